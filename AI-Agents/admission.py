@@ -0,0 +1,275 @@
+import os
+import json
+import math
+import time
+import bisect
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi.responses import JSONResponse
+from metrics import endpoint_var, ADMISSION_DECISIONS, ADMISSION_WAIT
+
+logger = logging.getLogger(__name__)
+
+# --- Priority Classes ---
+# Cheap, latency-sensitive calls must not queue behind report analysis and
+# consultation processing. Every managed request takes a slot; bulk work may
+# only hold a few of them, and a few slots are reserved for triage, so triage
+# always finds room even when interactive calls fill everything else.
+# Within a class, waiters are served earliest-deadline-first.
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") == "1"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+DEADLINE_HEADER = "x-deadline-ms"  # client budget in milliseconds from arrival
+
+PRIORITY_CLASSES: Dict[str, Dict[str, Any]] = {
+    "triage": {
+        "rank": 0,
+        "deadline": 10.0,
+        "max_concurrent": None,
+        "reserved": int(os.getenv("ADMISSION_TRIAGE_RESERVE", "4")),  # slots lower classes may not take
+        "service_estimate": 1.0,
+    },
+    "interactive": {"rank": 1, "deadline": 30.0, "max_concurrent": None, "service_estimate": 2.0},
+    "bulk": {
+        "rank": 2,
+        "deadline": 120.0,
+        "max_concurrent": int(os.getenv("ADMISSION_BULK_CONCURRENCY", "8")),
+        "service_estimate": 8.0,
+    },
+}
+
+# Route templates -> priority class; anything unlisted (health, metrics, job
+# polling, docs) bypasses admission control
+ENDPOINT_CLASSES: Dict[str, str] = {
+    "/api/v1/interview/initial-problem": "triage",
+    "/initial-problem": "triage",
+    "/api/v1/pre-diagnosis": "triage",
+    "/api/v1/interview/next-question": "interactive",
+    "/next-question": "interactive",
+    "/api/v1/interview/next-question/stream": "interactive",
+    "/next-question/stream": "interactive",
+    "/api/v1/interview/extract-entities": "interactive",
+    "/extract-entities": "interactive",
+    "/api/v1/interview/final-summary": "interactive",
+    "/final-summary": "interactive",
+    "/api/v1/agent/chat": "interactive",
+    "/ai/report-analyze": "bulk",
+    "/ai/report-analyze/batch": "bulk",
+    "/api/v1/consultation/process": "bulk",
+    "/api/v1/consultation/process/stream": "bulk",
+}
+
+
+def load_endpoint_classes() -> Dict[str, str]:
+    """ENDPOINT_CLASSES merged with ADMISSION_ENDPOINT_CLASSES (JSON), e.g. '{"/api/v1/agent/chat": "triage"}'"""
+    classes = dict(ENDPOINT_CLASSES)
+    raw = os.getenv("ADMISSION_ENDPOINT_CLASSES")
+    try:
+        if raw:
+            for endpoint, name in json.loads(raw).items():
+                if name not in PRIORITY_CLASSES:
+                    raise ValueError(f"unknown priority class '{name}' for {endpoint}")
+                classes[endpoint] = name
+    except Exception as e:
+        logger.error(f"Error loading ADMISSION_ENDPOINT_CLASSES, using defaults: {e}")
+        return dict(ENDPOINT_CLASSES)
+    return classes
+
+
+ENDPOINT_CLASSES = load_endpoint_classes()
+
+EWMA_ALPHA = 0.2
+
+
+class Shed(Exception):
+    """Request refused before doing any work"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+# --- Controller ---
+
+class AdmissionController:
+    """Priority slots with per-class caps, a bounded wait queue and deadline-based shedding"""
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENCY, max_queue: int = ADMISSION_MAX_QUEUE,
+                 classes: Optional[Dict[str, Dict[str, Any]]] = None, enabled: bool = ADMISSION_CONTROL):
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.classes = classes or PRIORITY_CLASSES
+        self.order = sorted(self.classes, key=lambda name: self.classes[name]["rank"])
+        self.active = {name: 0 for name in self.classes}
+        # Per class, sorted by (deadline, seq): earliest deadline first
+        self.waiting: Dict[str, List[Tuple[float, int, asyncio.Future]]] = {name: [] for name in self.classes}
+        # Moving average of how long a request of each class holds its slot
+        self.service = {name: float(cfg["service_estimate"]) for name, cfg in self.classes.items()}
+        self.shed = {name: 0 for name in self.classes}
+        self._seq = itertools.count()
+
+    def deadline(self, name: str, header: Optional[str] = None) -> float:
+        """Absolute (monotonic) deadline from the client's budget or the class default"""
+        budget = self.classes[name]["deadline"]
+        if header:
+            try:
+                budget = max(0.0, float(header) / 1000)
+            except ValueError:
+                pass
+        return time.monotonic() + budget
+
+    def _held_for_higher(self, name: str) -> int:
+        """Reserved slots of higher-priority classes that they are not using right now"""
+        rank = self.classes[name]["rank"]
+        return sum(
+            max(0, cfg.get("reserved", 0) - self.active[other])
+            for other, cfg in self.classes.items() if cfg["rank"] < rank
+        )
+
+    def _has_capacity(self, name: str) -> bool:
+        cap = self.classes[name].get("max_concurrent")
+        free = self.max_concurrent - sum(self.active.values()) - self._held_for_higher(name)
+        return free > 0 and (cap is None or self.active[name] < cap)
+
+    def _dispatch(self):
+        """Grant free slots to waiters, highest priority class first"""
+        for name in self.order:
+            queue = self.waiting[name]
+            while queue and self._has_capacity(name):
+                _, _, future = queue.pop(0)
+                if future.done():
+                    continue
+                self.active[name] += 1
+                future.set_result(None)
+
+    def estimate_wait(self, name: str) -> float:
+        """
+        Rough queueing delay: the queued work at this or higher priority plus
+        half a request still in flight, spread over the slots this class may use.
+        """
+        rank = self.classes[name]["rank"]
+        queued = sum(
+            len(self.waiting[other]) * self.service[other]
+            for other in self.order if self.classes[other]["rank"] <= rank
+        )
+        reserved = sum(cfg.get("reserved", 0) for cfg in self.classes.values() if cfg["rank"] < rank)
+        slots = self.classes[name].get("max_concurrent") or self.max_concurrent - reserved
+        return (queued + self.service[name] / 2) / max(1, slots)
+
+    def _remove(self, name: str, entry: Tuple[float, int, asyncio.Future]):
+        try:
+            self.waiting[name].remove(entry)
+        except ValueError:
+            pass
+
+    async def acquire(self, name: str, deadline: float) -> Tuple[str, float]:
+        """Wait for a slot; raises Shed when the queue is full or the deadline cannot be met"""
+        arrived = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        entry = (deadline, next(self._seq), future)
+        bisect.insort(self.waiting[name], entry)
+        self._dispatch()
+
+        if not future.done():
+            wait = self.estimate_wait(name)
+            if sum(len(q) for q in self.waiting.values()) > self.max_queue:
+                self._reject(name, entry, "shed_queue_full", wait)
+            if arrived + wait + self.service[name] > deadline:
+                self._reject(name, entry, "shed_deadline", wait)
+            try:
+                # Starting after deadline - service would only finish late
+                await asyncio.wait_for(asyncio.shield(future), timeout=max(0.0, deadline - self.service[name] - arrived))
+            except asyncio.TimeoutError:
+                if not future.done():
+                    self._reject(name, entry, "expired", self.estimate_wait(name))
+            except asyncio.CancelledError:
+                # Client went away while queued
+                if future.done() and not future.cancelled():
+                    self.active[name] -= 1
+                    self._dispatch()
+                else:
+                    future.cancel()
+                    self._remove(name, entry)
+                raise
+
+        started = time.monotonic()
+        ADMISSION_DECISIONS.labels(name, "admitted").inc()
+        ADMISSION_WAIT.labels(name).observe(started - arrived)
+        return name, started
+
+    def _reject(self, name: str, entry, outcome: str, retry_after: float):
+        entry[2].cancel()
+        self._remove(name, entry)
+        self.shed[name] += 1
+        ADMISSION_DECISIONS.labels(name, outcome).inc()
+        raise Shed(outcome, retry_after)
+
+    def release(self, ticket: Tuple[str, float]):
+        name, started = ticket
+        self.active[name] -= 1
+        self.service[name] += EWMA_ALPHA * ((time.monotonic() - started) - self.service[name])
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "classes": {
+                name: {
+                    "active": self.active[name],
+                    "waiting": len(self.waiting[name]),
+                    "max_concurrent": self.classes[name].get("max_concurrent"),
+                    "reserved": self.classes[name].get("reserved", 0),
+                    "default_deadline_s": self.classes[name]["deadline"],
+                    "service_estimate_s": round(self.service[name], 3),
+                    "shed": self.shed[name],
+                }
+                for name in self.order
+            },
+        }
+
+
+admission = AdmissionController()
+
+
+# --- Middleware ---
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware: holds the slot until the response body has been sent
+    (so streamed responses count), and answers 503 + Retry-After when shed.
+    Must sit inside the request-context middleware, which sets endpoint_var.
+    """
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        name = ENDPOINT_CLASSES.get(endpoint_var.get()) if scope["type"] == "http" else None
+        if name is None or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        try:
+            ticket = await self.controller.acquire(name, self.controller.deadline(name, headers.get(DEADLINE_HEADER)))
+        except Shed as e:
+            logger.warning(f"Shed {scope.get('path')} ({name}): {e.reason}, retry after {e.retry_after}s")
+            response = JSONResponse(
+                status_code=503,
+                content={"error": "Server busy", "reason": e.reason, "priority_class": name},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(ticket)
@@ -1,24 +1,118 @@
 import os
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+import io
+import json
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match
 from dotenv import load_dotenv
-from report_analyzer import process_report_file
-from consulatation_handler import process_consultation
-from agent_service import chat_with_agent
-from typing import Dict, Optional, List, Any
-from pydantic import BaseModel
-import uvicorn
+from jobs import job_queue, Job, PRIORITIES, QueueFullError, InvalidCallbackError
+from admission import admission, AdmissionMiddleware
+from quota import quota, QuotaMiddleware, may_read_usage
+from findings_store import findings_history, parse_report_date, series_trends
+from entity_ledger import ledgers
+from lab_parser import get_lab_reference
+from lazy_imports import LazyModule, LAZY_WARM_UP, warm_up, warm_up_state
+import tracing
+from metrics import (
+    configure_logging, new_request_id, render_metrics, stage,
+    request_id_var, endpoint_var, usage_var, REQUEST_DURATION
+)
+from typing import Dict, Optional, List, Any, Literal
+from pydantic import AliasChoices, BaseModel, Field
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 load_dotenv()
+configure_logging()
+logger = logging.getLogger("app")
+
+# Handler modules (LangChain, Groq, OCR, Motor) load on first use or during warm-up
+report_analyzer = LazyModule("report_analyzer")
+consulatation_handler = LazyModule("consulatation_handler")
+agent_service = LazyModule("agent_service")
+pre_diagnosis = LazyModule("pre_diagnosis")
+chat_diagnosis = LazyModule("chat_diagnosis")
+llm_router = LazyModule("llm_router")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Per worker: the exporter's thread and connections would not survive the
+    # fork if the pre-fork launcher (serve.py) set it up before forking
+    tracing.configure()
+    # asyncio.to_thread carries every blocking LLM, Whisper and OCR call; the
+    # default pool (cores + 4 threads) is far too small for I/O-bound waits
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=int(os.getenv("BLOCKING_THREADS", "64")), thread_name_prefix="blocking")
+    )
+    await job_queue.start()
+    warming = None
+    if LAZY_WARM_UP == "blocking":
+        await asyncio.to_thread(warm_up)
+    elif LAZY_WARM_UP == "background":
+        warming = asyncio.create_task(asyncio.to_thread(warm_up))
+    yield
+    if warming is not None:
+        await warming
+    # Requests have already drained; finish running jobs, then stray hedge calls
+    await job_queue.stop()
+    if llm_router.loaded:
+        await asyncio.to_thread(llm_router.router.drain, float(os.getenv("LLM_DRAIN_TIMEOUT", "30")))
+    tracing.shutdown()
 
 app = FastAPI(
     title="Telemedicine AI API",
     description="AI-powered medical services with prescription generation",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+# Added before request_context so it runs inside it (and sees endpoint_var)
+app.add_middleware(AdmissionMiddleware, controller=admission)
+# Outside admission: over-quota users are refused before they take a queue slot
+app.add_middleware(QuotaMiddleware, manager=quota)
+
+def route_label(request: Request) -> str:
+    """Route path template for metric labels (e.g. /api/v1/jobs/{job_id})"""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Assign a request id, expose it to logs and responses, and time the request"""
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    endpoint = route_label(request)
+    request_id_var.set(request_id)
+    endpoint_var.set(endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        with tracing.span(f"{request.method} {endpoint}", **{
+            "http.method": request.method,
+            "http.route": endpoint,
+            "request.id": request_id
+        }):
+            response = await call_next(request)
+            status = response.status_code
+            tracing.set_attributes(**{"http.status_code": status})
+    finally:
+        elapsed = time.perf_counter() - start
+        if endpoint != "/metrics":
+            REQUEST_DURATION.labels(endpoint, request.method, str(status)).observe(elapsed)
+        logger.info(f"{request.method} {request.url.path} {status} {elapsed * 1000:.1f}ms")
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+# Registered last so it is outermost: 429/503 answers from the quota and
+# admission middlewares still carry CORS headers instead of looking like
+# network errors to the browser
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
@@ -29,6 +123,7 @@ app.add_middleware(
 
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 MAX_FILE_SIZE = 25 * 1024 * 1024  
+MAX_BATCH_FILES = 10
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg', 'webm', 'm4a', 'flac'}
 
 def allowed_file(filename: str) -> bool:
@@ -37,6 +132,84 @@ def allowed_file(filename: str) -> bool:
 def get_file_extension(filename: str) -> str:
     return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
 
+def job_priority(priority: str) -> int:
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid priority. Allowed: {', '.join(PRIORITIES)}"
+        )
+    return PRIORITIES[priority]
+
+def report_day(report_date: Optional[str]) -> str:
+    try:
+        return parse_report_date(report_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def record_findings(report_meta: Dict[str, Any], analysis: Dict[str, Any]) -> int:
+    """Add a report's findings to the patient's lab history (when the upload names a patient)"""
+    if not report_meta.get("userId"):
+        return 0
+    return await findings_history.record(
+        report_meta["userId"], analysis["findings"], report_meta["reportDate"], source=report_meta["fileName"]
+    )
+
+async def submit_job(kind: str, params: Dict[str, Any], data: bytes, priority: str, callback_url: Optional[str]):
+    """
+    Queue a background job and return 202 with its id and status URL. The
+    job's LLM tokens are spent after this response, so the request's quota
+    charge moves to the job and is settled when it finishes.
+    """
+    charge = quota.current_charge()
+    try:
+        job = await job_queue.submit(kind, params, data, job_priority(priority), callback_url, quota=charge)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except InvalidCallbackError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    quota.defer()
+    return JSONResponse(content={
+        "success": True,
+        "jobId": job.id,
+        "status": job.status,
+        "statusUrl": f"/api/v1/jobs/{job.id}"
+    }, status_code=202)
+
+# --- Background job handlers ---
+
+async def run_report_job(job: Job) -> Dict:
+    upload = UploadFile(file=io.BytesIO(job.data), filename=job.params["reportMeta"]["fileName"])
+    result = await report_analyzer.process_report_file(upload, job.params["reportMeta"]["fileType"])
+    if "error" in result:
+        return result
+    return {
+        "success": True,
+        "message": "Report analyzed successfully.",
+        "reportMeta": job.params["reportMeta"],
+        "analysis": result["analysis"],
+        "findingsStored": await record_findings(job.params["reportMeta"], result["analysis"])
+    }
+
+async def run_consultation_job(job: Job) -> Dict:
+    upload = UploadFile(file=io.BytesIO(job.data), filename=job.params["filename"])
+    return await consulatation_handler.process_consultation(upload, job.params["patient_info"])
+
+def metered(handler):
+    """Count the tokens a job uses and settle them against the quota charge it took over"""
+    async def run(job: Job) -> Dict:
+        usage: Dict[str, int] = {}
+        token = usage_var.set(usage)
+        try:
+            return await handler(job)
+        finally:
+            usage_var.reset(token)
+            if job.quota:
+                await quota.settle_charge(job.quota, usage)
+    return run
+
+job_queue.register("report_analysis", metered(run_report_job))
+job_queue.register("consultation", metered(run_consultation_job))
+
 @app.get("/", tags=["Health"])
 async def root():
     return {
@@ -45,26 +218,102 @@ async def root():
         "version": "2.0.0",
         "endpoints": {
             "report_analysis": "/ai/report-analyze",
+            "batch_report_analysis": "/ai/report-analyze/batch",
             "consultation_processing": "/api/v1/consultation/process",
+            "consultation_stream": "/api/v1/consultation/process/stream",
             "pre_diagnosis": "/api/v1/pre-diagnosis",
             "agent_chat": "/api/v1/agent/chat",
-            "chat_diagnosis": "/initial-problem, /next-question, /final-summary",
+            "chat_diagnosis": "/api/v1/interview/{initial-problem, next-question, next-question/stream, extract-entities, final-summary}",
             "health": "/health",
+            "metrics": "/metrics",
+            "llm_routes": "/api/v1/llm/routes",
+            "admission": "/api/v1/admission",
+            "quota": "/api/v1/quota/{user_id}",
+            "findings": "/api/v1/findings/{user_id}",
+            "jobs": "/api/v1/jobs/{job_id}, /api/v1/jobs/metrics",
             "docs": "/docs"
         }
     }
 
 @app.get("/health", tags=["Health"])
 async def health_check():
-    return {"status": "healthy", "service": "Telemedicine AI"}
+    return {"status": "healthy", "service": "Telemedicine AI", "warm_up": warm_up_state()}
+
+@app.get("/metrics", tags=["Health"])
+async def metrics():
+    """Prometheus metrics: request and per-stage latency histograms, LLM token counts"""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/api/v1/llm/routes", tags=["Health"])
+async def llm_routes():
+    """Per-task LLM backend routing and latency/success stats"""
+    return {"routes": llm_router.router.routes, "stats": llm_router.router.report()}
+
+@app.get("/api/v1/admission", tags=["Health"])
+async def admission_stats():
+    """Admission control: active and queued requests, service estimates and shed counts per priority class"""
+    return admission.stats()
+
+@app.get("/api/v1/quota/{user_id}", tags=["Health"])
+async def quota_usage(user_id: str, request: Request):
+    """
+    Per-user sliding-window usage against limits and cumulative request/token
+    totals for billing. Readable by that user (X-User-ID from a trusted proxy)
+    or with the QUOTA_ADMIN_TOKEN bearer token.
+    """
+    if not may_read_usage(request.scope, user_id):
+        raise HTTPException(status_code=403, detail="Not allowed to read this user's usage")
+    return await quota.usage(user_id)
+
+@app.get("/api/v1/findings/{user_id}", tags=["AI Analysis"])
+async def findings_history_endpoint(
+    user_id: str,
+    parameter: Optional[List[str]] = Query(None),
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """
+    Stored lab results for a patient: per-analyte series (values in the
+    analyte's canonical unit) and trends, optionally restricted to
+    **parameter** names ("HbA1c", "LDL") and an inclusive **since**/**until** day range.
+    """
+    if not findings_history.enabled:
+        raise HTTPException(status_code=503, detail="Findings history is disabled")
+    analytes = None
+    if parameter:
+        reference = get_lab_reference()
+        analytes = [reference.resolve(name) or f"other:{name.strip().lower()}" for name in parameter]
+    since = report_day(since) if since else None
+    until = report_day(until) if until else None
+    series = await findings_history.series(user_id, analytes, since, until)
+    return {
+        "userId": user_id,
+        "trends": series_trends(series),
+        "series": series
+    }
 
 @app.post("/ai/report-analyze", tags=["AI Analysis"])
 async def ai_report_analyze(
     file: UploadFile = File(...),
     document_type: str = Form(...),
-    notes: Optional[str] = Form(None)
+    notes: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None),
+    report_date: Optional[str] = Form(None),
+    async_mode: bool = Form(False),
+    priority: str = Form("normal"),
+    callback_url: Optional[str] = Form(None)
 ) -> Dict:
-    """Analyze medical report (PDF or image)"""
+    """
+    Analyze medical report (PDF or image)
+
+    With **user_id** set, the findings are added to the patient's lab history
+    under **report_date** (YYYY-MM-DD, default today) for trend queries.
+
+    With **async_mode** set, returns a job id immediately; poll
+    /api/v1/jobs/{job_id} or pass **callback_url** (https, public or allowlisted
+    host) to have the result pushed. Finished jobs are kept for JOB_RETENTION.
+    """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file selected")
 
@@ -74,34 +323,39 @@ async def ai_report_analyze(
             detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
         )
 
-    contents = await file.read()
+    with stage("upload_read"):
+        contents = await file.read()
     file_size = len(contents)
     if file_size > MAX_FILE_SIZE:
         raise HTTPException(status_code=400, detail=f"File too large (max 25MB)")
     await file.seek(0)
 
-    try:
-        file_type = get_file_extension(file.filename)
-        uploaded_at = datetime.utcnow().isoformat()
+    file_type = get_file_extension(file.filename)
+    report_meta = {
+        "fileName": file.filename,
+        "fileType": file_type,
+        "fileSize": file_size,
+        "documentType": document_type,
+        "notes": notes,
+        "userId": user_id,
+        "reportDate": report_day(report_date),
+        "uploadedAt": datetime.utcnow().isoformat()
+    }
 
-        result = await process_report_file(file, file_type)
+    if async_mode:
+        return await submit_job("report_analysis", {"reportMeta": report_meta}, contents, priority, callback_url)
+
+    try:
+        result = await report_analyzer.process_report_file(file, file_type)
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
 
-        report_meta = {
-            "fileName": file.filename,
-            "fileType": file_type,
-            "fileSize": file_size,
-            "documentType": document_type,
-            "notes": notes,
-            "uploadedAt": uploaded_at
-        }
-
         response = {
             "success": True,
             "message": "Report analyzed successfully.",
             "reportMeta": report_meta,
-            "analysis": result["analysis"]
+            "analysis": result["analysis"],
+            "findingsStored": await record_findings(report_meta, result["analysis"])
         }
         return JSONResponse(content=response, status_code=200)
 
@@ -110,26 +364,75 @@ async def ai_report_analyze(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
-@app.post("/api/v1/consultation/process", tags=["Consultation"])
-async def process_consultation_endpoint(
-    file: UploadFile = File(...),
-    patient_data: str = Form(...)  # JSON string of patient data
+@app.post("/ai/report-analyze/batch", tags=["AI Analysis"])
+async def ai_report_analyze_batch(
+    files: List[UploadFile] = File(...),
+    document_type: str = Form(...),
+    notes: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None),
+    report_date: Optional[str] = Form(None)
 ) -> Dict:
     """
-    Process consultation audio and generate prescription
-    
-    - **file**: Audio file (MP3, WAV, etc.)
-    - **patient_data**: JSON string containing patient's complete health data
-    
-    Expected patient_data format:
-    {
-        "basicHealthProfile": {...},
-        "medicalHistory": {...},
-        "currentHealthStatus": {...}
-    }
-    
-    Returns: Transcription, consultation summary, and generated prescription
+    Analyze several medical reports (PDF or image) in one request.
+
+    Text is extracted from all files in parallel and the reports are packed
+    into as few LLM calls as fit the context budget. Returns per-file analyses
+    plus a merged findings view. With **user_id** set, every analyzed report's
+    findings are added to the patient's lab history under **report_date**.
     """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files selected")
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files (max {MAX_BATCH_FILES})")
+
+    file_types = []
+    for file in files:
+        if not file.filename or not allowed_file(file.filename):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file type for '{file.filename}'. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+            )
+        if file.size is not None and file.size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=400, detail=f"File '{file.filename}' too large (max 25MB)")
+        file_types.append(get_file_extension(file.filename))
+    taken_on = report_day(report_date)
+
+    try:
+        uploaded_at = datetime.utcnow().isoformat()
+        result = await report_analyzer.process_report_files(files, file_types)
+        if not result["success"]:
+            raise HTTPException(status_code=500, detail="Failed to analyze any of the uploaded reports")
+
+        for file, item in zip(files, result["reports"]):
+            item["reportMeta"] = {
+                "fileName": file.filename,
+                "fileType": item.pop("fileType"),
+                "fileSize": file.size,
+                "documentType": document_type,
+                "notes": notes,
+                "userId": user_id,
+                "reportDate": taken_on,
+                "uploadedAt": uploaded_at
+            }
+            if "analysis" in item:
+                item["findingsStored"] = await record_findings(item["reportMeta"], item["analysis"])
+
+        response = {
+            "success": True,
+            "message": f"Analyzed {sum('analysis' in r for r in result['reports'])} of {len(files)} reports.",
+            "reports": result["reports"],
+            "merged": result["merged"],
+            "batches": result["batches"]
+        }
+        return JSONResponse(content=response, status_code=200)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+
+async def read_consultation_upload(file: UploadFile, patient_data: str) -> tuple[bytes, Dict[str, Any]]:
+    """Validate a consultation upload; returns the audio bytes (file rewound) and the parsed patient data"""
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file selected")
     
@@ -140,7 +443,8 @@ async def process_consultation_endpoint(
             detail=f"Invalid audio format. Allowed: {', '.join(ALLOWED_AUDIO_EXTENSIONS)}"
         )
     
-    contents = await file.read()
+    with stage("upload_read"):
+        contents = await file.read()
     if len(contents) > MAX_FILE_SIZE:
         raise HTTPException(status_code=400, detail="File too large (max 25MB)")
     
@@ -148,13 +452,51 @@ async def process_consultation_endpoint(
     
     # Parse patient data
     try:
-        import json
         patient_info = json.loads(patient_data)
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid patient_data JSON format")
+    return contents, patient_info
+
+async def wait_for_disconnect(request: Request):
+    """Returns once the client has gone away (the request body is already consumed)"""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+@app.post("/api/v1/consultation/process", tags=["Consultation"])
+async def process_consultation_endpoint(
+    file: UploadFile = File(...),
+    patient_data: str = Form(...),  # JSON string of patient data
+    async_mode: bool = Form(False),
+    priority: str = Form("normal"),
+    callback_url: Optional[str] = Form(None)
+) -> Dict:
+    """
+    Process consultation audio and generate prescription
+    
+    - **file**: Audio file (MP3, WAV, etc.)
+    - **patient_data**: JSON string containing patient's complete health data
+    
+    Expected patient_data format:
+    {
+        "basicHealthProfile": {...},
+        "medicalHistory": {...},
+        "currentHealthStatus": {...}
+    }
+    
+    Returns: Transcription, consultation summary, and generated prescription
+
+    With **async_mode** set, returns a job id immediately instead; poll
+    /api/v1/jobs/{job_id} or pass **callback_url** (https, public or allowlisted
+    host) to have the result pushed. Finished jobs are kept for JOB_RETENTION.
+    """
+    contents, patient_info = await read_consultation_upload(file, patient_data)
+
+    if async_mode:
+        params = {"filename": file.filename, "patient_info": patient_info}
+        return await submit_job("consultation", params, contents, priority, callback_url)
     
     try:
-        result = await process_consultation(file, patient_info)
+        result = await consulatation_handler.process_consultation(file, patient_info)
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
         return JSONResponse(content=result, status_code=200)
@@ -163,12 +505,60 @@ async def process_consultation_endpoint(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
     
+@app.post("/api/v1/consultation/process/stream", tags=["Consultation"])
+async def process_consultation_stream_endpoint(
+    request: Request,
+    file: UploadFile = File(...),
+    patient_data: str = Form(...)
+):
+    """
+    Server-sent events for consultation processing: `transcript`, `summary`
+    and `prescription` events as each stage finishes, then `done` (or an
+    `error` event naming the failed stage). Every event has `timing` with the
+    stage duration and the elapsed time. Closing the connection cancels the
+    remaining stages, including an LLM call in flight.
+    """
+    contents, patient_info = await read_consultation_upload(file, patient_data)
+    # The upload is closed once the endpoint returns, before the body streams
+    upload = UploadFile(file=io.BytesIO(contents), filename=file.filename)
+
+    async def events():
+        stages = consulatation_handler.consultation_stages(upload, patient_info, stream=True)
+        disconnected = asyncio.create_task(wait_for_disconnect(request))
+        next_event = None
+        try:
+            while True:
+                next_event = asyncio.ensure_future(anext(stages))
+                await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_event.done():
+                    logger.info("Consultation stream closed by the client; remaining stages cancelled")
+                    return
+                try:
+                    event = next_event.result()
+                except StopAsyncIteration:
+                    return
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            # Also reached when the server cancels the response on disconnect;
+            # cancelling the pending step raises inside the running stage
+            disconnected.cancel()
+            if next_event is not None and not next_event.done():
+                next_event.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.post("/api/v1/pre-diagnosis", tags=["Pre-Diagnosis"])
 async def pre_diagnosis_endpoint(
     symptoms: Optional[str] = Form(None),
-    audio: Optional[UploadFile] = File(None)
+    audio: Optional[UploadFile] = File(None),
+    enrich: bool = Form(True)
 ) -> Dict:
-    """Pre-diagnosis based on symptoms (text or audio)"""
+    """
+    Pre-diagnosis based on symptoms (text or audio)
+
+    Local triage flags red-flag symptoms immediately; LLM enrichment is added
+    when it completes within the latency budget (set **enrich** false to skip it).
+    """
     if not symptoms and not audio:
         raise HTTPException(
             status_code=400,
@@ -183,15 +573,16 @@ async def pre_diagnosis_endpoint(
                 detail=f"Invalid audio format. Allowed: {', '.join(ALLOWED_AUDIO_EXTENSIONS)}"
             )
         
-        contents = await audio.read()
+        with stage("upload_read"):
+            contents = await audio.read()
         if len(contents) > MAX_FILE_SIZE:
             raise HTTPException(status_code=400, detail="File too large (max 25MB)")
         
         await audio.seek(0)
     
     try:
-        from pre_diagnosis import process_pre_diagnosis
-        result = await process_pre_diagnosis(symptoms_text=symptoms, audio_file=audio)
+        audio_file = audio if audio and audio.filename else None
+        result = await pre_diagnosis.process_pre_diagnosis(symptoms_text=symptoms, audio_file=audio_file, enrich=enrich)
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
         return JSONResponse(content=result, status_code=200)
@@ -200,6 +591,19 @@ async def pre_diagnosis_endpoint(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
+@app.get("/api/v1/jobs/metrics", tags=["Jobs"])
+async def job_metrics():
+    """Queue depth, running jobs and completion counts"""
+    return job_queue.metrics()
+
+@app.get("/api/v1/jobs/{job_id}", tags=["Jobs"])
+async def get_job(job_id: str):
+    """Poll the status and result of a background job"""
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.public()
+
 class ChatRequest(BaseModel):
     userId: str
     message: str
@@ -211,7 +615,7 @@ async def agent_chat_endpoint(request: ChatRequest):
     if not request.userId:
         raise HTTPException(status_code=400, detail="userId is required")
         
-    result = await chat_with_agent(request.userId, request.message, request.history)
+    result = await agent_service.chat_with_agent(request.userId, request.message, request.history)
     
     if "error" in result:
         if result["error"] == "Patient data not found":
@@ -220,55 +624,104 @@ async def agent_chat_endpoint(request: ChatRequest):
         
     return result
 
-from chat_diagnosis import (
-    analyze_initial_problem,
-    generate_next_question,
-    extract_entities_from_text,
-    generate_final_summary
-)
+
+InterviewBackend = Literal["structured", "gemini"]  # defaults to INTERVIEW_BACKEND
+EntityBackend = Literal["llm", "ner"]               # defaults to ENTITY_BACKEND
 
 class InitialProblemRequest(BaseModel):
-    problem_text: str
+    problem_text: str = Field(validation_alias=AliasChoices("problem_text", "problem"))
+    session_id: Optional[str] = None
+    backend: Optional[Literal["structured", "ner"]] = None  # "ner": keyword extraction only
 
 class NextQuestionRequest(BaseModel):
     history: List[Dict[str, Any]]
     patient_info: Dict[str, Any]
+    session_id: Optional[str] = None
+    context: Optional[Literal["transcript", "ledger"]] = None  # defaults to INTERVIEW_CONTEXT
+    backend: Optional[InterviewBackend] = None
+    entities: Optional[List[Dict[str, Any]]] = None  # keywords for the gemini backend
 
 class ExtractEntitiesRequest(BaseModel):
     text: str
+    session_id: Optional[str] = None
+    turn: Optional[int] = None  # index of the message in the interview; a retried turn is merged once
+    backend: Optional[EntityBackend] = None
 
 class FinalSummaryRequest(BaseModel):
     history: List[Dict[str, Any]]
     patient_info: Dict[str, Any]
+    session_id: Optional[str] = None
+    context: Optional[Literal["transcript", "ledger"]] = None
+    backend: Optional[InterviewBackend] = None
+    entities: Optional[List[Dict[str, Any]]] = None
+    reports_uploaded: bool = False
+
+# Interview routes live under /api/v1/interview; the unversioned paths the
+# frontend (and the retired Flask server) used stay as deprecated aliases.
 
-@app.post("/initial-problem", tags=["Chat Diagnosis"])
+@app.post("/api/v1/interview/initial-problem", tags=["Chat Diagnosis"])
+@app.post("/initial-problem", tags=["Chat Diagnosis"], deprecated=True)
 async def initial_problem_endpoint(request: InitialProblemRequest):
-    result = await analyze_initial_problem(request.problem_text)
+    result = await chat_diagnosis.analyze_initial_problem(request.problem_text, request.backend, request.session_id)
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
     return result
 
-@app.post("/next-question", tags=["Chat Diagnosis"])
+@app.post("/api/v1/interview/next-question", tags=["Chat Diagnosis"])
+@app.post("/next-question", tags=["Chat Diagnosis"], deprecated=True)
 async def next_question_endpoint(request: NextQuestionRequest):
-    result = await generate_next_question(request.history, request.patient_info)
+    result = await chat_diagnosis.generate_next_question(
+        request.history, request.patient_info, request.session_id, request.context,
+        request.backend, request.entities
+    )
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
     return result
 
-@app.post("/extract-entities", tags=["Chat Diagnosis"])
+@app.post("/api/v1/interview/next-question/stream", tags=["Chat Diagnosis"])
+@app.post("/next-question/stream", tags=["Chat Diagnosis"], deprecated=True)
+async def next_question_stream_endpoint(request: NextQuestionRequest):
+    """
+    Server-sent events: a `field` event per NextQuestion field as soon as it is
+    complete (question first, then options), followed by a `result` event.
+    """
+    if (request.backend or chat_diagnosis.INTERVIEW_BACKEND) != "structured":
+        raise HTTPException(status_code=400, detail="Streaming is only available for the structured backend")
+
+    async def events():
+        async for event in chat_diagnosis.stream_next_question(request.history, request.patient_info, request.session_id, request.context):
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/api/v1/interview/extract-entities", tags=["Chat Diagnosis"])
+@app.post("/extract-entities", tags=["Chat Diagnosis"], deprecated=True)
 async def extract_entities_endpoint(request: ExtractEntitiesRequest):
-    result = await extract_entities_from_text(request.text)
+    result = await chat_diagnosis.extract_entities_from_text(request.text, request.session_id, request.backend,
+                                                             request.turn)
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
     return result
 
-@app.post("/final-summary", tags=["Chat Diagnosis"])
+@app.post("/api/v1/interview/final-summary", tags=["Chat Diagnosis"])
+@app.post("/final-summary", tags=["Chat Diagnosis"], deprecated=True)
 async def final_summary_endpoint(request: FinalSummaryRequest):
-    result = await generate_final_summary(request.history, request.patient_info)
+    result = await chat_diagnosis.generate_final_summary(
+        request.history, request.patient_info, request.session_id, request.context,
+        request.backend, request.entities, request.reports_uploaded
+    )
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
     return result
 
+@app.get("/api/v1/interview/{session_id}/entities", tags=["Chat Diagnosis"])
+async def interview_entities(session_id: str):
+    """Merged entity ledger for an interview session"""
+    ledger = await ledgers.get(session_id)
+    if ledger is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return ledger.public()
+
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
     return JSONResponse(status_code=404, content={"error": "Endpoint not found"})
@@ -278,4 +731,5 @@ async def internal_error_handler(request, exc):
     return JSONResponse(status_code=500, content={"error": "Internal server error"})
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
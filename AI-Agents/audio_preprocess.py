@@ -0,0 +1,207 @@
+import os
+import io
+import time
+import shutil
+import hashlib
+import asyncio
+import logging
+import contextvars
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from metrics import stage, AUDIO_BYTES
+
+logger = logging.getLogger(__name__)
+
+# --- Audio Preprocessing ---
+# Browser recordings arrive as 44.1/48kHz stereo WAV or FLAC, while Whisper
+# resamples everything to 16kHz mono anyway, so most of those upload bytes buy
+# nothing. Recordings are downmixed, resampled, trimmed of leading/trailing
+# silence and re-encoded before upload. Decoding and encoding shell out to
+# ffmpeg through pydub; the work runs in a small thread pool so it never
+# blocks the event loop.
+
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") == "1"
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
+AUDIO_UPLOAD_FORMAT = os.getenv("AUDIO_UPLOAD_FORMAT", "ogg")
+AUDIO_UPLOAD_CODEC = os.getenv("AUDIO_UPLOAD_CODEC", "libopus")
+AUDIO_UPLOAD_BITRATE = os.getenv("AUDIO_UPLOAD_BITRATE", "32k")
+AUDIO_SILENCE_THRESHOLD = float(os.getenv("AUDIO_SILENCE_THRESHOLD", "-45"))  # dBFS
+AUDIO_SILENCE_PAD_MS = int(os.getenv("AUDIO_SILENCE_PAD_MS", "250"))
+AUDIO_PASSTHROUGH_MAX_BYTES = int(os.getenv("AUDIO_PASSTHROUGH_MAX_BYTES", str(4 * 1024 * 1024)))
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "2"))
+
+# Already compressed speech codecs: re-encoding small files only adds latency,
+# so they are uploaded as received (but still decoded for the fingerprint)
+COMPACT_FORMATS = {"ogg", "opus", "webm", "mp3", "m4a"}
+
+_executor = ThreadPoolExecutor(max_workers=AUDIO_WORKERS, thread_name_prefix="audio")
+
+
+@lru_cache(maxsize=1)
+def encoder_available() -> bool:
+    """ffmpeg (or avconv) is needed for every format except WAV"""
+    return bool(shutil.which("ffmpeg") or shutil.which("avconv"))
+
+
+def _extension(filename: str) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+
+
+def _speech_span(segment) -> Optional[Tuple[int, int]]:
+    """(start, end) ms between leading and trailing silence; None when there is nothing to trim"""
+    from pydub.silence import detect_leading_silence
+
+    if len(segment) == 0 or segment.dBFS == float("-inf"):
+        return None
+    # Quiet recordings: keep the threshold well below the speech level (whole
+    # dB, so a few extra tail samples in another container cannot shift it)
+    threshold = min(AUDIO_SILENCE_THRESHOLD, round(segment.dBFS) - 16)
+    lead = detect_leading_silence(segment, silence_threshold=threshold, chunk_size=10)
+    if lead >= len(segment):
+        return None
+    # Walk back on a 10ms grid anchored at the speech start rather than at the
+    # end of the file, so the cut depends on the audio and not on how many
+    # samples of tail the container happened to keep
+    end = lead + (len(segment) - lead) // 10 * 10
+    while end - 10 > lead and segment[end - 10:end].dBFS < threshold:
+        end -= 10
+    return lead, end
+
+
+def _trim_silence(segment) -> Tuple[Any, int, Any]:
+    """
+    Cut leading/trailing silence, keeping a short pad. Returns (segment, ms
+    removed, speech): speech is the unpadded span the fingerprint hashes.
+    """
+    span = _speech_span(segment)
+    if span is None:
+        return segment, 0, segment
+    start = max(0, span[0] - AUDIO_SILENCE_PAD_MS)
+    end = min(len(segment), span[1] + AUDIO_SILENCE_PAD_MS)
+    return segment[start:end], start + len(segment) - end, segment[span[0]:span[1]]
+
+
+def _encode(segment) -> Tuple[bytes, str]:
+    """Compact codec when ffmpeg is available, else 16-bit PCM WAV (pure Python)"""
+    buffer = io.BytesIO()
+    if encoder_available():
+        try:
+            segment.export(buffer, format=AUDIO_UPLOAD_FORMAT, codec=AUDIO_UPLOAD_CODEC,
+                           bitrate=AUDIO_UPLOAD_BITRATE)
+            return buffer.getvalue(), AUDIO_UPLOAD_FORMAT
+        except Exception as e:
+            logger.warning(f"Encoding to {AUDIO_UPLOAD_FORMAT}/{AUDIO_UPLOAD_CODEC} failed ({e}); using WAV")
+            buffer = io.BytesIO()
+    segment.export(buffer, format="wav")
+    return buffer.getvalue(), "wav"
+
+
+def fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_audio(data: bytes, filename: str) -> Tuple[Optional[Any], Dict[str, Any]]:
+    """
+    Decode, downmix, resample and trim. Returns (segment, info); segment is
+    None when the original should be uploaded as is (compact passthrough or
+    undecodable). info["fingerprint"] hashes the normalized PCM of the speech
+    span, so the same recording matches regardless of container, channel
+    layout or how much silent tail the container kept.
+    Compact uploads are decoded for the fingerprint only; without ffmpeg they
+    cannot be decoded and fall back to a hash of the bytes.
+    """
+    start = time.perf_counter()
+    ext = _extension(filename)
+    info: Dict[str, Any] = {"input_bytes": len(data), "input_format": ext}
+
+    passthrough = ext in COMPACT_FORMATS and len(data) <= AUDIO_PASSTHROUGH_MAX_BYTES
+    if passthrough and not encoder_available():
+        info.update(action="passthrough", fingerprint=f"raw:{fingerprint(data)}")
+        return None, info
+
+    with stage("audio_preprocess"):
+        from pydub import AudioSegment
+        try:
+            segment = AudioSegment.from_file(io.BytesIO(data), format=ext or None)
+        except Exception as e:
+            logger.warning(f"Could not decode {filename} ({e}); uploading as received")
+            info.update(action="undecodable", fingerprint=f"raw:{fingerprint(data)}")
+            return None, info
+
+        duration_ms = len(segment)
+        segment = segment.set_channels(1).set_frame_rate(AUDIO_SAMPLE_RATE).set_sample_width(2)
+        segment, trimmed_ms, speech = _trim_silence(segment)
+        info.update(
+            fingerprint=f"pcm:{fingerprint(speech.raw_data)}",
+            duration_s=round(duration_ms / 1000, 2),
+            trimmed_s=round(trimmed_ms / 1000, 2),
+            normalize_ms=round((time.perf_counter() - start) * 1000, 1)
+        )
+    if passthrough:
+        info["action"] = "passthrough"
+        return None, info
+    return segment, info
+
+
+def encode_audio(data: bytes, filename: str, segment, info: Dict[str, Any]) -> Tuple[bytes, str, Dict[str, Any]]:
+    """Encode a normalized segment for upload; the original wins if it is smaller"""
+    start = time.perf_counter()
+    payload, name = data, filename
+    if segment is not None:
+        with stage("audio_preprocess"):
+            encoded, fmt = _encode(segment)
+        if len(encoded) < len(data):
+            stem = filename.rsplit(".", 1)[0] if "." in filename else filename or "audio"
+            payload, name = encoded, f"{stem}.{fmt}"
+            info.update(action="transcoded", output_format=fmt)
+        else:
+            info["action"] = "passthrough"
+    info.update(
+        output_bytes=len(payload),
+        latency_ms=round(info.get("normalize_ms", 0) + (time.perf_counter() - start) * 1000, 1)
+    )
+    AUDIO_BYTES.labels("received", info["action"]).inc(len(data))
+    AUDIO_BYTES.labels("uploaded", info["action"]).inc(len(payload))
+    return payload, name, info
+
+
+def preprocess_audio(data: bytes, filename: str) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Normalize a recording for Whisper upload. Returns (bytes, filename, info);
+    on passthrough the original bytes and filename come back unchanged.
+    """
+    segment, info = normalize_audio(data, filename)
+    return encode_audio(data, filename, segment, info)
+
+
+async def _in_pool(fn, *args):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, context.run, fn, *args)
+
+
+async def prepare_audio(data: bytes, filename: str,
+                        lookup: Optional[Callable[[str], Awaitable[Any]]] = None) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Run preprocess_audio in the audio pool; on any failure upload the original.
+    `lookup` is awaited with the fingerprint before encoding; a non-None result
+    is returned as info["cached"] and encoding is skipped (empty payload).
+    """
+    raw = {"input_bytes": len(data), "output_bytes": len(data), "fingerprint": f"raw:{fingerprint(data)}"}
+    try:
+        if AUDIO_PREPROCESS:
+            segment, info = await _in_pool(normalize_audio, data, filename)
+        else:
+            segment, info = None, {**raw, "action": "disabled"}
+        if lookup is not None:
+            cached = await lookup(info["fingerprint"])
+            if cached is not None:
+                info.update(action="cached", cached=cached)
+                return b"", filename, info
+        if not AUDIO_PREPROCESS:
+            return data, filename, info
+        return await _in_pool(encode_audio, data, filename, segment, info)
+    except Exception as e:
+        logger.error(f"Error in prepare_audio: {e}")
+        return data, filename, {**raw, "action": "failed"}
@@ -0,0 +1,121 @@
+"""
+Mixed-load benchmark for admission control.
+
+Keeps a pool of bulk clients saturating /ai/report-analyze and
+/api/v1/consultation/process while triage probes hit
+/api/v1/interview/initial-problem at a steady rate, all in-process with fake
+backends. The fake LLM provider accepts a limited number of concurrent calls
+(--llm-capacity), standing in for provider rate limits: without admission
+control triage calls queue behind bulk work there. Runs three phases and reports triage p50/p95/p99 for each, plus
+completed, shed (503) and median latency of the bulk requests:
+
+    baseline     triage probes alone
+    mixed/off    bulk saturation, admission control disabled
+    mixed/on     bulk saturation, admission control enabled
+
+    python benchmarks/bench_admission.py
+    python benchmarks/bench_admission.py --bulk-clients 48 --duration 20
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from collections import Counter
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+from run_load import consultation, report_analysis, percentile
+
+TRIAGE_BODY = {"problem_text": "Sudden chest tightness and shortness of breath for an hour"}
+
+
+async def probe_triage(client, rate: float, stop: asyncio.Event, latencies: List[float], outcomes: Counter):
+    async def one():
+        start = time.perf_counter()
+        r = await client.post("/api/v1/interview/initial-problem", json=TRIAGE_BODY)
+        outcomes[r.status_code] += 1
+        if r.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    while not stop.is_set():
+        tasks.append(asyncio.create_task(one()))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+
+
+async def bulk_client(client, index: int, stop: asyncio.Event, latencies: List[float], outcomes: Counter):
+    action = consultation if index % 2 else report_analysis
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await action(client)
+            latencies.append(time.perf_counter() - start)
+            outcomes["ok"] += 1
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            outcomes[status or type(e).__name__] += 1
+            if status == 503:
+                retry_after = float(e.response.headers.get("Retry-After", "1"))
+                await asyncio.sleep(min(retry_after, 2.0))
+
+
+async def phase(app, args, bulk_clients: int) -> Dict:
+    import httpx
+
+    stop = asyncio.Event()
+    triage, bulk = [], []
+    triage_outcomes, bulk_outcomes = Counter(), Counter()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        workers = [asyncio.create_task(bulk_client(client, i, stop, bulk, bulk_outcomes)) for i in range(bulk_clients)]
+        await asyncio.sleep(args.warmup if bulk_clients else 0)
+        probes = asyncio.create_task(probe_triage(client, args.triage_rate, stop, triage, triage_outcomes))
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(probes, *workers)
+    return {"triage": triage, "triage_outcomes": triage_outcomes, "bulk": bulk, "bulk_outcomes": bulk_outcomes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bulk-clients", type=int, default=32, help="Concurrent bulk request loops")
+    parser.add_argument("--triage-rate", type=float, default=4.0, help="Triage requests per second")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of triage probing per phase")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds of bulk load before probing")
+    parser.add_argument("--llm-capacity", type=int, default=12, help="Concurrent calls the fake LLM provider serves")
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.3")
+    parser.add_argument("--whisper-latency", default="lognormal:1.5,0.3")
+    args = parser.parse_args()
+
+    fakes.install(llm=args.llm_latency, whisper=args.whisper_latency, mongo="const:0.01",
+                  extract="lognormal:0.15,0.3", llm_capacity=args.llm_capacity)
+    logging.disable(logging.WARNING)
+    from app import app
+    from admission import admission
+
+    print(f"bulk clients {args.bulk_clients}, LLM capacity {args.llm_capacity}, triage {args.triage_rate}/s for {args.duration:.0f}s per phase, "
+          f"admission max_concurrent={admission.max_concurrent}, "
+          f"bulk cap={admission.classes['bulk']['max_concurrent']}\n")
+    header = (f"{'phase':<12}{'triage p50':>11}{'p95':>8}{'p99':>8}{'triage 503':>11}"
+              f"{'bulk ok':>9}{'bulk 503':>10}{'bulk p50':>10}")
+    print(header)
+    print("-" * len(header))
+    for label, bulk_clients, enabled in [("baseline", 0, True), ("mixed/off", args.bulk_clients, False),
+                                         ("mixed/on", args.bulk_clients, True)]:
+        admission.enabled = enabled
+        result = asyncio.run(phase(app, args, bulk_clients))
+        triage = result["triage"]
+        print(f"{label:<12}{percentile(triage, 0.5):>10.2f}s{percentile(triage, 0.95):>7.2f}s"
+              f"{percentile(triage, 0.99):>7.2f}s{result['triage_outcomes'][503]:>11}"
+              f"{result['bulk_outcomes']['ok']:>9}{result['bulk_outcomes'][503]:>10}"
+              f"{percentile(result['bulk'], 0.5):>9.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Measure the audio preprocessing stage in front of Whisper.
+
+Synthesizes browser-style recordings (44.1kHz stereo 16-bit WAV with leading
+and trailing silence and a low noise floor), then reports per recording:
+bytes received vs uploaded, preprocessing time, and end-to-end transcription
+latency through consulatation_handler.transcribe_audio with a fake Whisper
+whose latency is upload time over a simulated uplink plus a per-second
+decoding cost.
+
+Fidelity: the recordings carry a message in a tone alphabet (one pure tone
+per character). The fake transcriber decodes tones with the Goertzel
+algorithm, so any damage done by downmixing, resampling, trimming or the
+codec shows up as character errors against the original message.
+
+    python benchmarks/bench_audio_preprocess.py
+    python benchmarks/bench_audio_preprocess.py --seconds 30 120 --uplink-mbps 5
+"""
+import os
+import io
+import sys
+import math
+import time
+import wave
+import random
+import asyncio
+import argparse
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi import UploadFile
+
+import consulatation_handler
+import audio_preprocess
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz "
+BASE_HZ, STEP_HZ = 400.0, 110.0  # 400..3260Hz, inside the 8kHz band of 16kHz audio
+SYMBOL_MS = 80
+MESSAGE = "patient reports fever and sore throat for three days with mild dry cough at night"
+
+
+def tone_hz(char: str) -> float:
+    return BASE_HZ + STEP_HZ * ALPHABET.index(char)
+
+
+# --- Synthetic recordings ---
+
+def synthesize(seconds: float, rate: int = 44100, lead_s: float = 2.0, tail_s: float = 3.0,
+               seed: int = 0) -> bytes:
+    """Stereo WAV: silence, the tone message repeated to fill `seconds`, silence"""
+    rng = random.Random(seed)
+    symbol = int(rate * SYMBOL_MS / 1000)
+    per_message = len(MESSAGE) * symbol
+    repeats = max(1, int(seconds * rate) // per_message)
+    samples = array("h")
+
+    def noise():
+        return int(rng.gauss(0, 60))
+
+    samples.extend(noise() for _ in range(int(lead_s * rate) * 2))
+    for _ in range(repeats):
+        for char in MESSAGE:
+            step = 2 * math.pi * tone_hz(char) / rate
+            for n in range(symbol):
+                value = int(9000 * math.sin(step * n)) + noise()
+                samples.append(value)
+                samples.append(value + noise())  # slightly different right channel
+    samples.extend(noise() for _ in range(int(tail_s * rate) * 2))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+# --- Fake transcriber ---
+
+def goertzel_power(samples, start: int, length: int, rate: int, hz: float) -> float:
+    coeff = 2 * math.cos(2 * math.pi * hz / rate)
+    s1 = s2 = 0.0
+    for x in samples[start:start + length]:
+        s1, s2 = x + coeff * s1 - s2, s1
+    return s1 * s1 + s2 * s2 - coeff * s1 * s2
+
+
+def decode_tones(data: bytes, filename: str, max_chars: int = len(MESSAGE)) -> str:
+    """Tone alphabet -> text, reading the first `max_chars` symbols after the leading silence"""
+    from pydub import AudioSegment
+    ext = filename.rsplit(".", 1)[-1].lower()
+    segment = AudioSegment.from_file(io.BytesIO(data), format=ext).set_channels(1)
+    rate = segment.frame_rate
+    samples = array("h", segment.raw_data) if segment.sample_width == 2 else segment.get_array_of_samples()
+    start = next((i for i, x in enumerate(samples) if abs(x) > 3000), None)
+    if start is None:
+        return ""
+    symbol = rate * SYMBOL_MS / 1000
+    window = int(symbol / 2)
+    text = []
+    for i in range(max_chars):
+        offset = int(start + i * symbol + symbol / 4)
+        if offset + window > len(samples):
+            break
+        powers = [goertzel_power(samples, offset, window, rate, tone_hz(c)) for c in ALPHABET]
+        text.append(ALPHABET[powers.index(max(powers))])
+    return "".join(text)
+
+
+def char_error_rate(reference: str, hypothesis: str) -> float:
+    """Levenshtein distance over characters / reference length"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, r in enumerate(reference, 1):
+        current = [i]
+        for j, h in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / max(1, len(reference))
+
+
+class FakeWhisper:
+    """Groq client stand-in: sleeps for upload + decoding time, then decodes tones"""
+
+    def __init__(self, uplink_mbps: float, decode_s_per_audio_s: float):
+        self.uplink_mbps = uplink_mbps
+        self.decode_cost = decode_s_per_audio_s
+        self.uploaded = []
+
+    def __call__(self, api_key=None, **kwargs):
+        whisper = self
+
+        class _Transcriptions:
+            def create(self, file, model, response_format="text", language=None, **kw):
+                data = file.getvalue()
+                whisper.uploaded.append((file.name, len(data)))
+                from pydub import AudioSegment
+                seconds = len(AudioSegment.from_file(io.BytesIO(data), format=file.name.rsplit(".", 1)[-1]))
+                time.sleep(len(data) * 8 / (whisper.uplink_mbps * 1e6) + seconds / 1000 * whisper.decode_cost)
+                return decode_tones(data, file.name)
+
+        class _Audio:
+            transcriptions = _Transcriptions()
+
+        class _Client:
+            audio = _Audio()
+
+        return _Client()
+
+
+async def transcribe(data: bytes, filename: str) -> tuple:
+    start = time.perf_counter()
+    text = await consulatation_handler.transcribe_audio(UploadFile(file=io.BytesIO(data), filename=filename))
+    return text, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, nargs="+", default=[15, 60, 120], help="Recording lengths")
+    parser.add_argument("--uplink-mbps", type=float, default=10.0, help="Simulated upload bandwidth to Whisper")
+    parser.add_argument("--decode-cost", type=float, default=0.01, help="Fake Whisper seconds per audio second")
+    args = parser.parse_args()
+
+    whisper = FakeWhisper(args.uplink_mbps, args.decode_cost)
+    consulatation_handler.Groq = whisper
+    codec = (f"{audio_preprocess.AUDIO_UPLOAD_FORMAT}/{audio_preprocess.AUDIO_UPLOAD_CODEC} "
+             f"@{audio_preprocess.AUDIO_UPLOAD_BITRATE}" if audio_preprocess.encoder_available()
+             else "wav (no ffmpeg on PATH)")
+    print(f"upload codec: {codec}; uplink {args.uplink_mbps} Mbit/s\n")
+
+    header = (f"{'audio':>7}{'received':>12}{'uploaded':>12}{'ratio':>7}{'prep ms':>9}"
+              f"{'raw e2e s':>11}{'prep e2e s':>12}{'CER raw':>9}{'CER prep':>10}")
+    print(header)
+    print("-" * len(header))
+    for seconds in args.seconds:
+        data = synthesize(seconds)
+        _, _, info = audio_preprocess.preprocess_audio(data, "consult.wav")
+
+        audio_preprocess.AUDIO_PREPROCESS = False
+        raw_text, raw_latency = asyncio.run(transcribe(data, "consult.wav"))
+        audio_preprocess.AUDIO_PREPROCESS = True
+        prep_text, prep_latency = asyncio.run(transcribe(data, "consult.wav"))
+
+        print(f"{seconds:>6.0f}s{len(data):>12,}{info['output_bytes']:>12,}"
+              f"{len(data) / info['output_bytes']:>6.1f}x{info['latency_ms']:>9.1f}"
+              f"{raw_latency:>11.2f}{prep_latency:>12.2f}"
+              f"{char_error_rate(MESSAGE, raw_text):>9.3f}{char_error_rate(MESSAGE, prep_text):>10.3f}")
+    print(f"\nuploads: {whisper.uploaded}")
+
+
+if __name__ == "__main__":
+    main()
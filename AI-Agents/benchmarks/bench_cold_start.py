@@ -0,0 +1,154 @@
+"""
+Cold-start benchmark: import-time profile and time to first /health.
+
+1. Import profile: `python -X importtime -c "import app"` in fresh
+   interpreters. Reports the median import time of the app alone and with
+   warm_up() (everything the handlers need), the slowest modules under each,
+   and warm_up()'s per-module cost.
+2. Startup: launches `uvicorn app:app` per LAZY_WARM_UP mode and polls until
+   /health answers, then immediately requests /api/v1/llm/routes (which needs
+   the LLM router module). Reports the time to the first /health, the time to
+   that first handler response, and for background warm-up the time until
+   /health reports the handler modules loaded.
+
+Stores are in-memory and no backend is called, so this needs only the
+service's own dependencies.
+
+    python benchmarks/bench_cold_start.py
+    python benchmarks/bench_cold_start.py --runs 10 --modes background,off
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import http.client
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ENV = {
+    **os.environ,
+    "JOB_STORE": "memory", "QUOTA_STORE": "memory", "FINDINGS_STORE": "memory", "RESULT_CACHE": "memory",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+# --- Import profile ---
+
+def importtime(code: str) -> Tuple[float, List[Tuple[float, str]]]:
+    """Total ms for `code` and (cumulative ms, module) for every module it imported"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=SERVICE_DIR, env=ENV,
+                            capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative) / 1000, name.rstrip()))
+    total = sum(ms for ms, name in modules if not name.startswith("  "))
+    return total, modules
+
+
+def top_level(modules: List[Tuple[float, str]], depth: int = 2) -> Dict[str, float]:
+    """Modules at most `depth` levels below the root imports, by cumulative ms"""
+    return {name.strip(): ms for ms, name in modules if (len(name) - len(name.lstrip())) // 2 <= depth}
+
+
+def profile(args):
+    print("import profile (median of fresh interpreters)\n")
+    for label, code in [("import app", "import app"),
+                        ("import app + warm_up()", "import app, lazy_imports; lazy_imports.warm_up()")]:
+        runs = [importtime(code) for _ in range(args.runs)]
+        print(f"{label:<28}{median(total for total, _ in runs):>8.0f}ms")
+        slowest: Dict[str, List[float]] = {}
+        for _, modules in runs:
+            for name, ms in top_level(modules).items():
+                slowest.setdefault(name, []).append(ms)
+        for name, samples in sorted(slowest.items(), key=lambda kv: -median(kv[1]))[:args.top]:
+            print(f"    {name:<40}{median(samples):>8.0f}ms")
+        print()
+
+    code = "import app, json, lazy_imports; print(json.dumps(lazy_imports.warm_up()))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=SERVICE_DIR, env=ENV, capture_output=True, text=True)
+    print("warm_up() per module (each includes dependencies not loaded yet)")
+    for name, ms in json.loads(result.stdout.strip().splitlines()[-1]).items():
+        print(f"    {name:<40}{ms:>8.0f}ms")
+
+
+# --- Startup ---
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(port: int, path: str) -> Optional[dict]:
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.request("GET", path)
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return json.loads(body) if response.status == 200 else None
+    except OSError:
+        return None
+
+
+def startup(mode: str, timeout: float) -> Dict[str, float]:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVICE_DIR, env={**ENV, "LAZY_WARM_UP": mode}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    timings: Dict[str, float] = {}
+    try:
+        while time.perf_counter() - start < timeout:
+            health = get(port, "/health")
+            if health:
+                timings["health"] = time.perf_counter() - start
+                get(port, "/api/v1/llm/routes")
+                timings["first_handler"] = time.perf_counter() - start
+                break
+            time.sleep(0.005)
+        while mode == "background" and time.perf_counter() - start < timeout:
+            health = get(port, "/health")
+            if health and health["warm_up"]["state"] == "warm":
+                timings["warm"] = time.perf_counter() - start
+                break
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="Slowest modules listed per profile")
+    parser.add_argument("--modes", default="background,blocking,off", help="LAZY_WARM_UP modes to start with")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    profile(args)
+
+    print(f"\nuvicorn startup (median of {args.runs})\n")
+    header = f"{'LAZY_WARM_UP':<14}{'first /health':>15}{'first handler':>15}{'warm':>9}"
+    print(header)
+    print("-" * len(header))
+    for mode in args.modes.split(","):
+        runs = [startup(mode, args.timeout) for _ in range(args.runs)]
+
+        def column(key: str) -> str:
+            samples = [r[key] for r in runs if key in r]
+            return f"{median(samples):.2f}s" if samples else "-"
+        print(f"{mode:<14}{column('health'):>15}{column('first_handler'):>15}{column('warm'):>9}")
+
+
+if __name__ == "__main__":
+    main()
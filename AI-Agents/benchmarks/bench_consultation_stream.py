@@ -0,0 +1,139 @@
+"""
+Consultation progress streaming: time to each stage and work saved on disconnect.
+
+Drives the app directly over ASGI (httpx's ASGI transport buffers streamed
+bodies) with fake Whisper and LLM backends and the result cache off.
+
+1. Latency: for /api/v1/consultation/process/stream, when the transcript,
+   summary and prescription events arrive; for /api/v1/consultation/process,
+   when the single response arrives.
+2. Disconnects: clients that drop the connection right after the transcript
+   event. Reports the LLM calls completed and cancelled and the LLM tokens
+   spent, against the same number of requests to the blocking endpoint, which
+   has no transcript to drop after and never watches for disconnects: its
+   work always runs to completion.
+
+    python benchmarks/bench_consultation_stream.py
+    python benchmarks/bench_consultation_stream.py --runs 20 --llm-latency lognormal:2,0.3
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+from bench_audio_preprocess import synthesize
+from run_load import percentile
+
+STREAM_PATH = "/api/v1/consultation/process/stream"
+BLOCKING_PATH = "/api/v1/consultation/process"
+
+
+def encode(audio: bytes):
+    import httpx._multipart as multipart
+    stream = multipart.MultipartStream(
+        data={"patient_data": json.dumps(fakes.SAMPLE_PATIENT)}, files={"file": ("visit.wav", audio, "audio/wav")}
+    )
+    return b"".join(stream), stream.content_type
+
+
+async def request(app, path: str, body: bytes, content_type: str, drop_after: Optional[str] = None) -> Dict[str, float]:
+    """POST over raw ASGI; returns seconds until each SSE event (or 'response'). Disconnects after `drop_after`."""
+    start = time.perf_counter()
+    arrivals: Dict[str, float] = {}
+    dropped = asyncio.Event()
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await dropped.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] != "http.response.body":
+            return
+        chunk = message.get("body", b"").decode()
+        for line in chunk.splitlines():
+            if line.startswith("event: "):
+                arrivals[line[len("event: "):]] = time.perf_counter() - start
+                if line[len("event: "):] == drop_after:
+                    dropped.set()
+        if not message.get("more_body") and path == BLOCKING_PATH:
+            arrivals["response"] = time.perf_counter() - start
+            if drop_after:
+                dropped.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        "headers": [(b"host", b"bench"), (b"content-type", content_type.encode()),
+                    (b"content-length", str(len(body)).encode())],
+    }
+    await app(scope, receive, send)
+    return arrivals
+
+
+def llm_delta(backends, before: Dict[str, int]) -> Dict[str, int]:
+    completed = sum(v - before.get(k, 0) for k, v in backends.calls.items() if k.startswith("llm:"))
+    cancelled = sum(v - before.get(k, 0) for k, v in backends.calls.items() if k.startswith("llm_cancelled:"))
+    return {"completed": completed, "cancelled": cancelled}
+
+
+async def run(args):
+    backends = fakes.install(llm=args.llm_latency, whisper=args.whisper_latency, mongo="const:0")
+    logging.disable(logging.WARNING)
+    import result_cache
+    from app import app
+
+    result_cache.result_cache.configure("off")
+    body, content_type = encode(synthesize(args.seconds))
+
+    stream_runs: List[Dict[str, float]] = [await request(app, STREAM_PATH, body, content_type) for _ in range(args.runs)]
+    blocking_runs = [await request(app, BLOCKING_PATH, body, content_type) for _ in range(args.runs)]
+
+    header = f"{'endpoint':<12}{'event':<14}{'p50':>8}{'p95':>8}"
+    print(header)
+    print("-" * len(header))
+    for event in ("transcript", "summary", "prescription"):
+        samples = [r[event] for r in stream_runs if event in r]
+        print(f"{'stream':<12}{event:<14}{percentile(samples, 0.5):>7.2f}s{percentile(samples, 0.95):>7.2f}s")
+    samples = [r["response"] for r in blocking_runs]
+    print(f"{'blocking':<12}{'response':<14}{percentile(samples, 0.5):>7.2f}s{percentile(samples, 0.95):>7.2f}s")
+
+    print(f"\n{args.runs} clients dropping after the transcript")
+    header = f"{'endpoint':<12}{'LLM done':>10}{'cancelled':>11}{'LLM tokens':>12}"
+    print(header)
+    print("-" * len(header))
+    for label, path in [("stream", STREAM_PATH), ("blocking", BLOCKING_PATH)]:
+        before, tokens_before = dict(backends.calls), sum(backends.tokens.values())
+        await asyncio.gather(*[request(app, path, body, content_type, drop_after="transcript")
+                               for _ in range(args.runs)])
+        # Let any call still running in a worker thread finish before counting
+        await asyncio.sleep(args.settle)
+        calls = llm_delta(backends, before)
+        print(f"{label:<12}{calls['completed']:>10}{calls['cancelled']:>11}"
+              f"{sum(backends.tokens.values()) - tokens_before:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=20.0, help="Length of the synthetic recording")
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.3")
+    parser.add_argument("--whisper-latency", default="lognormal:1.5,0.3")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds to wait for abandoned work before counting")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Findings history store: write and query cost per backend.
+
+Fills a store with --users patients, each with --reports dated lab reports of
+~20 analytes (values drifting over time, mixed units as different labs report
+them), then measures per backend:
+
+    record      storing one report's findings (unit conversion included)
+    series      one analyte for one patient over a date range
+    overview    every analyte for one patient (general "how are my results")
+    context     agent chat context built for a message naming two analytes
+
+and, for SQLite, the on-disk bytes per stored finding. A history question used
+to mean re-uploading and re-analyzing the old reports (OCR plus an LLM call
+each); these lookups replace that.
+
+First checks that reports printing units in different places (after the
+value, after the range, nowhere) store the right canonical values and trend;
+exits non-zero if not.
+
+    python benchmarks/bench_findings.py
+    python benchmarks/bench_findings.py --users 2000 --reports 24
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from datetime import date, timedelta
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from findings_store import FindingsHistory, create_store
+from lab_parser import get_lab_reference, parse_lab_report
+
+# (parameter as printed, unit, typical value, drift per report)
+PANEL = [
+    ("Hemoglobin", "g/dL", 12.5, -0.05), ("Total Leukocyte Count", "10^3/uL", 7.2, 0.0),
+    ("Platelet Count", "10^3/uL", 240, 1.0), ("HbA1c", "%", 7.4, -0.08),
+    ("Fasting Blood Sugar", "mg/dL", 128, -1.5), ("Fasting Glucose", "mmol/L", 7.1, -0.08),
+    ("Total Cholesterol", "mg/dL", 215, -1.0), ("LDL Cholesterol", "mg/dL", 140, -1.2),
+    ("HDL Cholesterol", "mg/dL", 42, 0.2), ("Triglycerides", "mg/dL", 180, -2.0),
+    ("Serum Creatinine", "mg/dL", 1.1, 0.01), ("Creatinine", "umol/L", 97, 0.9),
+    ("Blood Urea", "mg/dL", 32, 0.1), ("Uric Acid", "mg/dL", 6.8, 0.0),
+    ("Sodium", "mmol/L", 139, 0.0), ("Potassium", "mmol/L", 4.3, 0.0),
+    ("SGPT", "U/L", 48, -0.6), ("SGOT", "U/L", 36, -0.3),
+    ("TSH", "mIU/L", 3.2, 0.05), ("Vitamin D", "ng/mL", 18, 0.8), ("Vitamin B12", "pg/mL", 260, 4.0),
+]
+
+
+def report(rng: random.Random, index: int) -> List[Dict[str, str]]:
+    findings = []
+    for parameter, unit, typical, drift in PANEL:
+        value = (typical + drift * index) * rng.uniform(0.95, 1.05)
+        findings.append({"parameter": parameter, "value": f"{value:.3g} {unit}",
+                         "normal_range": "-", "status": "Normal"})
+    return findings
+
+
+# (report day, report line) -> stored canonical value, for one patient's hemoglobin
+UNIT_CASES = [
+    ("2025-01-10", "Hemoglobin 13.0 g/dL 12-15", 13.0),
+    ("2025-03-02", "Hemoglobin (Hb) 11.2 L 12-15 g/dL", 11.2),
+    ("2025-04-15", "Hemoglobin 10.8", None),  # unit printed nowhere: text only
+    ("2025-06-20", "Hb 6.3 mmol/L 7.4-9.9", 10.1),
+]
+
+
+async def check_units() -> bool:
+    history = FindingsHistory(create_store("memory"))
+    for taken_on, line, _ in UNIT_CASES:
+        await history.record("u", parse_lab_report(line)["findings"], taken_on)
+    points = (await history.series("u", ["hemoglobin"]))["hemoglobin"]
+    stored = [round(p["value"], 1) if p["value"] is not None else None for p in points]
+    expected = [value for _, _, value in UNIT_CASES]
+    summary = (await history.trends("u"))["hemoglobin"]
+    ok = stored == expected and summary["direction"] == "falling" and summary["change"] < 0
+    print(f"unit handling: {'ok' if ok else 'FAIL'} stored {stored} (expected {expected}), "
+          f"trend {summary['direction']} {summary['change']:+.3g}")
+    return ok
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def bench(spec: str, args) -> Dict[str, List[float]]:
+    history = FindingsHistory(create_store(spec))
+    rng = random.Random(7)
+    start_day = date(2023, 1, 1)
+    timings: Dict[str, List[float]] = {"record": [], "series": [], "overview": [], "context": []}
+
+    for user in range(args.users):
+        for i in range(args.reports):
+            taken_on = (start_day + timedelta(days=45 * i + user % 30)).isoformat()
+            findings = report(rng, i)
+            t = time.perf_counter()
+            await history.record(f"user-{user}", findings, taken_on, source=f"report-{i}.pdf")
+            timings["record"].append(time.perf_counter() - t)
+
+    for _ in range(args.queries):
+        user = f"user-{rng.randrange(args.users)}"
+        t = time.perf_counter()
+        await history.series(user, ["hba1c"], since="2024-01-01", until="2025-12-31")
+        timings["series"].append(time.perf_counter() - t)
+        t = time.perf_counter()
+        await history.trends(user)
+        timings["overview"].append(time.perf_counter() - t)
+        t = time.perf_counter()
+        await history.chat_context(user, "Has my HbA1c and LDL improved since last year?")
+        timings["context"].append(time.perf_counter() - t)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--reports", type=int, default=12, help="Reports per patient")
+    parser.add_argument("--queries", type=int, default=500, help="Queries of each kind")
+    args = parser.parse_args()
+
+    get_lab_reference()
+    if not asyncio.run(check_units()):
+        sys.exit(1)
+    tmp = tempfile.mkdtemp(prefix="bench-findings-")
+    path = os.path.join(tmp, "findings.db")
+    rows = args.users * args.reports * len(PANEL)
+    print(f"{args.users} patients x {args.reports} reports x {len(PANEL)} findings = {rows} findings\n")
+    header = f"{'store':<8}" + "".join(f"{name + ' p50':>14}{'p95':>9}" for name in ("record", "series", "overview", "context"))
+    print(header)
+    print("-" * len(header))
+    for label, spec in [("memory", "memory"), ("sqlite", f"sqlite:{path}")]:
+        timings = asyncio.run(bench(spec, args))
+        print(f"{label:<8}" + "".join(
+            f"{percentile(timings[name], 0.5) * 1e6:>12.0f}us{percentile(timings[name], 0.95) * 1e6:>7.0f}us"
+            for name in ("record", "series", "overview", "context")
+        ))
+
+    size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+    print(f"\nsqlite: {size / 1024 / 1024:.1f} MB on disk, {size / rows:.0f} bytes per finding (incl. WAL)")
+
+    sample = FindingsHistory(create_store("memory"))
+    rng = random.Random(7)
+    for i in range(args.reports):
+        asyncio.run(sample.record("u", report(rng, i), (date(2023, 1, 1) + timedelta(days=45 * i)).isoformat()))
+    print("\nchat context for 'Has my HbA1c and LDL improved since last year?':")
+    print(asyncio.run(sample.chat_context("u", "Has my HbA1c and LDL improved since last year?")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Accuracy and cost of the local lab-value parser on hand-labelled sample reports.
+
+Each sample is report text in a different real-world layout (space, colon and
+pipe separated, SI and conventional units, lakh/cumm counts, flags, OCR
+spacing, header noise) with the expected findings. Reports per-sample and
+overall:
+
+    recall      expected analytes found
+    precision   found analytes that were expected (no false positives)
+    value       found analytes whose value matches
+    status      found analytes whose Normal/High/Low/Critical status matches
+
+plus parse latency and the output tokens the LLM no longer has to generate
+(the findings JSON, ~4 chars per token). Mismatches are listed with -v.
+
+    python benchmarks/bench_lab_parser.py
+    python benchmarks/bench_lab_parser.py -v
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lab_parser import LabReference, parse_lab_report, DATA_PATH
+
+CHARS_PER_TOKEN = 4
+
+# (name, report text, {parameter: (value, status)})
+SAMPLES = [
+    ("cbc_indian", """DEPARTMENT OF HAEMATOLOGY
+COMPLETE BLOOD COUNT (CBC)
+Test Name Result Unit Bio. Ref. Interval
+Haemoglobin 10.4 g/dL 12.0 - 15.0
+Total Leukocyte Count 7,800 /cumm 4,000 - 11,000
+RBC Count 3.9 mill/cumm 3.8 - 4.8
+Packed Cell Volume (PCV) 33.1 % 36 - 46
+MCV 84.9 fL 83 - 101
+MCH 26.7 pg 27 - 32
+MCHC 31.4 g/dL 31.5 - 34.5
+Platelet Count 1.2 lakhs/cumm 1.5 - 4.1
+DIFFERENTIAL LEUCOCYTE COUNT
+Neutrophils 68 % 40 - 80
+Lymphocytes 24 % 20 - 40
+Eosinophils 5 % 1 - 6
+Monocytes 3 % 2 - 10
+Basophils 0 % 0 - 2
+ESR (Westergren) 32 mm/1st hr 0 - 20
+""", {
+        "Hemoglobin": ("10.4 g/dL", "Low"),
+        "Total Leukocyte Count": ("7,800 /cumm", "Normal"),
+        "RBC Count": ("3.9 mill/cumm", "Normal"),
+        "Hematocrit (PCV)": ("33.1 %", "Low"),
+        "MCV": ("84.9 fL", "Normal"),
+        "MCH": ("26.7 pg", "Low"),
+        "MCHC": ("31.4 g/dL", "Low"),
+        "Platelet Count": ("1.2 lakhs/cumm", "Low"),
+        "Neutrophils": ("68 %", "Normal"),
+        "Lymphocytes": ("24 %", "Normal"),
+        "Eosinophils": ("5 %", "Normal"),
+        "Monocytes": ("3 %", "Normal"),
+        "Basophils": ("0 %", "Normal"),
+        "ESR": ("32 mm/1st hr", "High"),
+    }),
+    ("lft_colon_flags", """LIVER FUNCTION TEST
+Sample: Serum    Collected: 14/03/2025 08:10
+S. Bilirubin Total : 2.8 mg/dL (H) 0.3 - 1.2
+S. Bilirubin Direct : 1.1 mg/dL (H) 0.0 - 0.3
+S. Bilirubin Indirect : 1.7 mg/dL (H) 0.2 - 0.9
+SGOT (AST) : 88 U/L (H) 5 - 40
+SGPT (ALT) : 112 U/L (H) 5 - 41
+Alkaline Phosphatase : 131 IU/L 40 - 129
+GGT : 74 U/L 0 - 60
+Total Protein : 6.9 g/dL 6.0 - 8.3
+Albumin : 3.4 g/dL 3.5 - 5.2
+Globulin : 3.5 g/dL 2.0 - 3.5
+A/G Ratio : 0.97 1.0 - 2.1
+""", {
+        "Total Bilirubin": ("2.8 mg/dL", "High"),
+        "Direct Bilirubin": ("1.1 mg/dL", "High"),
+        "Indirect Bilirubin": ("1.7 mg/dL", "High"),
+        "AST (SGOT)": ("88 U/L", "High"),
+        "ALT (SGPT)": ("112 U/L", "High"),
+        "Alkaline Phosphatase": ("131 IU/L", "High"),
+        "GGT": ("74 U/L", "High"),
+        "Total Protein": ("6.9 g/dL", "Normal"),
+        "Albumin": ("3.4 g/dL", "Low"),
+        "Globulin": ("3.5 g/dL", "Normal"),
+    }),
+    ("lipid_one_sided", """LIPID PROFILE
+Total Cholesterol 246 mg/dL Desirable < 200
+Triglycerides 310 mg/dL < 150
+HDL Cholesterol 36 mg/dL > 40
+LDL Cholesterol 148 mg/dL < 100
+VLDL Cholesterol 62 mg/dL 5 - 40
+Total Cholesterol/HDL Ratio 6.8 < 5.0
+LDL/HDL Ratio 4.1 < 3.5
+""", {
+        "Total Cholesterol": ("246 mg/dL", "High"),
+        "Triglycerides": ("310 mg/dL", "High"),
+        "HDL Cholesterol": ("36 mg/dL", "Low"),
+        "LDL Cholesterol": ("148 mg/dL", "High"),
+        "VLDL Cholesterol": ("62 mg/dL", "High"),
+    }),
+    ("renal_si_units", """RENAL PANEL
+Urea 9.8 mmol/L 2.5 - 6.7
+Creatinine 186 umol/L 62 - 115
+Uric Acid 512 µmol/L 208 - 428
+Sodium 131 mmol/L 135 - 145
+Potassium 6.8 mmol/L 3.5 - 5.1
+Chloride 101 mmol/L 98 - 107
+Calcium 2.31 mmol/L 2.15 - 2.55
+Urine Creatinine 84 mg/dL
+""", {
+        "Blood Urea": ("9.8 mmol/L", "High"),
+        "Creatinine": ("186 umol/L", "High"),
+        "Uric Acid": ("512 µmol/L", "High"),
+        "Sodium": ("131 mmol/L", "Low"),
+        "Potassium": ("6.8 mmol/L", "Critical"),
+        "Chloride": ("101 mmol/L", "Normal"),
+        "Calcium": ("2.31 mmol/L", "Normal"),
+    }),
+    ("thyroid", """THYROID PROFILE, TOTAL
+T3, Total 0.62 ng/mL
+T3 Total (CLIA) 62 ng/dL 80 - 200
+T4, Total (CLIA) 4.2 µg/dL 5.1 - 14.1
+TSH 3rd Generation (CLIA) 9.84 µIU/mL 0.27 - 4.2
+Free T4 0.7 ng/dL 0.9 - 1.7
+""", {
+        "Total T3": ("0.62 ng/mL", "Low"),
+        "Total T4": ("4.2 µg/dL", "Low"),
+        "TSH": ("9.84 µIU/mL", "High"),
+        "Free T4": ("0.7 ng/dL", "Low"),
+    }),
+    ("diabetes_mmol_no_ranges", """DIABETES SCREEN
+Fasting Plasma Glucose 7.4 mmol/L
+Glucose PP (2 hr) 12.9 mmol/L
+HbA1c (Glycated Haemoglobin) 7.9 %
+Random Blood Sugar 28.6 mmol/L
+""", {
+        "Fasting Blood Sugar": ("7.4 mmol/L", "High"),
+        "Post Prandial Blood Sugar": ("12.9 mmol/L", "High"),
+        "HbA1c": ("7.9 %", "High"),
+        "Random Blood Sugar": ("28.6 mmol/L", "Critical"),
+    }),
+    ("pipe_ocr", """| Investigation | Result | Units | Reference |
+| Haemoglobin | 6.4 | gm/dl | 12.0 - 15.0 |
+| Total WBC Count | 23,400 | cells/cumm | 4000 - 11000 |
+| Platelets | 38,000 | /cumm | 1,50,000 - 4,10,000 |
+| PCV | 21.2 | % | 36 - 46 |
+""", {
+        "Hemoglobin": ("6.4 gm/dl", "Critical"),
+        "Total Leukocyte Count": ("23,400 cells/cumm", "High"),
+        "Platelet Count": ("38,000 /cumm", "Critical"),
+        "Hematocrit (PCV)": ("21.2 %", "Low"),
+    }),
+    ("us_style_flags", """CBC W/ DIFF
+WBC 12.4 x10^3/uL 4.0-11.0 H
+RBC 4.62 x10^6/uL 4.50-5.90
+HGB 13.1 g/dL 13.5-17.5 L
+HCT 39.8 % 41.0-53.0 L
+MCV 86.1 fL 80.0-100.0
+RDW 15.2 % 11.5-14.5 H
+PLT 96 x10^3/uL 150-400 L
+""", {
+        "Total Leukocyte Count": ("12.4 x10^3/uL", "High"),
+        "RBC Count": ("4.62 x10^6/uL", "Normal"),
+        "Hemoglobin": ("13.1 g/dL", "Low"),
+        "Hematocrit (PCV)": ("39.8 %", "Low"),
+        "MCV": ("86.1 fL", "Normal"),
+        "RDW-CV": ("15.2 %", "High"),
+        "Platelet Count": ("96 x10^3/uL", "Low"),
+    }),
+    ("vitamins_iron", """VITAMIN & IRON STUDIES
+25-OH Vitamin D (Total) 8.5 ng/mL 30 - 100
+Vitamin B12 1020 pg/mL 211 - 911
+Serum Ferritin 12 ng/mL 13 - 150
+Serum Iron 45 µg/dL 60 - 170
+TIBC 480 µg/dL 250 - 450
+Transferrin Saturation 9.4 % 20 - 50
+hs-CRP 7.8 mg/L < 3.0
+""", {
+        "Vitamin D (25-OH)": ("8.5 ng/mL", "Low"),
+        "Vitamin B12": ("1020 pg/mL", "High"),
+        "Ferritin": ("12 ng/mL", "Low"),
+        "Serum Iron": ("45 µg/dL", "Low"),
+        "TIBC": ("480 µg/dL", "High"),
+        "C-Reactive Protein": ("7.8 mg/L", "High"),
+    }),
+    ("header_noise", """City Diagnostics Pvt. Ltd. Ph: 080 4123 4567
+Patient: Asha K. Age: 45 Years Sex: Female
+Ref. Doctor: Dr. K. Rao Reg. No: 22817
+Sample collected: 12/05/2024 09:30
+Fasting Blood Sugar 96 mg/dL 70 - 100
+Serum Creatinine 0.8 mg/dL 0.6 - 1.1
+Hemoglobin 12.8 g/dL 12.0 - 15.0
+Report printed on 12/05/2024 14:02. Page 1 of 1
+""", {
+        "Fasting Blood Sugar": ("96 mg/dL", "Normal"),
+        "Creatinine": ("0.8 mg/dL", "Normal"),
+        "Hemoglobin": ("12.8 g/dL", "Normal"),
+    }),
+    ("radiology_free_text", """ULTRASOUND ABDOMEN
+Liver measures 16.5 cm and shows increased echogenicity.
+Gall bladder is well distended; wall thickness 2 mm. No calculi.
+Both kidneys normal in size (RK 10.2 cm, LK 10.6 cm).
+Impression: Grade I fatty liver.
+""", {}),
+    ("unitless_no_range", """Hemoglobin 4.5
+Creatinine 9.5
+Potassium 6.9
+""", {
+        "Hemoglobin": ("4.5", "Critical"),
+        "Creatinine": ("9.5", "High"),
+        "Potassium": ("6.9", "Critical"),
+    }),
+    ("unit_after_range", """Hemoglobin (Hb) 11.2 L 12-15 g/dL
+Total Leukocyte Count 7,800 4,000 - 11,000
+Serum Creatinine 1.9 H 0.6-1.2 mg/dL
+""", {
+        "Hemoglobin": ("11.2 g/dL", "Low"),
+        "Total Leukocyte Count": ("7,800", "Normal"),
+        "Creatinine": ("1.9 mg/dL", "High"),
+    }),
+    ("glucose_unqualified", """Glucose 250 mg/dL 70-100
+Glucose (Fasting) 95 mg/dL 70-100
+Random Blood Glucose 180 mg/dL 70-140
+""", {
+        "Blood Glucose": ("250 mg/dL", "High"),
+        "Fasting Blood Sugar": ("95 mg/dL", "Normal"),
+        "Random Blood Sugar": ("180 mg/dL", "High"),
+    }),
+    ("blood_glucose", """Blood Glucose 250 mg/dL 70-100
+""", {
+        "Blood Glucose": ("250 mg/dL", "High"),
+    }),
+]
+
+
+def score(expected, findings):
+    found = {f["parameter"]: f for f in findings}
+    hits = [name for name in expected if name in found]
+    return {
+        "expected": len(expected),
+        "found": len(found),
+        "hits": len(hits),
+        "values": sum(found[name]["value"] == expected[name][0] for name in hits),
+        "statuses": sum(found[name]["status"] == expected[name][1] for name in hits),
+        "missed": [name for name in expected if name not in found],
+        "extra": [name for name in found if name not in expected],
+        "wrong": [
+            (name, found[name]["value"], found[name]["status"], *expected[name])
+            for name in hits if (found[name]["value"], found[name]["status"]) != expected[name]
+        ],
+    }
+
+
+def ratio(a, b):
+    return f"{a / b * 100:.0f}%" if b else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="List missed, extra and wrong findings")
+    parser.add_argument("--iterations", type=int, default=200, help="Parses per sample for latency")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    reference = LabReference.load(DATA_PATH)
+    print(f"reference build: {(time.perf_counter() - start) * 1000:.1f} ms ({len(reference.tests)} analytes)\n")
+
+    header = (f"{'sample':<26}{'recall':>8}{'precision':>11}{'value':>8}{'status':>8}"
+              f"{'parse us':>10}{'tokens saved':>14}")
+    print(header)
+    print("-" * len(header))
+    totals = {"expected": 0, "found": 0, "hits": 0, "values": 0, "statuses": 0}
+    saved_total = 0
+    for name, text, expected in SAMPLES:
+        result = parse_lab_report(text, reference)
+        t = time.perf_counter()
+        for _ in range(args.iterations):
+            parse_lab_report(text, reference)
+        parse_us = (time.perf_counter() - t) / args.iterations * 1e6
+        s = score(expected, result["findings"])
+        for key in totals:
+            totals[key] += s[key]
+        saved = len(json.dumps({"report_type": result["report_type"], "findings": result["findings"]})) // CHARS_PER_TOKEN \
+            if result["findings"] else 0
+        saved_total += saved
+        print(f"{name:<26}{ratio(s['hits'], s['expected']):>8}{ratio(s['hits'], s['found']):>11}"
+              f"{ratio(s['values'], s['hits']):>8}{ratio(s['statuses'], s['hits']):>8}{parse_us:>10.0f}{saved:>14}")
+        if args.verbose:
+            for missed in s["missed"]:
+                print(f"    missed  {missed}")
+            for extra in s["extra"]:
+                print(f"    extra   {extra}")
+            for param, value, status, want_value, want_status in s["wrong"]:
+                print(f"    wrong   {param}: got {value!r} {status}, expected {want_value!r} {want_status}")
+
+    print("-" * len(header))
+    print(f"{'overall':<26}{ratio(totals['hits'], totals['expected']):>8}{ratio(totals['hits'], totals['found']):>11}"
+          f"{ratio(totals['values'], totals['hits']):>8}{ratio(totals['statuses'], totals['hits']):>8}"
+          f"{'':>10}{saved_total:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Accuracy and cost of the local keyword triage on hand-labelled patient messages.
+
+Each case is a message with the expected urgency, red flags and symptoms, plus
+symptoms that must not be reported (negated ones). Covers negation
+("I don't have a fever"), explicit denials of red flags ("denies chest pain"),
+phrasings that must keep a red flag ("never had chest pain this bad") and
+look-alike words ("the shoe fits"). Prints per-case results and triage latency;
+exits non-zero if any case fails.
+
+    python benchmarks/bench_local_triage.py
+    python benchmarks/bench_local_triage.py -v
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pre_diagnosis import local_triage
+
+# (message, urgency, red flags, symptoms expected, symptoms that must be absent)
+CASES = [
+    ("I have never had chest pain this bad before", "Emergency", {"chest pain"}, set(), set()),
+    ("I don't have a fever but I keep coughing", "Routine", set(), {"cough"}, {"fever"}),
+    ("I am not able to breathe properly since morning", "Emergency", {"breathing difficulty"}, set(), set()),
+    ("I can't breathe and my lips feel swollen", "Emergency", {"breathing difficulty"}, {"swelling"}, set()),
+    ("the shoe fits but my ankle is swollen", "Routine", set(), {"swelling"}, set()),
+    ("I get fits of coughing at night", "Routine", set(), {"cough"}, set()),
+    ("My son had a seizure an hour ago", "Emergency", {"seizure"}, set(), set()),
+    ("Patient denies chest pain, reports mild headache", "Routine", set(), {"headache"}, set()),
+    ("no chest pain, just a sore throat and runny nose", "Routine", set(), {"sore throat", "runny nose"}, set()),
+    ("I don't think it's chest pain, more like heartburn", "Emergency", {"chest pain"}, set(), set()),
+    ("He doesn't have a rash and didn't vomit, only diarrhea", "Routine", set(), {"diarrhea"}, {"rash", "vomiting"}),
+    ("I haven't had a headache since Monday but feel dizzy", "Routine", set(), {"dizziness"}, {"headache"}),
+    ("I can't stop coughing and have a high temperature", "Routine", set(), {"cough", "fever"}, set()),
+    ("Worst headache of my life, came on suddenly", "Urgent", {"thunderclap headache"}, {"headache"}, set()),
+    ("Fever and stiff neck for two days", "Urgent", {"meningism"}, {"fever"}, set()),
+    ("Mild cold with sneezing, no fever", "Routine", set(), {"runny nose"}, {"fever"}),
+]
+
+
+def check(case):
+    text, urgency, flags, symptoms, absent = case
+    result = local_triage(text)
+    got_flags = {f["flag"] for f in result["red_flags"]}
+    got_symptoms = set(result["symptoms"])
+    problems = []
+    if result["urgency"] != urgency:
+        problems.append(f"urgency {result['urgency']}, expected {urgency}")
+    if got_flags != flags:
+        problems.append(f"red flags {sorted(got_flags)}, expected {sorted(flags)}")
+    if symptoms - got_symptoms:
+        problems.append(f"missed symptoms {sorted(symptoms - got_symptoms)}")
+    if absent & got_symptoms:
+        problems.append(f"negated symptoms reported {sorted(absent & got_symptoms)}")
+    return result, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the triage result of every case")
+    parser.add_argument("--iterations", type=int, default=1000, help="Triage runs per case for latency")
+    args = parser.parse_args()
+
+    failures = 0
+    for case in CASES:
+        result, problems = check(case)
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok':<6}{case[0]}")
+        for problem in problems:
+            print(f"        {problem}")
+        if args.verbose:
+            print(f"        {result['urgency']} flags={[f['flag'] for f in result['red_flags']]} "
+                  f"symptoms={result['symptoms']} severity={result['severity']}")
+
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        for case in CASES:
+            local_triage(case[0])
+    per_call = (time.perf_counter() - start) / (args.iterations * len(CASES)) * 1e6
+    print(f"\n{len(CASES) - failures}/{len(CASES)} cases pass, {per_call:.0f} us per triage")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
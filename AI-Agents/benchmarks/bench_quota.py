@@ -0,0 +1,123 @@
+"""
+Per-user quota benchmark.
+
+1. Overhead: admit + settle round trips per store backend (memory, sqlite,
+   two sqlite shards), the cost every metered request pays.
+2. Noisy neighbour: one user hammers /api/v1/agent/chat from many concurrent
+   loops while normal users chat every couple of seconds, in-process with fake
+   backends whose LLM accepts a limited number of concurrent calls. Reports
+   normal users' p50/p95, the abuser's completed and 429'd requests, and the
+   total LLM tokens spent, with quotas off and on (default limits).
+
+    python benchmarks/bench_quota.py
+    python benchmarks/bench_quota.py --abuser-loops 32 --duration 20
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import Counter
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+from run_load import USER_ID, percentile
+
+ABUSER_ID = "665f1c2e8f1b2c3d4e5f6aff"
+CHAT_BODY = {"message": "What medications am I on?", "history": []}
+
+
+async def overhead(spec: str, iterations: int) -> float:
+    from quota import QuotaManager, create_store
+
+    manager = QuotaManager(create_store(spec))
+    usage = {"input_tokens": 800, "output_tokens": 200}
+    start = time.perf_counter()
+    for i in range(iterations):
+        user = f"user-{i % 50}"
+        reserved = await manager.admit(user, "/api/v1/pre-diagnosis")
+        await manager.settle(user, "/api/v1/pre-diagnosis", usage, reserved)
+    return (time.perf_counter() - start) / iterations
+
+
+async def chat_loop(client, user: str, stop: asyncio.Event, latencies: List[float], outcomes: Counter,
+                    interval: float = 0.0):
+    while not stop.is_set():
+        start = time.perf_counter()
+        r = await client.post("/api/v1/agent/chat", json={**CHAT_BODY, "userId": user})
+        outcomes[r.status_code] += 1
+        if r.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        elif r.status_code == 429:
+            await asyncio.sleep(min(float(r.headers.get("Retry-After", "1")), 0.5))
+        if interval:
+            await asyncio.sleep(interval)
+
+
+async def phase(app, args, backends) -> Dict:
+    import httpx
+
+    stop = asyncio.Event()
+    normal, abuser = [], []
+    normal_outcomes, abuser_outcomes = Counter(), Counter()
+    tokens_before = sum(backends.tokens.values())
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        tasks = [asyncio.create_task(chat_loop(client, ABUSER_ID, stop, abuser, abuser_outcomes))
+                 for _ in range(args.abuser_loops)]
+        tasks += [asyncio.create_task(chat_loop(client, f"{USER_ID[:-2]}{i:02x}", stop, normal, normal_outcomes,
+                                                interval=args.normal_interval))
+                  for i in range(args.normal_users)]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+    return {"normal": normal, "normal_outcomes": normal_outcomes, "abuser_outcomes": abuser_outcomes,
+            "tokens": sum(backends.tokens.values()) - tokens_before}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="Round trips per store in the overhead test")
+    parser.add_argument("--abuser-loops", type=int, default=24, help="Concurrent request loops of the abusive user")
+    parser.add_argument("--normal-users", type=int, default=6, help="Normal users, one request loop each")
+    parser.add_argument("--normal-interval", type=float, default=2.0, help="Normal users' pause between requests")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per phase")
+    parser.add_argument("--llm-capacity", type=int, default=8, help="Concurrent calls the fake LLM provider serves")
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.3")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-quota-")
+    print(f"{'store':<28}{'admit+settle':>14}")
+    for label, spec in [("memory", "memory"), ("sqlite", f"sqlite:{tmp}/a.db"),
+                        ("sqlite x2 shards", f"sqlite:{tmp}/b.db,sqlite:{tmp}/c.db")]:
+        per_call = asyncio.run(overhead(spec, args.iterations))
+        print(f"{label:<28}{per_call * 1e6:>12.0f}us")
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    # Any valid ObjectId has a patient record in the fakes, so the abuser's calls do real work
+    backends = fakes.install(llm=args.llm_latency, mongo="const:0.01", llm_capacity=args.llm_capacity)
+    logging.disable(logging.WARNING)
+    from app import app
+    from quota import quota
+
+    print(f"\nabuser loops {args.abuser_loops}, normal users {args.normal_users}, LLM capacity {args.llm_capacity}, "
+          f"{args.duration:.0f}s per phase, agent chat limit {quota.limits['/api/v1/agent/chat']['requests']}\n")
+    header = f"{'quotas':<8}{'normal p50':>11}{'p95':>8}{'normal ok':>11}{'normal 429':>12}{'abuser ok':>11}{'abuser 429':>12}{'LLM tokens':>12}"
+    print(header)
+    print("-" * len(header))
+    for label, spec in [("off", "off"), ("on", "memory")]:
+        quota.configure(spec)
+        result = asyncio.run(phase(app, args, backends))
+        normal = result["normal"]
+        print(f"{label:<8}{percentile(normal, 0.5):>10.2f}s{percentile(normal, 0.95):>7.2f}s"
+              f"{result['normal_outcomes'][200]:>11}{result['normal_outcomes'][429]:>12}{result['abuser_outcomes'][200]:>11}"
+              f"{result['abuser_outcomes'][429]:>12}{result['tokens']:>12}")
+
+
+if __name__ == "__main__":
+    main()
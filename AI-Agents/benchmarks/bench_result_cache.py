@@ -0,0 +1,110 @@
+"""
+Measure consultation re-runs with the transcription and summary caches.
+
+Submits the same recording to /api/v1/consultation/process several times with
+different patient_info (as a doctor tweaking the patient record would), using
+the fake Whisper and LLM backends, and reports per-run latency, the per-stage
+cache report from the response and how many Whisper/LLM calls were made.
+
+With --formats the runs cycle through the same recording in other containers
+(flac is a lossless copy; ogg carries the webm's Opus stream remuxed), which
+should still hit the transcription cache because it is keyed by the decoded
+audio. Needs ffmpeg; without it only wav is used.
+
+    python benchmarks/bench_result_cache.py
+    python benchmarks/bench_result_cache.py --runs 5 --cache off
+    python benchmarks/bench_result_cache.py --runs 8 --formats wav,flac,webm,ogg
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+from bench_audio_preprocess import synthesize
+
+
+def ffmpeg(data: bytes, *args: str) -> bytes:
+    return subprocess.run(["ffmpeg", "-loglevel", "error", "-i", "pipe:0", *args, "pipe:1"],
+                          input=data, capture_output=True, check=True).stdout
+
+
+def containers(audio: bytes, formats: List[str]) -> List[Tuple[str, bytes]]:
+    """(filename, bytes) of the WAV recording in each requested container"""
+    from audio_preprocess import encoder_available
+
+    if not encoder_available():
+        print("ffmpeg not found, using wav only\n")
+        return [("visit.wav", audio)]
+    variants, opus = [], None
+    for fmt in formats:
+        if fmt == "wav":
+            data = audio
+        elif fmt == "flac":
+            data = ffmpeg(audio, "-f", "flac")
+        elif fmt in ("webm", "ogg"):
+            opus = opus or ffmpeg(audio, "-c:a", "libopus", "-b:a", "32k", "-f", "webm")
+            data = opus if fmt == "webm" else ffmpeg(opus, "-c:a", "copy", "-f", "ogg")
+        else:
+            raise ValueError(f"Unsupported format '{fmt}'")
+        variants.append((f"visit.{fmt}", data))
+    return variants
+
+
+async def run(args):
+    backends = fakes.install(llm=args.llm_latency, whisper=args.whisper_latency, mongo="const:0")
+    import httpx
+    import result_cache
+    from app import app
+
+    result_cache.result_cache.configure(args.cache)
+    variants = containers(synthesize(args.seconds), args.formats.split(","))
+    hits = 0
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        header = f"{'run':>4}{'upload':>12}{'latency s':>11}{'transcription':>15}{'summary':>9}{'whisper':>9}{'llm calls':>11}"
+        print(header)
+        print("-" * len(header))
+        for i in range(args.runs):
+            patient = {**fakes.SAMPLE_PATIENT, "basicHealthProfile": {
+                **fakes.SAMPLE_PATIENT["basicHealthProfile"], "weight": {"value": 78 + i, "unit": "kg"}}}
+            filename, audio = variants[i % len(variants)]
+            before = dict(backends.calls)
+            start = time.perf_counter()
+            response = await client.post(
+                "/api/v1/consultation/process",
+                files={"file": (filename, audio, "application/octet-stream")},
+                data={"patient_data": json.dumps(patient)}
+            )
+            elapsed = time.perf_counter() - start
+            body = response.json()
+            cache = body.get("cache", {})
+            whisper = backends.calls["whisper"] - before.get("whisper", 0)
+            llm = sum(v - before.get(k, 0) for k, v in backends.calls.items() if k.startswith("llm:"))
+            hits += cache.get("transcription") == "hit"
+            print(f"{i + 1:>4}{filename:>12}{elapsed:>11.2f}{cache.get('transcription', '-'):>15}{cache.get('summary', '-'):>9}"
+                  f"{whisper:>9}{llm:>11}")
+        if result_cache.result_cache.store is not None:
+            print(f"\ntranscription hit rate: {hits}/{args.runs}")
+            print(f"cache: {await result_cache.result_cache.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=20, help="Recording length")
+    parser.add_argument("--cache", default="memory", help="RESULT_CACHE spec: off, memory or sqlite:<path>")
+    parser.add_argument("--formats", default="wav", help="Containers to cycle through: wav, flac, webm, ogg")
+    parser.add_argument("--llm-latency", default="const:0.8")
+    parser.add_argument("--whisper-latency", default="const:1.5")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
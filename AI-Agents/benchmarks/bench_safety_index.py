@@ -0,0 +1,94 @@
+"""
+Measure clinical safety index build time and prescription validation cost.
+
+Builds the index from the bundled data file and checks it on hand-labelled
+prescriptions (issues that must and must not be reported), then validates
+seeded random prescriptions of increasing size against a patient on many
+current medications with several allergies, reporting microseconds per
+validation. Exits non-zero if any labelled case fails.
+
+    python benchmarks/bench_safety_index.py [iterations]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from safety_index import SafetyIndex, DATA_PATH
+
+SIZES = [3, 10, 50, 200, 1000]
+CURRENT_MEDICATIONS = 20
+
+# (label, prescribed names, current medications, allergies, expected (type, medicine index, with) issues)
+CASES = [
+    ("combination brand plus its ingredient", ["Combiflam", "Dolo 650"], [], [],
+     {("duplicate_therapy", 1, "Combiflam")}),
+    ("same generic under two brands", ["Crocin 500mg", "Calpol 650mg"], [], [],
+     {("duplicate_therapy", 1, "Crocin 500mg")}),
+    ("combination brand already taken", ["Dolo 650"], ["Combiflam"], [],
+     {("duplicate_therapy", 0, "paracetamol")}),
+    ("distinct drugs", ["Dolo 650", "Amoxicillin 500mg"], [], [], set()),
+]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def check(index, case):
+    label, prescribed, current, allergies, expected = case
+    result = index.validate([{"name": name} for name in prescribed], current, allergies)
+    got = {(i["type"], i["medicine_index"], i["with"]) for i in result["issues"] if i["type"] == "duplicate_therapy"}
+    problems = []
+    if expected - got:
+        problems.append(f"missed {sorted(expected - got)}")
+    if got - expected:
+        problems.append(f"unexpected {sorted(got - expected)}")
+    return problems
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    index = SafetyIndex.load(DATA_PATH)
+    print(f"index build: {(time.perf_counter() - start) * 1000:.2f} ms "
+          f"({len(index.drug_keys)} drugs, {sum(len(v) for v in index.interactions.values()) // 2} interaction rules)\n")
+
+    failures = 0
+    for case in CASES:
+        problems = check(index, case)
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok':<6}{case[0]}")
+        for problem in problems:
+            print(f"        {problem}")
+    print(f"{len(CASES) - failures}/{len(CASES)} cases pass\n")
+
+    generics = sorted(index.drug_keys)
+    current = [{"name": f"{g.title()} 10mg", "dosage": "10mg"} for g in rng.sample(generics, CURRENT_MEDICATIONS)]
+    allergies = [{"allergen": a, "severity": "Severe"} for a in ["Penicillin", "Sulfa drugs", "Codeine"]]
+
+    header = f"{'medicines':>10}{'mean us':>12}{'p50 us':>12}{'p99 us':>12}{'issues':>9}"
+    print(header)
+    print("-" * len(header))
+    for size in SIZES:
+        prescription = [
+            {"name": f"{g.title()} 500mg", "generic_name": g}
+            for g in (rng.choice(generics) for _ in range(size))
+        ]
+        samples = []
+        for _ in range(iterations):
+            t = time.perf_counter_ns()
+            result = index.validate(prescription, current, allergies)
+            samples.append((time.perf_counter_ns() - t) / 1000)
+        print(f"{size:>10}{sum(samples) / len(samples):>12.1f}{percentile(samples, 0.5):>12.1f}"
+              f"{percentile(samples, 0.99):>12.1f}{len(result['issues']):>9}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
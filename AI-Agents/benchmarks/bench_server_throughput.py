@@ -0,0 +1,164 @@
+"""
+Compare throughput of the dev server with the production launcher.
+
+Starts each server in a subprocess with fake backends installed, drives it
+over real TCP with concurrent scenario clients, then sends SIGTERM while
+requests are in flight to check that they drain instead of failing.
+
+    python benchmarks/bench_server_throughput.py --workers 4 --requests 400 --concurrency 32
+    python benchmarks/bench_server_throughput.py --servers prod --scenario interview
+"""
+import os
+import sys
+import time
+import json
+import signal
+import asyncio
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+# --- Server side (runs in the subprocess) ---
+
+def serve(args):
+    import fakes
+    fakes.install(llm=args.llm_latency, whisper=args.llm_latency, mongo="const:0.002", extract=args.llm_latency)
+    if args.serve == "dev":
+        import uvicorn
+        from app import app
+        uvicorn.run(app, host="127.0.0.1", port=args.port, access_log=False)
+    else:
+        import serve as launcher
+        sys.argv = ["serve.py", "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers),
+                    "--graceful-timeout", "10"]
+        launcher.main()
+
+
+# --- Client side ---
+
+async def wait_ready(base_url: str, timeout: float = 60.0):
+    import httpx
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready")
+
+
+async def drive(base_url: str, scenario, requests: int, concurrency: int):
+    import httpx
+    from run_load import percentile
+
+    latencies, errors = [], 0
+    remaining = requests
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def worker(client):
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await scenario(client)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        wall = time.perf_counter() - start
+    return {
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "errors": errors,
+    }
+
+
+async def drain_check(proc, base_url: str, inflight: int):
+    """SIGTERM with `inflight` requests outstanding; count how many still succeed"""
+    import httpx
+    from run_load import agent_chat
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        tasks = [asyncio.create_task(agent_chat(client)) for _ in range(inflight)]
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.to_thread(proc.wait, 60)
+    return {
+        "inflight": inflight,
+        "completed": sum(1 for r in results if not isinstance(r, Exception)),
+        "shutdown_seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+async def bench(args, server: str, port: int):
+    from run_load import SCENARIOS
+
+    cmd = [sys.executable, os.path.abspath(__file__), "--serve", server, "--port", str(port),
+           "--workers", str(args.workers), "--llm-latency", args.llm_latency]
+    env = {**os.environ, "JOB_STORE": "memory"}
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        await wait_ready(base_url)
+        await drive(base_url, SCENARIOS[args.scenario], min(20, args.requests), args.concurrency)  # warm up
+        result = await drive(base_url, SCENARIOS[args.scenario], args.requests, args.concurrency)
+        result["drain"] = await drain_check(proc, base_url, args.concurrency)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+    return result
+
+
+async def main_async(args):
+    results = {}
+    for i, server in enumerate(args.servers.split(",")):
+        results[server] = await bench(args, server, args.port + i)
+
+    header = f"{'server':<8}{'workers':>8}{'rps':>9}{'p50 ms':>10}{'p99 ms':>10}{'err':>5}{'drained':>10}{'stop s':>8}"
+    print(header)
+    print("-" * len(header))
+    for server, r in results.items():
+        drain = r["drain"]
+        workers = 1 if server == "dev" else args.workers
+        print(f"{server:<8}{workers:>8}{r['throughput_rps']:>9}{r['p50_ms']:>10}{r['p99_ms']:>10}{r['errors']:>5}"
+              f"{drain['completed']:>5}/{drain['inflight']:<4}{drain['shutdown_seconds']:>8}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", default="dev,prod", help="Comma-separated: dev, prod")
+    parser.add_argument("--scenario", default="agent_chat")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--llm-latency", default="const:0.05")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--serve", choices=["dev", "prod"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measure the per-stage cost of metrics + tracing instrumentation.
+
+Runs the same instrumented block with tracing disabled, then enabled with
+the file exporter, and reports nanoseconds per stage against a bare loop.
+
+    python benchmarks/bench_tracing_overhead.py [iterations]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tracing
+from metrics import stage
+
+
+def bare(n: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        pass
+    return (time.perf_counter_ns() - start) / n
+
+
+def staged(n: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        with stage("llm_call"):
+            pass
+    return (time.perf_counter_ns() - start) / n
+
+
+def raw_span(n: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        with tracing.span("bench"):
+            pass
+    return (time.perf_counter_ns() - start) / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    results = {"bare loop": bare(n)}
+
+    tracing.configure("none")
+    results["span() disabled"] = raw_span(n)
+    results["stage() tracing disabled"] = staged(n)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["TRACING_FILE"] = os.path.join(tmp, "traces.jsonl")
+        tracing.configure("file")
+        if tracing.enabled():
+            results["span() enabled"] = raw_span(n // 10)
+            results["stage() tracing enabled"] = staged(n // 10)
+        else:
+            print("opentelemetry-sdk not installed; skipping enabled run")
+
+    print(f"{'case':<28}{'ns/op':>12}")
+    for name, ns in results.items():
+        print(f"{name:<28}{ns:>12.0f}")
+
+    overhead = results["span() disabled"] - results["bare loop"]
+    print(f"\nDisabled tracing adds ~{overhead:.0f}ns per span "
+          f"({overhead / 1e6 * 10:.5f}ms across 10 stages per request)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Deterministic fake backends for offline benchmarking.
+
+install() swaps the LLM route providers (groq, gemini), the Groq Whisper
+client, the Motor database, PDF/OCR text extraction and the local NER models
+for in-process fakes with configurable latency distributions and canned,
+schema-valid outputs.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("JOB_STORE", "memory")
+os.environ.setdefault("RESULT_CACHE", "off")
+os.environ.setdefault("QUOTA_STORE", "off")
+os.environ.setdefault("FINDINGS_STORE", "memory")
+os.environ.setdefault("ENTITY_LEDGER_STORE", "memory")
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+# --- Latency Distributions ---
+
+
+class Latency:
+    """
+    Seeded latency sampler. Spec formats:
+        const:0.2            - always 0.2s
+        uniform:0.1,0.5      - uniform between bounds
+        lognormal:0.8,0.3    - lognormal with median 0.8s and sigma 0.3
+    """
+
+    def __init__(self, spec: str, seed: int = 0):
+        self.spec = spec
+        kind, _, args = spec.partition(":")
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "const":
+                return self.args[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(self.args[0], self.args[1])
+            if self.kind == "lognormal":
+                import math
+                return self._rng.lognormvariate(math.log(self.args[0]), self.args[1])
+        raise ValueError(f"Unknown latency spec '{self.spec}'")
+
+
+# --- Canned Outputs ---
+
+SAMPLE_REPORT_TEXT = """COMPLETE BLOOD COUNT
+Hemoglobin 11.2 g/dL 13.0-17.0
+WBC Count 11800 /cumm 4000-11000
+Platelet Count 2.5 lakh/cumm 1.5-4.1
+Fasting Blood Sugar 132 mg/dL 70-100
+HbA1c 7.1 % 4.0-5.6
+"""
+
+SAMPLE_TRANSCRIPT = (
+    "Doctor: What brings you in today? Patient: I have had a fever and sore throat for three days, "
+    "and some body ache. Doctor: Any cough? Patient: A mild dry cough. Doctor: Your throat looks "
+    "inflamed. This looks like acute pharyngitis. I'll start you on paracetamol and an antibiotic. "
+    "Come back in five days if the fever persists."
+)
+
+SAMPLE_PATIENT = {
+    "basicHealthProfile": {
+        "gender": "Male", "dateOfBirth": "1988-04-12T00:00:00.000Z", "bloodGroup": "B+",
+        "height": {"value": 175, "unit": "cm"}, "weight": {"value": 78, "unit": "kg"}, "bmi": 25.5
+    },
+    "medicalHistory": {
+        "chronicDiseases": [{"name": "Type 2 Diabetes", "diagnosedYear": 2019}],
+        "previousSurgeries": [{"name": "Appendectomy", "year": 2010}],
+        "hospitalizations": [],
+        "familyMedicalHistory": [{"relation": "Father", "condition": "Hypertension"}]
+    },
+    "currentHealthStatus": {
+        "currentMedications": [{"name": "Metformin", "dosage": "500mg", "frequency": "twice daily"}],
+        "allergies": [{"allergen": "Penicillin", "severity": "Severe", "reaction": "Rash"}],
+        "ongoingTreatments": [], "smokingStatus": "Never", "alcoholConsumption": "Occasional",
+        "dietType": "Vegetarian", "exerciseFrequency": "3-4 times a week", "sleepHours": {"average": 7}
+    },
+    "telemedicinePreferences": {"languagePreference": "English", "emergencyContacts": []}
+}
+
+REPORT_ANALYSIS = {
+    "report_type": "Complete Blood Count",
+    "findings": [
+        {"parameter": "Hemoglobin", "value": "11.2 g/dL", "normal_range": "13.0-17.0", "status": "Low"},
+        {"parameter": "WBC Count", "value": "11800 /cumm", "normal_range": "4000-11000", "status": "High"},
+        {"parameter": "HbA1c", "value": "7.1 %", "normal_range": "4.0-5.6", "status": "High"},
+    ],
+    "summary": "Mild anaemia with raised white cells and poorly controlled blood sugar.",
+    "recommendations": ["Discuss iron supplementation with your doctor", "Review diabetes medication"],
+    "concerns": ["Raised HbA1c indicates uncontrolled diabetes"],
+}
+
+REPORT_NARRATIVE = {key: REPORT_ANALYSIS[key] for key in ("summary", "recommendations", "concerns")}
+
+CANNED: Dict[str, object] = {
+    "triage": {
+        "symptoms_identified": ["fever", "sore throat"],
+        "potential_conditions": ["Pharyngitis", "Viral upper respiratory infection"],
+        "severity_assessment": "Mild",
+        "triage_advice": "Rest, fluids, and see a doctor if breathing becomes difficult."
+    },
+    "next_question": {
+        "question": "How long have you had the fever?",
+        "options": ["Less than a day", "1-3 days", "4-7 days", "More than a week"],
+        "rationale": "Duration helps distinguish viral from bacterial causes.",
+        "is_final": False
+    },
+    "entity_extraction": {
+        "entities": [
+            {"entity": "fever", "category": "Symptom", "confidence": 0.95},
+            {"entity": "3 days", "category": "Duration", "confidence": 0.9}
+        ]
+    },
+    "final_summary": {
+        "possible_conditions": [{"name": "Acute pharyngitis", "probability": 0.7, "description": "Throat infection"}],
+        "recommendations": ["Warm salt-water gargles", "Paracetamol for fever"],
+        "summary_text": "Three days of fever and sore throat, most consistent with acute pharyngitis.",
+        "specialist_recommendation": "General Physician"
+    },
+    "consultation_summary": {
+        "doctor_summary": "3/7 history of pyrexia, odynophagia and myalgia. Pharyngeal erythema. Impression: acute pharyngitis.",
+        "patient_summary": "You have a throat infection. Take the medicines as prescribed and rest.",
+        "key_symptoms": ["fever", "sore throat", "body ache", "dry cough"],
+        "diagnosis_discussed": "Acute pharyngitis",
+        "medications_prescribed": ["Paracetamol", "Azithromycin"],
+        "follow_up_instructions": ["Return in 5 days if fever persists"],
+        "important_notes": []
+    },
+    "prescription": {
+        "medicines": [
+            {
+                "name": "Paracetamol 500mg", "generic_name": "Paracetamol", "dosage": "1 tablet",
+                "frequency": {"morning": True, "afternoon": True, "night": True},
+                "duration_days": 5, "instructions": "After meals", "warnings": "Do not exceed 4g per day"
+            },
+            {
+                "name": "Azithromycin 500mg", "generic_name": "Azithromycin", "dosage": "1 tablet",
+                "frequency": {"morning": True, "afternoon": False, "night": False},
+                "duration_days": 3, "instructions": "One hour before food", "warnings": "May cause loose stools"
+            }
+        ],
+        "follow_up_date": None,
+        "additional_instructions": ["Drink plenty of fluids"],
+        "contraindications": ["Penicillin allergy - avoid amoxicillin"]
+    },
+    "next_question_text": "How high has your temperature been, and at what time of day is it worst? "
+                          "(e.g. 100F in the evenings, 102F all day)",
+    "final_summary_text": "Case Summary: 3 days of fever, sore throat and body ache.\n"
+                          "Differential Diagnoses: Acute pharyngitis 55%, Viral URTI 25%, Influenza 10%, "
+                          "Infectious mononucleosis 5%, COVID-19 5%.\n"
+                          "Recommended Tests: CBC, throat swab.\nUrgency Level: Routine.\n"
+                          "Specialist Recommendation: General Physician.\n"
+                          "Red Flags: difficulty breathing, drooling, neck stiffness.",
+    "report_analysis": REPORT_ANALYSIS,
+    "report_narrative": REPORT_NARRATIVE,
+    "agent_chat": "Hello! Based on your profile you are currently taking Metformin 500mg twice daily. "
+                  "Please consult your doctor before making any changes.",
+}
+
+
+def canned_response(task: str, prompt_text: str) -> str:
+    """Schema-valid completion for a route task"""
+    if task in ("report_analysis", "report_narrative") and "=== REPORT" in prompt_text:
+        count = prompt_text.count("=== REPORT")
+        output = REPORT_ANALYSIS if task == "report_analysis" else REPORT_NARRATIVE
+        return json.dumps({"reports": [{**output, "report_index": i} for i in range(count)]})
+    output = CANNED.get(task, {})
+    return output if isinstance(output, str) else json.dumps(output)
+
+
+# Token-classification output shaped like a transformers "ner" pipeline
+NER_OUTPUT = [
+    {"entity_group": "Sign_symptom", "word": "fever", "score": 0.97},
+    {"entity_group": "Sign_symptom", "word": "sore throat", "score": 0.93},
+    {"entity_group": "Duration", "word": "three days", "score": 0.88},
+    {"entity_group": "PER", "word": "Asha", "score": 0.99},
+]
+
+
+# --- Fake Backends ---
+
+
+class FakeBackends:
+    """Holds latency models and call counters for all installed fakes"""
+
+    def __init__(self, llm: str = "lognormal:0.8,0.3", whisper: str = "lognormal:1.5,0.3",
+                 mongo: str = "lognormal:0.02,0.4", extract: str = "lognormal:0.15,0.3", seed: int = 0,
+                 llm_capacity: Optional[int] = None):
+        self.latency = {
+            "llm": Latency(llm, seed),
+            "whisper": Latency(whisper, seed + 1),
+            "mongo": Latency(mongo, seed + 2),
+            "extract": Latency(extract, seed + 3),
+        }
+        self.calls = Counter()
+        self.tokens = Counter()
+        # Provider-side concurrency limit: calls beyond it wait their turn
+        self.llm_slots = threading.BoundedSemaphore(llm_capacity) if llm_capacity else None
+
+    # LLM: replaces the groq and gemini route providers
+    def llm_factory(self, model: str, cfg: Dict):
+        task = cfg.get("task")
+
+        def respond(text):
+            content = canned_response(task, text)
+            usage = {
+                "input_tokens": len(text) // 4,
+                "output_tokens": len(content) // 4,
+                "total_tokens": (len(text) + len(content)) // 4,
+            }
+            self.calls[f"llm:{task}"] += 1
+            self.tokens["input"] += usage["input_tokens"]
+            self.tokens["output"] += usage["output_tokens"]
+            return AIMessage(content=content, usage_metadata=usage)
+
+        def call(prompt_value):
+            text = prompt_value.to_string() if hasattr(prompt_value, "to_string") else str(prompt_value)
+            if self.llm_slots:
+                with self.llm_slots:
+                    time.sleep(self.latency["llm"].sample())
+            else:
+                time.sleep(self.latency["llm"].sample())
+            return respond(text)
+
+        async def acall(prompt_value):
+            # Streamed calls: tokens are only billed if the generation is not cancelled
+            text = prompt_value.to_string() if hasattr(prompt_value, "to_string") else str(prompt_value)
+            if self.llm_slots:
+                await asyncio.to_thread(self.llm_slots.acquire)
+            try:
+                await asyncio.sleep(self.latency["llm"].sample())
+            except asyncio.CancelledError:
+                self.calls[f"llm_cancelled:{task}"] += 1
+                raise
+            finally:
+                if self.llm_slots:
+                    self.llm_slots.release()
+            return respond(text)
+
+        return RunnableLambda(call, afunc=acall)
+
+    # Whisper: replaces groq.Groq in the consultation handler
+    def groq_client(self, api_key: Optional[str] = None, **kwargs):
+        backends = self
+
+        class _Transcriptions:
+            def create(self, file, model, response_format="text", language=None, **kw):
+                time.sleep(backends.latency["whisper"].sample())
+                backends.calls["whisper"] += 1
+                return SAMPLE_TRANSCRIPT
+
+        class _Audio:
+            transcriptions = _Transcriptions()
+
+        class _Client:
+            audio = _Audio()
+
+        return _Client()
+
+    # NER: replaces the transformers pipelines in medical_ner
+    def ner_pipeline(self, text: str):
+        time.sleep(self.latency["extract"].sample())
+        self.calls["ner"] += 1
+        return [dict(item) for item in NER_OUTPUT if item["word"].split()[0].lower() in text.lower()]
+
+    # Motor: replaces database.db
+    def motor_db(self):
+        backends = self
+
+        class _Collection:
+            def __init__(self, name):
+                self.name = name
+
+            async def find_one(self, query, *args, **kwargs):
+                await asyncio.sleep(backends.latency["mongo"].sample())
+                backends.calls[f"mongo:{self.name}"] += 1
+                if self.name == "users":
+                    return {"_id": query.get("_id"), "name": "Test Patient"}
+                if self.name == "patientonboardings":
+                    return {"_id": "665f1c2e8f1b2c3d4e5f6a7b", "userId": query.get("userId"), **SAMPLE_PATIENT}
+                return None
+
+        class _Database:
+            def __getattr__(self, name):
+                return _Collection(name)
+
+            def __getitem__(self, name):
+                return _Collection(name)
+
+        return _Database()
+
+    # PDF / OCR: replaces text extraction in report_analyzer
+    def extract_text(self, file_obj, *args):
+        time.sleep(self.latency["extract"].sample())
+        self.calls["extract"] += 1
+        return SAMPLE_REPORT_TEXT
+
+
+def install(**latency) -> FakeBackends:
+    """Patch every external dependency of app.py with fakes; call before importing app"""
+    import llm_router
+    import database
+    import medical_ner
+    import report_analyzer
+    import consulatation_handler
+
+    fakes = FakeBackends(**latency)
+    llm_router.register_backend("groq", fakes.llm_factory)
+    llm_router.register_backend("gemini", fakes.llm_factory)
+    llm_router.router._models.clear()
+    consulatation_handler.Groq = fakes.groq_client
+    database.db = fakes.motor_db()
+    report_analyzer.extract_text_from_pdf = fakes.extract_text
+    report_analyzer.extract_text_from_image = fakes.extract_text
+    medical_ner._pipelines = [fakes.ner_pipeline]
+    return fakes
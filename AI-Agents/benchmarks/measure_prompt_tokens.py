@@ -0,0 +1,257 @@
+"""
+Prompt token measurement for the compact prompt contexts.
+
+Renders real-shaped patient records the old way (str(patient_info), the
+agent's N/A-filled template and the prescription template) and with
+prompt_context.compact_context, and a
+sample interview as a transcript and as an entity ledger, then reports the
+token count of each prompt input. Counts use tiktoken's
+cl100k_base encoding when installed, otherwise a chars/4 estimate.
+
+    python benchmarks/measure_prompt_tokens.py
+    python benchmarks/measure_prompt_tokens.py --show
+"""
+import os
+import sys
+import asyncio
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+from prompt_context import compact_context, compact_history
+from entity_ledger import ledgers, interview_context
+
+# Shape of a patientonboardings document as returned by database.get_patient_data:
+# nested _ids, datetimes, empty sub-documents and onboarding bookkeeping included.
+MONGO_PATIENT = {
+    "_id": "665f1c2e8f1b2c3d4e5f6a7b",
+    "userId": "665f1c2e8f1b2c3d4e5f6a7c",
+    "patientName": "Asha Verma",
+    "basicHealthProfile": {
+        "height": {"value": 162, "unit": "cm"}, "weight": {"value": 64, "unit": "kg"}, "bmi": 24.4,
+        "bloodGroup": "O+", "gender": "Female", "dateOfBirth": datetime(1979, 9, 3),
+    },
+    "medicalHistory": {
+        "chronicDiseases": [
+            {"_id": "6660a1", "name": "Hypertension", "diagnosedYear": 2015, "notes": ""},
+            {"_id": "6660a2", "name": "Hypothyroidism", "diagnosedYear": 2018, "notes": ""},
+        ],
+        "previousSurgeries": [{"_id": "6660a3", "name": "C-section", "year": 2008, "notes": ""}],
+        "hospitalizations": [],
+        "familyMedicalHistory": [
+            {"_id": "6660a4", "relation": "Mother", "condition": "Type 2 Diabetes", "notes": ""},
+            {"_id": "6660a5", "relation": "Father", "condition": "Hypertension", "notes": ""},
+        ],
+    },
+    "currentHealthStatus": {
+        "currentMedications": [
+            {"_id": "6660b1", "name": "Amlodipine", "dosage": "5mg", "frequency": "once daily",
+             "startDate": datetime(2015, 6, 1), "prescribedBy": ""},
+            {"_id": "6660b2", "name": "Levothyroxine", "dosage": "50mcg", "frequency": "once daily",
+             "startDate": datetime(2018, 2, 10), "prescribedBy": ""},
+        ],
+        "allergies": [{"_id": "6660b3", "allergen": "Sulfa drugs", "reaction": "Hives", "severity": "Moderate"}],
+        "ongoingTreatments": [
+            {"_id": "6660b4", "condition": "Hypertension", "treatmentType": "Medication", "provider": ""},
+        ],
+        "smokingStatus": "Never",
+        "smokingDetails": {"cigarettesPerDay": None, "yearsSmoked": None, "quitDate": None},
+        "alcoholConsumption": "Never",
+        "alcoholDetails": {"drinksPerWeek": None},
+        "exerciseFrequency": "1-2 times a week", "exerciseType": [],
+        "dietType": "Vegetarian",
+        "sleepHours": {"average": 6, "quality": "Fair"},
+    },
+    "telemedicinePreferences": {
+        "preferredConsultationType": ["Video"], "preferredConsultationTime": [],
+        "languagePreference": "Hindi", "specialistPreferences": [],
+        "emergencyContacts": {
+            "primary": {"name": "Rahul Verma", "relationship": "Husband", "phone": "+91 98xxxxxx10"},
+            "secondary": {"name": "", "relationship": "", "phone": ""},
+        },
+        "notificationPreferences": {"email": True, "sms": True, "push": False},
+    },
+    "onboardingProgress": {"currentStep": 5, "completedSteps": [1, 2, 3, 4, 5], "isComplete": True},
+    "createdAt": datetime(2024, 5, 1, 10, 12), "updatedAt": datetime(2024, 6, 2, 8, 30), "__v": 0,
+}
+
+HISTORY = [
+    {"role": "user", "content": "Fever and sore throat for 3 days"},
+    {"role": "assistant", "content": "How high has the fever been?"},
+    {"role": "user", "content": "  Around 101F,   mostly in the evenings  "},
+    {"role": "assistant", "content": "Do you have a cough?"},
+    {"role": "user", "content": "Yes, mild dry cough"},
+    {"role": "user", "content": "Yes, mild dry cough"},
+]
+
+
+# A full interview: long free-text answers and the entities extracted from each
+INTERVIEW = [
+    ("Fever and sore throat for 3 days, and my whole body is aching since yesterday.", [
+        {"entity": "fever", "category": "Symptom", "confidence": 0.95},
+        {"entity": "sore throat", "category": "Symptom", "confidence": 0.95},
+        {"entity": "3 days", "category": "Duration", "confidence": 0.9},
+        {"entity": "body ache", "category": "Symptom", "confidence": 0.85}]),
+    ("How high has your temperature been?", None),
+    ("It started as a scratchy throat in the evening, then the fever came the next morning, around 101F, "
+     "and it keeps coming back every evening even after I take paracetamol.", [
+        {"entity": "Fever", "category": "Symptom", "confidence": 0.9},
+        {"entity": "101F", "category": "Severity", "confidence": 0.8},
+        {"entity": "paracetamol", "category": "Medication", "confidence": 0.9}]),
+    ("Do you have a cough or a runny nose?", None),
+    ("Yes, I have a mild dry cough, mostly at night, no phlegm, and it is not getting any worse. "
+     "My nose is a little blocked in the mornings.", [
+        {"entity": "dry cough", "category": "Symptom", "confidence": 0.9},
+        {"entity": "nasal congestion", "category": "Symptom", "confidence": 0.7}]),
+    ("Any difficulty breathing or chest pain?", None),
+    ("No, I haven't had any breathing trouble or chest pain, I just feel tired and achy all over, "
+     "and swallowing hurts on the right side of my throat.", [
+        {"entity": "fatigue", "category": "Symptom", "confidence": 0.8},
+        {"entity": "body aches", "category": "Symptom", "confidence": 0.8},
+        {"entity": "painful swallowing", "category": "Symptom", "confidence": 0.85}]),
+]
+
+
+def interview_cases():
+    """Transcript vs entity ledger for the interview prompts"""
+    history = []
+    asyncio.run(ledgers.drop("measure"))
+    for text, entities in INTERVIEW:
+        history.append({"role": "user" if entities else "assistant", "content": text})
+        if entities:
+            asyncio.run(ledgers.add("measure", text, entities, len(history) - 1))
+    yield "interview", "next_question", compact_history(history), asyncio.run(
+        interview_context(history, "measure", "ledger"))
+    yield "interview", "final_summary", compact_history(history), asyncio.run(
+        interview_context(history, "measure", "ledger", include_questions=False))
+
+
+def legacy_agent_context(patient_data: dict) -> str:
+    """The per-field template chat_with_agent used before compact_context"""
+    return f"""
+        CURRENT PATIENT CONTEXT:
+        Name: {patient_data.get('patientName', 'Patient')}
+        ID: {patient_data.get('_id')}
+        User ID: {patient_data.get('userId')}
+
+        BASIC HEALTH PROFILE:
+        - Gender: {patient_data.get('basicHealthProfile', {}).get('gender', 'N/A')}
+        - Date of Birth: {patient_data.get('basicHealthProfile', {}).get('dateOfBirth', 'N/A')}
+        - Blood Group: {patient_data.get('basicHealthProfile', {}).get('bloodGroup', 'N/A')}
+        - Height: {patient_data.get('basicHealthProfile', {}).get('height', {})}
+        - Weight: {patient_data.get('basicHealthProfile', {}).get('weight', {})}
+        - BMI: {patient_data.get('basicHealthProfile', {}).get('bmi', 'N/A')}
+
+        MEDICAL HISTORY:
+        - Chronic Diseases: {patient_data.get('medicalHistory', {}).get('chronicDiseases', [])}
+        - Previous Surgeries: {patient_data.get('medicalHistory', {}).get('previousSurgeries', [])}
+        - Hospitalizations: {patient_data.get('medicalHistory', {}).get('hospitalizations', [])}
+        - Family Medical History: {patient_data.get('medicalHistory', {}).get('familyMedicalHistory', [])}
+
+        CURRENT HEALTH STATUS:
+        - Current Medications: {patient_data.get('currentHealthStatus', {}).get('currentMedications', [])}
+        - Allergies: {patient_data.get('currentHealthStatus', {}).get('allergies', [])}
+        - Ongoing Treatments: {patient_data.get('currentHealthStatus', {}).get('ongoingTreatments', [])}
+        - Smoking Status: {patient_data.get('currentHealthStatus', {}).get('smokingStatus', 'N/A')}
+        - Alcohol Consumption: {patient_data.get('currentHealthStatus', {}).get('alcoholConsumption', 'N/A')}
+        - Diet Type: {patient_data.get('currentHealthStatus', {}).get('dietType', 'N/A')}
+        - Exercise Frequency: {patient_data.get('currentHealthStatus', {}).get('exerciseFrequency', 'N/A')}
+        - Sleep Hours: {patient_data.get('currentHealthStatus', {}).get('sleepHours', {})}
+
+        PREFERENCES:
+        - Language Preference: {patient_data.get('telemedicinePreferences', {}).get('languagePreference', 'English')}
+        - Emergency Contacts: {patient_data.get('telemedicinePreferences', {}).get('emergencyContacts', {})}
+        """
+
+
+def legacy_prescription_context(patient_data: dict) -> str:
+    """The per-field template generate_prescription used before compact_context"""
+    basic_health = patient_data.get('basicHealthProfile', {})
+    medical_history = patient_data.get('medicalHistory', {})
+    current_health = patient_data.get('currentHealthStatus', {})
+    dob = basic_health.get('dateOfBirth')
+    if isinstance(dob, str):
+        dob = datetime.fromisoformat(dob.replace('Z', '+00:00'))
+    today = datetime.now()
+    age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day)) if dob else "Unknown"
+    return f"""
+**Patient Age:** {age} years
+**Weight:** {basic_health.get('weight', {}).get('value', 'Unknown')} kg
+**Blood Group:** {basic_health.get('bloodGroup', 'Unknown')}
+**Gender:** {basic_health.get('gender', 'Unknown')}
+
+**Chronic Diseases:** {', '.join([d['name'] for d in medical_history.get('chronicDiseases', [])]) or 'None'}
+
+**Current Medications:** {', '.join([m['name'] + ' (' + m['dosage'] + ')' for m in current_health.get('currentMedications', [])]) or 'None'}
+
+**Allergies:** {', '.join([a['allergen'] + ' (Severity: ' + a['severity'] + ')' for a in current_health.get('allergies', [])]) or 'None'}
+
+**Smoking Status:** {current_health.get('smokingStatus', 'Unknown')}
+**Alcohol Consumption:** {current_health.get('alcoholConsumption', 'Unknown')}
+
+**Previous Surgeries:** {', '.join([s['name'] + ' (' + str(s['year']) + ')' for s in medical_history.get('previousSurgeries', [])]) or 'None'}
+
+**Family Medical History:** {', '.join([f['relation'] + ': ' + f['condition'] for f in medical_history.get('familyMedicalHistory', [])]) or 'None'}
+"""
+
+
+def legacy_history(history) -> str:
+    return "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
+
+
+def token_counter():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return (lambda text: len(encoding.encode(text))), "tiktoken cl100k_base"
+    except Exception:
+        return (lambda text: max(1, len(text) // 4)), "chars/4 estimate"
+
+
+def cases():
+    """(record, endpoint, old rendering, new rendering)"""
+    records = {
+        "sample": {"patientName": "Test Patient", **fakes.SAMPLE_PATIENT},
+        "mongo": MONGO_PATIENT,
+        "client_info": {"name": "Asha", "age": 44, "gender": "Female", "symptoms": [], "notes": "N/A"},
+    }
+    for label, record in records.items():
+        for endpoint in ("next_question", "final_summary"):
+            old = f"Patient Info: {str(record)}\n{legacy_history(HISTORY)}"
+            new = f"Patient Info: {compact_context(record, endpoint)}\n{compact_history(HISTORY)}"
+            yield label, endpoint, old, new
+        if label != "client_info":
+            new = "CURRENT PATIENT CONTEXT:\n" + compact_context(
+                {"patientName": record.get("patientName", "Patient"), **record}, "agent_chat"
+            )
+            yield label, "agent_chat", legacy_agent_context(record), new
+            yield label, "prescription", legacy_prescription_context(record), compact_context(record, "prescription")
+    yield from interview_cases()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--show", action="store_true", help="Print both renderings for each case")
+    args = parser.parse_args()
+
+    count, method = token_counter()
+    print(f"token counts: {method}\n")
+    header = f"{'record':<14}{'endpoint':<16}{'before':>8}{'after':>8}{'saved':>9}"
+    print(header)
+    print("-" * len(header))
+    total_old = total_new = 0
+    for label, endpoint, old, new in cases():
+        before, after = count(old), count(new)
+        total_old += before
+        total_new += after
+        print(f"{label:<14}{endpoint:<16}{before:>8}{after:>8}{(1 - after / before) * 100:>8.1f}%")
+        if args.show:
+            print(f"\n--- before ---\n{old}\n--- after ---\n{new}\n")
+    print("-" * len(header))
+    print(f"{'total':<30}{total_old:>8}{total_new:>8}{(1 - total_new / total_old) * 100:>8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
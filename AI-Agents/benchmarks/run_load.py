@@ -0,0 +1,205 @@
+"""
+Scripted load scenarios against app.py with fake backends.
+
+Every endpoint runs in-process through httpx's ASGI transport, so no Groq,
+Gemini or Mongo access is needed. Reports throughput, p50/p95/p99 latency
+and peak memory per scenario.
+
+    python benchmarks/run_load.py --scenario all --concurrency 16 --requests 200
+    python benchmarks/run_load.py --scenario consultation --llm-latency const:0.5
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import resource
+import tracemalloc
+from typing import Awaitable, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+
+USER_ID = "665f1c2e8f1b2c3d4e5f6a7c"
+
+
+# --- Scenarios ---
+# Each scenario is one logical user action; it may span several requests.
+
+async def report_analysis(client):
+    r = await client.post(
+        "/ai/report-analyze",
+        files={"file": ("cbc.pdf", b"%PDF-1.4 fake", "application/pdf")},
+        data={"document_type": "Lab Report"}
+    )
+    r.raise_for_status()
+
+
+async def batch_report_analysis(client):
+    r = await client.post(
+        "/ai/report-analyze/batch",
+        files=[("files", (f"page{i}.pdf", b"%PDF-1.4 fake", "application/pdf")) for i in range(5)],
+        data={"document_type": "Lab Report"}
+    )
+    r.raise_for_status()
+
+
+async def consultation(client):
+    r = await client.post(
+        "/api/v1/consultation/process",
+        files={"file": ("visit.wav", b"RIFF" + b"\0" * 4096, "audio/wav")},
+        data={"patient_data": json.dumps(fakes.SAMPLE_PATIENT)}
+    )
+    r.raise_for_status()
+
+
+async def agent_chat(client):
+    r = await client.post("/api/v1/agent/chat", json={
+        "userId": USER_ID,
+        "message": "What medications am I on?",
+        "history": [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}]
+    })
+    r.raise_for_status()
+
+
+INTERVIEW_ANSWERS = [
+    "It started about three days ago, first a scratchy throat in the evening and then the fever came "
+    "the next morning, around 101F, and it comes back every evening even after paracetamol.",
+    "Yes, I have a mild dry cough, mostly at night, no phlegm, and it is not getting any worse.",
+    "No, I haven't had any breathing trouble or chest pain, I just feel tired and achy all over.",
+]
+
+
+async def interview(client):
+    session_id = uuid.uuid4().hex
+    r = await client.post("/initial-problem", json={"problem_text": "Fever and sore throat for 3 days"})
+    r.raise_for_status()
+    history = [{"role": "user", "content": "Fever and sore throat for 3 days"}]
+    for answer in INTERVIEW_ANSWERS:
+        r = await client.post("/next-question", json={
+            "history": history, "patient_info": fakes.SAMPLE_PATIENT, "session_id": session_id
+        })
+        r.raise_for_status()
+        history += [{"role": "assistant", "content": r.json()["question"]}, {"role": "user", "content": answer}]
+        r = await client.post("/extract-entities", json={"text": answer, "session_id": session_id,
+                                                          "turn": len(history) - 1})
+        r.raise_for_status()
+    r = await client.post("/final-summary", json={
+        "history": history, "patient_info": fakes.SAMPLE_PATIENT, "session_id": session_id
+    })
+    r.raise_for_status()
+
+
+SCENARIOS: Dict[str, Callable[..., Awaitable[None]]] = {
+    "report_analysis": report_analysis,
+    "batch_report_analysis": batch_report_analysis,
+    "consultation": consultation,
+    "agent_chat": agent_chat,
+    "interview": interview,
+}
+
+
+# --- Runner ---
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run_scenario(app, name: str, requests: int, concurrency: int) -> Dict:
+    import httpx
+
+    scenario = SCENARIOS[name]
+    latencies: List[float] = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    async def worker(client):
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                await scenario(client)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"  first error in {name}: {e}")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        tracemalloc.start()
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "scenario": name,
+        "requests": requests,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "peak_traced_mb": round(peak / 1e6, 2),
+    }
+
+
+async def main_async(args):
+    os.environ["INTERVIEW_CONTEXT"] = args.interview_context
+    backends = fakes.install(
+        llm=args.llm_latency, whisper=args.whisper_latency,
+        mongo=args.mongo_latency, extract=args.extract_latency, seed=args.seed
+    )
+    from app import app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    names = list(SCENARIOS) if args.scenario == "all" else args.scenario.split(",")
+    results = []
+    async with app.router.lifespan_context(app):
+        for name in names:
+            results.append(await run_scenario(app, name, args.requests, args.concurrency))
+
+    header = f"{'scenario':<24}{'reqs':>6}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['scenario']:<24}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>9}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['peak_traced_mb']:>9}")
+    print(f"\nmax RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    print(f"fake calls: {dict(backends.calls)}")
+    print(f"fake tokens: {dict(backends.tokens)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", default="all", help=f"all or comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.3")
+    parser.add_argument("--whisper-latency", default="lognormal:1.5,0.3")
+    parser.add_argument("--mongo-latency", default="lognormal:0.02,0.4")
+    parser.add_argument("--extract-latency", default="lognormal:0.15,0.3")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--interview-context", default="transcript", choices=["transcript", "ledger"],
+                        help="How the interview scenario's prompts see the conversation")
+    parser.add_argument("--json", help="Write results to this file")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
 import os
-from groq import Groq
-from langchain_groq import ChatGroq
+import logging
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.output_parsers import StrOutputParser
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
+from llm_router import router
+from medical_ner import extract_entities_ner
+from json_stream import RobustJsonOutputParser, stream_fields
+from prompt_context import compact_context, compact_history
+from entity_ledger import ledgers, interview_context
+
+logger = logging.getLogger(__name__)
+
+# Default interview backends; each request may override them.
+#   questions/summary: "structured" (JSON schema via the router) or "gemini"
+#                      (free-text prompts, formerly the Flask server.py)
+#   entities:          "llm" (router entity_extraction) or "ner" (local models)
+INTERVIEW_BACKEND = os.getenv("INTERVIEW_BACKEND", "structured")
+ENTITY_BACKEND = os.getenv("ENTITY_BACKEND", "llm")
 
 # --- Pydantic Models ---
 
@@ -27,6 +40,7 @@ class MedicalEntity(BaseModel):
     entity: str = Field(description="The extracted entity (e.g., 'headache', 'ibuprofen')")
     category: str = Field(description="Category: Symptom, Medication, Condition, Allergy, etc.")
     confidence: float = Field(description="Confidence score between 0 and 1")
+    negated: bool = Field(default=False, description="True when the text denies it (e.g. 'no fever', 'I don't smoke')")
 
 class ExtractedEntities(BaseModel):
     """List of extracted entities"""
@@ -41,17 +55,14 @@ class FinalSummary(BaseModel):
 
 # --- Logic ---
 
-def get_llm():
-    return ChatGroq(
-        model="llama-3.3-70b-versatile",
-        temperature=0.3,
-        groq_api_key=os.getenv("GROQ_API_KEY")
-    )
-
-async def analyze_initial_problem(problem_text: str) -> dict:
+async def analyze_initial_problem(problem_text: str, backend: Optional[str] = None,
+                                  session_id: Optional[str] = None) -> dict:
+    if (backend or INTERVIEW_BACKEND) == "ner":
+        # Keyword pass only: entities of the opening complaint, no LLM call
+        result = await extract_entities_from_text(problem_text, session_id, "ner")
+        return result if "error" in result else {"problem": problem_text, **result}
     try:
-        llm = get_llm()
-        parser = JsonOutputParser(pydantic_object=InitialAnalysis)
+        parser = RobustJsonOutputParser(pydantic_object=InitialAnalysis)
         
         prompt = ChatPromptTemplate.from_messages([
             ("system", """You are an expert medical AI assistant. Analyze the patient's initial symptom description.
@@ -62,84 +73,128 @@ async def analyze_initial_problem(problem_text: str) -> dict:
             ("user", "{problem_text}")
         ])
         
-        chain = prompt | llm | parser
-        result = chain.invoke({
+        result = await router.ainvoke("triage", prompt, {
             "problem_text": problem_text,
             "format_instructions": parser.get_format_instructions()
-        })
+        }, parser)
         return result
     except Exception as e:
-        print(f"Error in analyze_initial_problem: {e}")
+        logger.error(f"Error in analyze_initial_problem: {e}")
         return {"error": str(e)}
 
-async def generate_next_question(history: List[dict], patient_info: dict) -> dict:
+NEXT_QUESTION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a medical AI conducting a diagnostic interview.
+    Your goal is to ask relevant follow-up questions to narrow down the diagnosis.
+    Review the conversation history and patient info.
+    Ask ONE clear, concise question at a time.
+    Do not repeat questions.
+    Provide 4 simple, likely answer options for the patient to choose from (e.g., "Yes", "No", "2 days", "Sharp pain").
+    If you have enough information (usually after 6 questions) or if the condition is clear, set is_final to true.
+    
+    Patient Info: {patient_context}
+    
+    {format_instructions}"""),
+    ("user", """Conversation History:
+    {conversation_context}
+    
+    Generate the next question with options.""")
+])
+
+async def _next_question_inputs(history: List[dict], patient_info: dict, parser,
+                                session_id: Optional[str] = None, context_mode: Optional[str] = None) -> dict:
+    # Merged entity ledger when configured, otherwise the formatted history
+    ledger_context = await interview_context(history, session_id, context_mode)
+    return {
+        "conversation_context": ledger_context or compact_history(history),
+        "patient_context": compact_context(patient_info, "next_question"),
+        "format_instructions": parser.get_format_instructions()
+    }
+
+async def generate_next_question(history: List[dict], patient_info: dict,
+                                 session_id: Optional[str] = None, context_mode: Optional[str] = None,
+                                 backend: Optional[str] = None, entities: Optional[List[dict]] = None) -> dict:
+    if (backend or INTERVIEW_BACKEND) == "gemini":
+        return await generate_next_question_text(history, patient_info, entities, session_id, context_mode)
     try:
-        llm = get_llm()
-        parser = JsonOutputParser(pydantic_object=NextQuestion)
-        
-        # Format history for context
-        conversation_context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-        patient_context = str(patient_info)
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a medical AI conducting a diagnostic interview.
-            Your goal is to ask relevant follow-up questions to narrow down the diagnosis.
-            Review the conversation history and patient info.
-            Ask ONE clear, concise question at a time.
-            Do not repeat questions.
-            Provide 4 simple, likely answer options for the patient to choose from (e.g., "Yes", "No", "2 days", "Sharp pain").
-            If you have enough information (usually after 6 questions) or if the condition is clear, set is_final to true.
-            
-            Patient Info: {patient_context}
-            
-            {format_instructions}"""),
-            ("user", """Conversation History:
-            {conversation_context}
-            
-            Generate the next question with options.""")
-        ])
-        
-        chain = prompt | llm | parser
-        result = chain.invoke({
-            "conversation_context": conversation_context,
-            "patient_context": patient_context,
-            "format_instructions": parser.get_format_instructions()
-        })
+        parser = RobustJsonOutputParser(pydantic_object=NextQuestion)
+        inputs = await _next_question_inputs(history, patient_info, parser, session_id, context_mode)
+        result = await router.ainvoke("next_question", NEXT_QUESTION_PROMPT, inputs, parser)
         return result
     except Exception as e:
-        print(f"Error in generate_next_question: {e}")
+        logger.error(f"Error in generate_next_question: {e}")
         return {"error": str(e)}
 
-async def extract_entities_from_text(text: str) -> dict:
+async def stream_next_question(history: List[dict], patient_info: dict,
+                               session_id: Optional[str] = None, context_mode: Optional[str] = None) -> AsyncIterator[dict]:
+    """
+    Stream the next question as it is generated: each NextQuestion field is
+    yielded as soon as it is complete (the question arrives before the options),
+    then the validated result.
+    """
     try:
-        llm = get_llm()
-        parser = JsonOutputParser(pydantic_object=ExtractedEntities)
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """Extract medical entities from the text.
-            Categorize them into: Symptom, Medication, Condition, Allergy, Body Part, Duration, Severity.
-            
-            {format_instructions}"""),
-            ("user", "{text}")
-        ])
-        
-        chain = prompt | llm | parser
-        result = chain.invoke({
-            "text": text,
-            "format_instructions": parser.get_format_instructions()
-        })
+        parser = RobustJsonOutputParser(pydantic_object=NextQuestion)
+        inputs = await _next_question_inputs(history, patient_info, parser, session_id, context_mode)
+        chunks = router.astream("next_question", NEXT_QUESTION_PROMPT, inputs)
+        async for event in stream_fields(NextQuestion, chunks):
+            yield event
+    except Exception as e:
+        logger.error(f"Error in stream_next_question: {e}")
+        yield {"event": "error", "error": str(e)}
+
+async def extract_entities_from_text(text: str, session_id: Optional[str] = None,
+                                     backend: Optional[str] = None, turn: Optional[int] = None) -> dict:
+    """
+    Extract entities; with a session_id they are also merged into that
+    session's ledger (once per turn, so client retries do not count twice)
+    """
+    try:
+        if (backend or ENTITY_BACKEND) == "ner":
+            result = await extract_entities_ner(text)
+            if "error" in result:
+                return result
+        else:
+            result = await _extract_entities_llm(text)
+        if session_id:
+            ledger = await ledgers.add(session_id, text, result.get("entities", []), turn)
+            result["ledger"] = ledger.public()
         return result
     except Exception as e:
-        print(f"Error in extract_entities_from_text: {e}")
+        logger.error(f"Error in extract_entities_from_text: {e}")
         return {"error": str(e)}
 
-async def generate_final_summary(history: List[dict], patient_info: dict) -> dict:
+async def _extract_entities_llm(text: str) -> dict:
+    parser = RobustJsonOutputParser(pydantic_object=ExtractedEntities)
+    
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """Extract medical entities from the text.
+        Categorize them into: Symptom, Medication, Condition, Allergy, Body Part, Duration, Severity.
+        Include what the patient denies (e.g. "no fever") with negated set to true.
+        
+        {format_instructions}"""),
+        ("user", "{text}")
+    ])
+    
+    result = await router.ainvoke("entity_extraction", prompt, {
+        "text": text,
+        "format_instructions": parser.get_format_instructions()
+    }, parser)
+    return result
+
+async def generate_final_summary(history: List[dict], patient_info: dict,
+                                 session_id: Optional[str] = None, context_mode: Optional[str] = None,
+                                 backend: Optional[str] = None, entities: Optional[List[dict]] = None,
+                                 reports_uploaded: bool = False) -> dict:
+    if (backend or INTERVIEW_BACKEND) == "gemini":
+        return await generate_final_summary_text(history, patient_info, entities, session_id, context_mode,
+                                                 reports_uploaded)
     try:
-        llm = get_llm()
-        parser = JsonOutputParser(pydantic_object=FinalSummary)
+        parser = RobustJsonOutputParser(pydantic_object=FinalSummary)
         
-        conversation_context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-        patient_context = str(patient_info)
+        conversation_context = (
+            await interview_context(history, session_id, context_mode, include_questions=False)
+            or compact_history(history)
+        )
+        patient_context = compact_context(patient_info, "final_summary")
         
         prompt = ChatPromptTemplate.from_messages([
             ("system", """You are an expert medical AI. Provide a final diagnosis summary based on the consultation.
@@ -157,13 +212,98 @@ async def generate_final_summary(history: List[dict], patient_info: dict) -> dic
             Generate the final summary.""")
         ])
         
-        chain = prompt | llm | parser
-        result = chain.invoke({
+        result = await router.ainvoke("final_summary", prompt, {
             "conversation_context": conversation_context,
             "patient_context": patient_context,
             "format_instructions": parser.get_format_instructions()
-        })
+        }, parser)
         return result
     except Exception as e:
-        print(f"Error in generate_final_summary: {e}")
+        logger.error(f"Error in generate_final_summary: {e}")
+        return {"error": str(e)}
+
+# --- Free-text Backend ---
+# Prose question/summary prompts formerly served by the Flask server.py,
+# routed through the shared LLM router (Gemini first, Groq fallback).
+
+NEXT_QUESTION_TEXT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an AI medical doctor performing pre-consultation.
+    Ask the next clinical question.
+    Rules:
+    - Total 15-20 questions
+    - Include examples in brackets
+    - Ask only ONE question
+    - No repetition
+
+    Patient Info: {patient_context}"""),
+    ("user", """Conversation so far:
+    {conversation_context}
+
+    Detected medical keywords: {keywords}""")
+])
+
+FINAL_SUMMARY_TEXT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a senior medical AI.
+    Generate a structured medical summary including:
+    - Case Summary
+    - Symptoms & Timeline
+    - Clinical History
+    - 5-8 Differential Diagnoses with probabilities summing to 100%
+    - Recommended Tests
+    - Urgency Level
+    - Specialist Recommendation
+    - Red Flags
+    Always include a disclaimer that this is AI-generated and not a replacement for professional medical advice."""),
+    ("user", """--- BASIC INFO ---
+    {patient_context}
+
+    --- ALL SYMPTOMS / KEYWORDS ---
+    {keywords}
+
+    --- FULL INTERVIEW ---
+    {conversation_context}
+
+    --- REPORTS UPLOADED ---
+    {reports_uploaded}""")
+])
+
+async def _keywords(entities: Optional[List[dict]], session_id: Optional[str]) -> str:
+    """Keywords from the request's entities (NER "word" or LLM "entity"), else the session ledger; denied ones are left out"""
+    if entities:
+        words = [str(e.get("entity") or e.get("word") or "").strip() for e in entities if not e.get("negated")]
+    else:
+        ledger = await ledgers.get(session_id) if session_id else None
+        words = [entry.entity for entry in ledger.present()] if ledger else []
+    return ", ".join(dict.fromkeys(w for w in words if w)) or "none"
+
+async def generate_next_question_text(history: List[dict], patient_info: dict,
+                                      entities: Optional[List[dict]] = None, session_id: Optional[str] = None,
+                                      context_mode: Optional[str] = None) -> dict:
+    try:
+        question = await router.ainvoke("next_question_text", NEXT_QUESTION_TEXT_PROMPT, {
+            "conversation_context": await interview_context(history, session_id, context_mode) or compact_history(history),
+            "patient_context": compact_context(patient_info, "next_question"),
+            "keywords": await _keywords(entities, session_id)
+        }, StrOutputParser())
+        return {"question": question.strip(), "backend": "gemini"}
+    except Exception as e:
+        logger.error(f"Error in generate_next_question_text: {e}")
+        return {"error": str(e)}
+
+async def generate_final_summary_text(history: List[dict], patient_info: dict,
+                                      entities: Optional[List[dict]] = None, session_id: Optional[str] = None,
+                                      context_mode: Optional[str] = None, reports_uploaded: bool = False) -> dict:
+    try:
+        summary = await router.ainvoke("final_summary_text", FINAL_SUMMARY_TEXT_PROMPT, {
+            "conversation_context": (
+                await interview_context(history, session_id, context_mode, include_questions=False)
+                or compact_history(history)
+            ),
+            "patient_context": compact_context(patient_info, "final_summary"),
+            "keywords": await _keywords(entities, session_id),
+            "reports_uploaded": "yes" if reports_uploaded else "no"
+        }, StrOutputParser())
+        return {"summary": summary.strip(), "backend": "gemini"}
+    except Exception as e:
+        logger.error(f"Error in generate_final_summary_text: {e}")
         return {"error": str(e)}
@@ -1,13 +1,31 @@
 import os
+import time
+import asyncio
+import logging
 from groq import Groq
-from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Dict, Any
 import io
-import json
+from llm_router import router
+from json_stream import RobustJsonOutputParser
+from metrics import stage
+from prompt_context import compact_context
+from safety_index import validate_prescription
+from audio_preprocess import prepare_audio
+from result_cache import result_cache, text_fingerprint
+
+# Targeted regeneration rounds for medicines the safety index flags
+MAX_PRESCRIPTION_REVISIONS = int(os.getenv("MAX_PRESCRIPTION_REVISIONS", "1"))
+
+WHISPER_MODEL = "whisper-large-v3-turbo"
+WHISPER_LANGUAGE = "en"
+# Cache keys carry the model / prompt version; bump SUMMARY_CACHE_VERSION when
+# the summary prompt or schema changes so stale entries are not served
+TRANSCRIPTION_CACHE_VERSION = f"{WHISPER_MODEL}:{WHISPER_LANGUAGE}"
+SUMMARY_CACHE_VERSION = "v1"
+
+logger = logging.getLogger(__name__)
 
 # --- Pydantic Models ---
 class ConsultationSummary(BaseModel):
@@ -37,43 +55,55 @@ class PrescriptionData(BaseModel):
     additional_instructions: List[str] = Field(description="General prescription instructions")
     contraindications: List[str] = Field(description="Contraindications based on patient history")
 
-async def transcribe_audio(audio_file) -> str:
-    """Transcribe audio file using Groq Whisper"""
+class PrescriptionRevision(BaseModel):
+    """Replacements for medicines flagged by the safety check"""
+    medicines: List[Medicine] = Field(description="Safe replacement medicines; empty if the flagged ones should simply be dropped")
+    contraindications: List[str] = Field(description="Contraindications that led to the replacement")
+
+async def transcribe_audio(audio_file, cache_report: Optional[Dict[str, str]] = None) -> str:
+    """Transcribe audio file using Groq Whisper (cached by normalized audio fingerprint)"""
     try:
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
         audio_data = await audio_file.read()
+
+        async def cached_transcription(fingerprint: str):
+            return await result_cache.get("transcription", f"{TRANSCRIPTION_CACHE_VERSION}:{fingerprint}")
+
+        # Mono 16kHz, silence-trimmed, compact codec: fewer bytes to upload
+        audio_data, filename, prep = await prepare_audio(audio_data, audio_file.filename, cached_transcription)
+        if cache_report is not None:
+            cache_report["transcription"] = "hit" if "cached" in prep else "miss"
+        if "cached" in prep:
+            return prep["cached"]["text"]
+        logger.info(f"Audio {prep['action']}: {prep['input_bytes']} -> {prep['output_bytes']} bytes")
         audio_buffer = io.BytesIO(audio_data)
-        audio_buffer.name = audio_file.filename
+        audio_buffer.name = filename
 
-        transcription = client.audio.transcriptions.create(
-            file=audio_buffer,
-            model="whisper-large-v3-turbo",
-            response_format="text",
-            language="en"
-        )
+        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        with stage("transcription"):
+            transcription = await asyncio.to_thread(
+                client.audio.transcriptions.create,
+                file=audio_buffer,
+                model=WHISPER_MODEL,
+                response_format="text",
+                language=WHISPER_LANGUAGE
+            )
+        if transcription and transcription.strip():
+            await result_cache.put(
+                "transcription", f"{TRANSCRIPTION_CACHE_VERSION}:{prep['fingerprint']}", {"text": transcription}
+            )
         return transcription
     except Exception as e:
-        print(f"Error during transcription: {e}")
+        logger.error(f"Error during transcription: {e}")
         return None
 
-def generate_consultation_summary(transcription: str) -> ConsultationSummary | None:
-    """Generate structured summary from transcription"""
-    try:
-        llm = ChatGroq(
-            model="llama-3.3-70b-versatile",
-            temperature=0.3,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
-        parser = JsonOutputParser(pydantic_object=ConsultationSummary)
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert medical assistant that creates consultation summaries.
-            You analyze doctor-patient conversations and create two versions:
-            1. Doctor Summary: Detailed, uses medical terminology, comprehensive
-            2. Patient Summary: Simple, easy to understand, focuses on action items
-            
-            Always extract key information accurately and maintain medical accuracy."""),
-            ("user", """Analyze this medical consultation transcription and provide a structured summary.
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert medical assistant that creates consultation summaries.
+    You analyze doctor-patient conversations and create two versions:
+    1. Doctor Summary: Detailed, uses medical terminology, comprehensive
+    2. Patient Summary: Simple, easy to understand, focuses on action items
+    
+    Always extract key information accurately and maintain medical accuracy."""),
+    ("user", """Analyze this medical consultation transcription and provide a structured summary.
 
 **Consultation Transcription:**
 {transcription}
@@ -88,76 +118,47 @@ def generate_consultation_summary(transcription: str) -> ConsultationSummary | N
 7. Note any important warnings or special instructions
 
 {format_instructions}""")
-        ])
+])
+
+async def _call_llm(task: str, prompt, inputs: Dict[str, Any], parser, stream: bool = False):
+    """
+    router.ainvoke, or with `stream` a streamed call: cancelling the awaiting
+    task then closes the provider stream, so an abandoned request stops
+    generating tokens (streamed calls fall back but do not hedge).
+    """
+    if not stream:
+        return await router.ainvoke(task, prompt, inputs, parser)
+    text = "".join([chunk async for chunk in router.astream(task, prompt, inputs)])
+    with stage("json_parse"):
+        return parser.parse(text)
+
+async def generate_consultation_summary(transcription: str, stream: bool = False) -> ConsultationSummary | None:
+    """Generate structured summary from transcription"""
+    try:
+        parser = RobustJsonOutputParser(pydantic_object=ConsultationSummary)
 
-        chain = prompt | llm | parser
-        result = chain.invoke({
+        result = await _call_llm("consultation_summary", SUMMARY_PROMPT, {
             "transcription": transcription,
             "format_instructions": parser.get_format_instructions()
-        })
+        }, parser, stream)
 
         return ConsultationSummary(**result)
 
     except Exception as e:
-        print(f"Error during summarization: {e}")
+        logger.error(f"Error during summarization: {e}")
         return None
 
-def generate_prescription(
-    summary: ConsultationSummary, 
-    patient_data: Dict[str, Any]
-) -> PrescriptionData | None:
-    """Generate prescription based on consultation summary and comprehensive patient data"""
-    try:
-        llm = ChatGroq(
-            model="llama-3.3-70b-versatile",
-            temperature=0.2,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
-        parser = JsonOutputParser(pydantic_object=PrescriptionData)
-
-        # Extract patient details
-        basic_health = patient_data.get('basicHealthProfile', {})
-        medical_history = patient_data.get('medicalHistory', {})
-        current_health = patient_data.get('currentHealthStatus', {})
-        
-        age = calculate_age(basic_health.get('dateOfBirth')) if basic_health.get('dateOfBirth') else "Unknown"
-        weight = basic_health.get('weight', {}).get('value', 'Unknown')
-        blood_group = basic_health.get('bloodGroup', 'Unknown')
-        
-        # Compile patient context
-        patient_context = f"""
-**Patient Age:** {age} years
-**Weight:** {weight} kg
-**Blood Group:** {blood_group}
-**Gender:** {basic_health.get('gender', 'Unknown')}
-
-**Chronic Diseases:** {', '.join([d['name'] for d in medical_history.get('chronicDiseases', [])]) or 'None'}
-
-**Current Medications:** {', '.join([m['name'] + ' (' + m['dosage'] + ')' for m in current_health.get('currentMedications', [])]) or 'None'}
-
-**Allergies:** {', '.join([a['allergen'] + ' (Severity: ' + a['severity'] + ')' for a in current_health.get('allergies', [])]) or 'None'}
-
-**Smoking Status:** {current_health.get('smokingStatus', 'Unknown')}
-**Alcohol Consumption:** {current_health.get('alcoholConsumption', 'Unknown')}
-
-**Previous Surgeries:** {', '.join([s['name'] + ' (' + str(s['year']) + ')' for s in medical_history.get('previousSurgeries', [])]) or 'None'}
-
-**Family Medical History:** {', '.join([f['relation'] + ': ' + f['condition'] for f in medical_history.get('familyMedicalHistory', [])]) or 'None'}
-"""
-
-        # Check if follow-up already exists
-        has_follow_up = len(summary.follow_up_instructions) > 0
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert medical prescription assistant for Indian healthcare.
-            Generate appropriate medicine prescriptions considering patient's complete medical history.
-            Use Indian medicine names (Paracetamol, Azithromycin, etc.).
-            
-            CRITICAL: Check for drug interactions, contraindications, and allergies.
-            Adjust dosages based on age, weight, and existing conditions.
-            Follow Indian medical prescription standards."""),
-            ("user", """Generate a prescription based on the following consultation and patient history:
+PRESCRIPTION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert medical prescription assistant for Indian healthcare.
+    Generate appropriate medicine prescriptions considering patient's complete medical history.
+    Use Indian medicine names (Paracetamol, Azithromycin, etc.).
+    
+    CRITICAL: Check for drug interactions, contraindications, and allergies.
+    Adjust dosages based on age, weight, and existing conditions.
+    Follow Indian medical prescription standards."""),
+    ("user", """Generate a prescription based on the following consultation and patient history:
 
+**Patient:**
 {patient_context}
 
 **Current Consultation:**
@@ -188,58 +189,185 @@ def generate_prescription(
 - Warn about medicines to avoid due to allergies
 
 {format_instructions}""")
-        ])
+])
 
-        chain = prompt | llm | parser
-        result = chain.invoke({
-            "patient_context": patient_context,
+async def generate_prescription(
+    summary: ConsultationSummary, 
+    patient_data: Dict[str, Any],
+    stream: bool = False
+) -> PrescriptionData | None:
+    """Generate prescription based on consultation summary and comprehensive patient data"""
+    try:
+        parser = RobustJsonOutputParser(pydantic_object=PrescriptionData)
+
+        # Check if follow-up already exists
+        has_follow_up = len(summary.follow_up_instructions) > 0
+
+        result = await _call_llm("prescription", PRESCRIPTION_PROMPT, {
+            "patient_context": compact_context(patient_data, "prescription"),
             "diagnosis": summary.diagnosis_discussed,
             "symptoms": ", ".join(summary.key_symptoms),
             "medications_mentioned": ", ".join(summary.medications_prescribed) if summary.medications_prescribed else "None",
             "should_add_follow_up": "NO - follow-up already exists in consultation" if has_follow_up else "YES - calculate follow-up date",
             "format_instructions": parser.get_format_instructions()
-        })
+        }, parser, stream)
 
         return PrescriptionData(**result)
 
     except Exception as e:
-        print(f"Error during prescription generation: {e}")
+        logger.error(f"Error during prescription generation: {e}")
         return None
 
-def calculate_age(date_of_birth: str) -> int:
-    """Calculate age from date of birth"""
+REVISION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert medical prescription assistant for Indian healthcare.
+    A safety check flagged some medicines in a prescription. Replace ONLY the flagged medicines
+    with safe alternatives for the same indication, or return none if no replacement is needed.
+    Never suggest a medicine from the same class as the flagged interaction or allergy."""),
+    ("user", """Patient: {patient_context}
+Diagnosis: {diagnosis}
+Medicines being kept: {kept}
+
+Flagged medicines:
+{flagged}
+
+{format_instructions}""")
+])
+
+async def revise_prescription(
+    prescription: PrescriptionData,
+    safety: Dict[str, Any],
+    summary: ConsultationSummary,
+    patient_data: Dict[str, Any],
+    stream: bool = False
+) -> PrescriptionData | None:
+    """Ask the LLM to replace only the flagged medicines, keeping the rest of the prescription"""
     try:
-        if isinstance(date_of_birth, str):
-            dob = datetime.fromisoformat(date_of_birth.replace('Z', '+00:00'))
-        else:
-            dob = date_of_birth
-        today = datetime.now()
-        age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
-        return age
-    except:
-        return 0
+        parser = RobustJsonOutputParser(pydantic_object=PrescriptionRevision)
+        blocking = set(safety["blocking_indexes"])
+        flagged = "\n".join(
+            f"- {issue['medicine']}: {issue['type'].replace('_', ' ')} with {issue['with']} ({issue['severity']}): {issue['effect']}"
+            for issue in safety["issues"] if issue["medicine_index"] in blocking
+        )
+        kept = [m for i, m in enumerate(prescription.medicines) if i not in blocking]
 
-async def process_consultation(audio_file, patient_data: Dict[str, Any]) -> dict:
-    """Main function to process consultation audio and generate prescription"""
-    
-    # Step 1: Transcribe audio
-    transcription = await transcribe_audio(audio_file)
+        result = await _call_llm("prescription", REVISION_PROMPT, {
+            "patient_context": compact_context(patient_data, "prescription"),
+            "diagnosis": summary.diagnosis_discussed,
+            "kept": ", ".join(m.name for m in kept) or "None",
+            "flagged": flagged,
+            "format_instructions": parser.get_format_instructions()
+        }, parser, stream)
+        revision = PrescriptionRevision(**result)
+        kept_names = {m.name.lower() for m in kept}
+        replacements = [m for m in revision.medicines if m.name.lower() not in kept_names]
+
+        return prescription.model_copy(update={
+            "medicines": kept + replacements,
+            "contraindications": list(dict.fromkeys(prescription.contraindications + revision.contraindications))
+        })
+    except Exception as e:
+        logger.error(f"Error during prescription revision: {e}")
+        return None
+
+async def check_prescription_safety(
+    prescription: PrescriptionData,
+    summary: ConsultationSummary,
+    patient_data: Dict[str, Any],
+    stream: bool = False
+) -> tuple[PrescriptionData, Dict[str, Any]]:
+    """
+    Validate against the local safety index; regenerate only the flagged
+    medicines (up to MAX_PRESCRIPTION_REVISIONS times) and re-check.
+    """
+    revisions = 0
+    with stage("safety_check"):
+        safety = validate_prescription(prescription.model_dump(), patient_data)
+    while not safety["safe"] and revisions < MAX_PRESCRIPTION_REVISIONS:
+        revised = await revise_prescription(prescription, safety, summary, patient_data, stream)
+        if revised is None:
+            break
+        revisions += 1
+        prescription = revised
+        with stage("safety_check"):
+            safety = validate_prescription(prescription.model_dump(), patient_data)
+    if not safety["safe"]:
+        logger.warning(f"Prescription still has {len(safety['blocking_indexes'])} flagged medicine(s) after {revisions} revision(s)")
+    return prescription, {**safety, "revisions": revisions}
+
+async def consultation_stages(audio_file, patient_data: Dict[str, Any], stream: bool = False) -> AsyncIterator[dict]:
+    """
+    Run the consultation pipeline, yielding each stage's result as soon as it
+    is ready: `transcript`, `summary`, `prescription` (after the safety
+    check), then `done`; or an `error` event for the stage that failed. Every
+    event carries the stage's own duration and the time since the start.
+    With `stream` the LLM calls are streamed so that closing this generator
+    (a client dropping the connection) cancels the call in flight.
+    """
+    start = time.perf_counter()
+    stages: Dict[str, float] = {}
+    mark = start
+
+    def timing(name: str) -> Dict[str, float]:
+        nonlocal mark
+        now = time.perf_counter()
+        stages[name] = round((now - mark) * 1000, 1)
+        mark = now
+        return {"stage_ms": stages[name], "elapsed_ms": round((now - start) * 1000, 1)}
+
+    # Step 1: Transcribe audio (re-runs of the same recording hit the cache)
+    cache: Dict[str, str] = {}
+    transcription = await transcribe_audio(audio_file, cache)
     if not transcription or len(transcription.strip()) < 10:
-        return {"error": "Failed to transcribe audio or audio is too short"}
-    
-    # Step 2: Generate consultation summary
-    summary = generate_consultation_summary(transcription)
-    if not summary:
-        return {"error": "Failed to generate consultation summary"}
-    
+        yield {"event": "error", "stage": "transcript", "error": "Failed to transcribe audio or audio is too short",
+               "timing": timing("transcript")}
+        return
+    yield {"event": "transcript", "transcription": transcription, "cache": cache["transcription"],
+           "timing": timing("transcript")}
+
+    # Step 2: Generate consultation summary; it depends only on the transcription
+    summary_key = f"{SUMMARY_CACHE_VERSION}:{text_fingerprint(transcription)}"
+    cached_summary = await result_cache.get("summary", summary_key)
+    cache["summary"] = "hit" if cached_summary else "miss"
+    if cached_summary:
+        summary = ConsultationSummary(**cached_summary)
+    else:
+        summary = await generate_consultation_summary(transcription, stream)
+        if not summary:
+            yield {"event": "error", "stage": "summary", "error": "Failed to generate consultation summary",
+                   "timing": timing("summary")}
+            return
+        await result_cache.put("summary", summary_key, summary.dict())
+    yield {"event": "summary", "summary": summary.dict(), "cache": cache["summary"], "timing": timing("summary")}
+
     # Step 3: Generate prescription with patient history
-    prescription = generate_prescription(summary, patient_data)
+    prescription = await generate_prescription(summary, patient_data, stream)
     if not prescription:
-        return {"error": "Failed to generate prescription"}
-    
-    return {
-        "success": True,
-        "transcription": transcription,
-        "summary": summary.dict(),
-        "prescription": prescription.dict()
-    }
\ No newline at end of file
+        yield {"event": "error", "stage": "prescription", "error": "Failed to generate prescription",
+               "timing": timing("prescription")}
+        return
+
+    # Step 4: Local interaction/allergy check with targeted regeneration
+    prescription, safety = await check_prescription_safety(prescription, summary, patient_data, stream)
+    yield {"event": "prescription", "prescription": prescription.dict(), "safety": safety,
+           "timing": timing("prescription")}
+
+    yield {"event": "done", "cache": cache,
+           "timing": {"stages_ms": stages, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}}
+
+async def process_consultation(audio_file, patient_data: Dict[str, Any]) -> dict:
+    """Main function to process consultation audio and generate prescription"""
+    result: Dict[str, Any] = {"success": True}
+    async for event in consultation_stages(audio_file, patient_data):
+        if event["event"] == "error":
+            return {"error": event["error"]}
+        if event["event"] == "transcript":
+            result["transcription"] = event["transcription"]
+        elif event["event"] == "summary":
+            result["summary"] = event["summary"]
+        elif event["event"] == "prescription":
+            result["prescription"] = event["prescription"]
+            result["safety"] = event["safety"]
+        elif event["event"] == "done":
+            result["cache"] = event["cache"]
+            result["timing"] = event["timing"]
+    return result
@@ -1,18 +1,31 @@
 import os
-import motor.motor_asyncio
+import logging
 from bson import ObjectId
 from dotenv import load_dotenv
 
+from metrics import stage
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 MONGODB_URI = os.getenv("MONGODB_URI")
 DB_NAME = "TeleMedAI" # Extracted from URI
 
 if not MONGODB_URI:
-    print("WARNING: MONGODB_URI not found in environment variables.")
+    logger.warning("MONGODB_URI not found in environment variables.")
+
+# Created on first query, in the process that uses it (never before a fork)
+client = None
+db = None
 
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URI)
-db = client.get_database(DB_NAME)
+def get_db():
+    global client, db
+    if db is None:
+        import motor.motor_asyncio
+        client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URI)
+        db = client.get_database(DB_NAME)
+    return db
 
 async def get_patient_data(user_id: str):
     """
@@ -28,16 +41,17 @@ async def get_patient_data(user_id: str):
         
         # Find in 'patientonboardings' (mongoose default pluralization usually lowercases)
         # Or check the actual collection name. Based on model 'PatientOnboarding', it's likely 'patientonboardings'
-        patient_data = await db.patientonboardings.find_one({"userId": user_oid})
-        
-        # Fetch user details for name
-        user_data = await db.users.find_one({"_id": user_oid})
+        with stage("mongo_fetch"):
+            patient_data = await get_db().patientonboardings.find_one({"userId": user_oid})
+            
+            # Fetch user details for name
+            user_data = await get_db().users.find_one({"_id": user_oid})
         patient_name = "Patient"
         if user_data and "name" in user_data:
             patient_name = user_data["name"]
         
         if not patient_data:
-            print(f"No patient data found for userId: {user_id}")
+            logger.info(f"No patient data found for userId: {user_id}")
             return None
             
         # Convert ObjectId to string for JSON serialization
@@ -48,5 +62,5 @@ async def get_patient_data(user_id: str):
         return patient_data
         
     except Exception as e:
-        print(f"Error fetching patient data: {e}")
+        logger.error(f"Error fetching patient data: {e}")
         return None
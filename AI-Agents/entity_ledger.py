@@ -0,0 +1,323 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+# How interview prompts see the conversation: "transcript" (full history) or
+# "ledger" (chief complaint + merged entities + the latest exchange)
+INTERVIEW_CONTEXT = os.getenv("INTERVIEW_CONTEXT", "transcript")
+# "memory" is per process: with several serve.py workers a session's turns land
+# on different workers, so the default is a SQLite file they all share
+ENTITY_LEDGER_STORE = os.getenv("ENTITY_LEDGER_STORE", "sqlite:ledgers.db")
+LEDGER_TTL = float(os.getenv("ENTITY_LEDGER_TTL", "3600"))
+LEDGER_MAX_SESSIONS = int(os.getenv("ENTITY_LEDGER_MAX_SESSIONS", "10000"))
+
+MAX_CONFIDENCE = 0.99
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+_FILLER = {"a", "an", "the", "my", "some", "of"}
+
+
+def entity_key(entity: str, category: str) -> str:
+    """Merge key: category plus the entity lowercased, without fillers or plural 's'"""
+    words = [w for w in _NON_WORD.sub(" ", entity.lower()).split() if w not in _FILLER]
+    if words and len(words[-1]) > 3 and words[-1].endswith("s") and not words[-1].endswith("ss"):
+        words[-1] = words[-1][:-1]
+    return f"{category.strip().lower()}:{' '.join(words)}"
+
+
+# --- Ledger ---
+
+class LedgerEntry(BaseModel):
+    """One merged entity across interview turns"""
+    entity: str
+    category: str
+    confidence: float
+    negated: bool = False  # the patient denies it ("no fever"); the latest turn decides
+    mentions: int = 1
+    first_turn: int
+    last_turn: int
+    surface_forms: List[str] = Field(default_factory=list)
+
+
+class EntityLedger(BaseModel):
+    """Entities accumulated for one interview session"""
+    session_id: str
+    turns: int = 0
+    chief_complaint: Optional[str] = None
+    entries: Dict[str, LedgerEntry] = Field(default_factory=dict)
+    merged_turns: List[str] = Field(default_factory=list)
+    updated_at: float = Field(default_factory=time.time)
+
+    def add(self, text: str, entities: List[Dict[str, Any]], turn: Optional[int] = None) -> List[str]:
+        """
+        Merge one turn's extraction. Repeated mentions in later turns combine
+        confidence as independent evidence (1 - prod(1 - c)); the most confident
+        surface form is kept as the display name. A turn is merged once: a retry
+        of the same turn index (or, without one, the same text) changes nothing.
+        When a later turn flips an entity between affirmed and denied, its
+        confidence restarts from that turn. Returns the keys that changed.
+        """
+        turn_id = f"#{turn}" if turn is not None else hashlib.sha1(" ".join(text.split()).lower().encode()).hexdigest()[:16]
+        if turn_id in self.merged_turns:
+            return []
+        self.merged_turns.append(turn_id)
+        self.turns += 1
+        position = turn if turn is not None else self.turns
+        if self.chief_complaint is None and text.strip():
+            self.chief_complaint = " ".join(text.split())
+
+        # One vote per entity per turn: the most confident mention
+        mentioned: Dict[str, Dict[str, Any]] = {}
+        for item in entities:
+            name = str(item.get("entity", "")).strip()
+            category = str(item.get("category", "Other")).strip() or "Other"
+            if not name:
+                continue
+            confidence = min(max(float(item.get("confidence", 0.5) or 0.0), 0.0), 1.0)
+            key = entity_key(name, category)
+            if key not in mentioned or confidence > mentioned[key]["confidence"]:
+                mentioned[key] = {"name": name, "category": category, "confidence": confidence,
+                                  "negated": bool(item.get("negated", False))}
+
+        for key, item in mentioned.items():
+            name, confidence, negated = item["name"], item["confidence"], item["negated"]
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = LedgerEntry(
+                    entity=name, category=item["category"], confidence=min(confidence, MAX_CONFIDENCE),
+                    negated=negated, first_turn=position, last_turn=position, surface_forms=[name]
+                )
+                continue
+            if negated != entry.negated:
+                if position < entry.last_turn:
+                    continue  # an older turn arriving late does not overrule a newer answer
+                entry.negated = negated
+                entry.confidence = min(confidence, MAX_CONFIDENCE)
+                entry.entity = name
+            else:
+                if confidence > entry.confidence:
+                    entry.entity = name
+                entry.confidence = round(min(1 - (1 - entry.confidence) * (1 - confidence), MAX_CONFIDENCE), 4)
+            entry.first_turn = min(entry.first_turn, position)
+            entry.last_turn = max(entry.last_turn, position)
+            entry.mentions += 1
+            if name not in entry.surface_forms:
+                entry.surface_forms.append(name)
+        self.updated_at = time.time()
+        return list(mentioned)
+
+    def present(self) -> List[LedgerEntry]:
+        """Entities the patient has not denied"""
+        return [e for e in self.entries.values() if not e.negated]
+
+    def by_category(self) -> Dict[str, List[LedgerEntry]]:
+        """Affirmed entities per category, most confident first"""
+        grouped: Dict[str, List[LedgerEntry]] = {}
+        for entry in sorted(self.present(), key=lambda e: (-e.confidence, e.first_turn)):
+            grouped.setdefault(entry.category, []).append(entry)
+        return grouped
+
+    def render(self) -> str:
+        """Compact prompt form: one line per category, then what the patient denied"""
+        lines = []
+        for category, entries in self.by_category().items():
+            items = [
+                f"{e.entity} ({e.confidence:.2f}{f', x{e.mentions}' if e.mentions > 1 else ''})"
+                for e in entries
+            ]
+            lines.append(f"{category}: {', '.join(items)}")
+        denied = [e.entity for e in sorted(self.entries.values(), key=lambda e: e.first_turn) if e.negated]
+        if denied:
+            lines.append(f"Denied: {', '.join(denied)}")
+        return "\n".join(lines) or "none yet"
+
+    def public(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "turns": self.turns,
+            "chief_complaint": self.chief_complaint,
+            "entities": [e.model_dump() for entries in self.by_category().values() for e in entries],
+            "denied": [e.model_dump() for e in self.entries.values() if e.negated],
+        }
+
+
+# --- Stores ---
+
+class MemoryLedgerStore:
+    """Process-local LRU of session ledgers with idle expiry (single worker only)"""
+
+    def __init__(self, ttl: float = LEDGER_TTL, max_sessions: int = LEDGER_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._ledgers: "OrderedDict[str, EntityLedger]" = OrderedDict()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        while self._ledgers:
+            session_id, ledger = next(iter(self._ledgers.items()))
+            if ledger.updated_at >= cutoff and len(self._ledgers) <= self.max_sessions:
+                break
+            del self._ledgers[session_id]
+
+    async def get(self, session_id: str) -> Optional[EntityLedger]:
+        self._expire()
+        ledger = self._ledgers.get(session_id)
+        if ledger is not None:
+            self._ledgers.move_to_end(session_id)
+        return ledger
+
+    async def update(self, session_id: str, change: Callable[[EntityLedger], Any]) -> EntityLedger:
+        ledger = await self.get(session_id)
+        if ledger is None:
+            ledger = self._ledgers[session_id] = EntityLedger(session_id=session_id)
+        change(ledger)
+        self._expire()
+        return ledger
+
+    async def drop(self, session_id: str):
+        self._ledgers.pop(session_id, None)
+
+
+class SQLiteLedgerStore:
+    """
+    One JSON document per session in a file shared by every worker on the
+    host. Updates read, merge and write inside one IMMEDIATE transaction, so
+    concurrent turns of a session on different workers never lose each other.
+    """
+
+    def __init__(self, path: str = "ledgers.db", ttl: float = LEDGER_TTL,
+                 max_sessions: int = LEDGER_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ledgers (session_id TEXT PRIMARY KEY, doc TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ledgers_updated ON ledgers (updated_at)")
+
+    def _load(self, session_id: str) -> Optional[EntityLedger]:
+        row = self._conn.execute(
+            "SELECT doc FROM ledgers WHERE session_id = ? AND updated_at >= ?", (session_id, time.time() - self.ttl)
+        ).fetchone()
+        return EntityLedger.model_validate_json(row[0]) if row else None
+
+    def _get(self, session_id: str) -> Optional[EntityLedger]:
+        with self._lock:
+            return self._load(session_id)
+
+    def _update(self, session_id: str, change: Callable[[EntityLedger], Any]) -> EntityLedger:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ledger = self._load(session_id) or EntityLedger(session_id=session_id)
+                change(ledger)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO ledgers (session_id, doc, updated_at) VALUES (?, ?, ?)",
+                    (session_id, ledger.model_dump_json(), ledger.updated_at)
+                )
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    self._conn.execute("DELETE FROM ledgers WHERE updated_at < ?", (time.time() - self.ttl,))
+                    self._conn.execute(
+                        "DELETE FROM ledgers WHERE session_id IN "
+                        "(SELECT session_id FROM ledgers ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_sessions,)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ledger
+
+    def _drop(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM ledgers WHERE session_id = ?", (session_id,))
+
+    async def get(self, session_id: str) -> Optional[EntityLedger]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def update(self, session_id: str, change: Callable[[EntityLedger], Any]) -> EntityLedger:
+        return await asyncio.to_thread(self._update, session_id, change)
+
+    async def drop(self, session_id: str):
+        await asyncio.to_thread(self._drop, session_id)
+
+
+def create_store(spec: Optional[str] = None):
+    """Build a store from ENTITY_LEDGER_STORE: 'memory' or 'sqlite:<path>'"""
+    spec = spec or ENTITY_LEDGER_STORE
+    if spec == "memory":
+        return MemoryLedgerStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteLedgerStore(spec[len("sqlite:"):] or "ledgers.db")
+    raise ValueError(f"Unknown ENTITY_LEDGER_STORE '{spec}'")
+
+
+class LedgerStore:
+    """Session ledgers over a store built lazily from ENTITY_LEDGER_STORE"""
+
+    def __init__(self, store=None):
+        self.store = store
+        self._configured = store is not None
+
+    def configure(self, spec: Optional[str] = None):
+        self.store = create_store(spec)
+        self._configured = True
+
+    def _store(self):
+        # Opened lazily so a preloading parent never shares a connection with its workers
+        if not self._configured:
+            self.configure()
+        return self.store
+
+    async def get(self, session_id: str) -> Optional[EntityLedger]:
+        return await self._store().get(session_id)
+
+    async def add(self, session_id: str, text: str, entities: List[Dict[str, Any]],
+                  turn: Optional[int] = None) -> EntityLedger:
+        """Merge one turn's entities into the session's ledger, creating it if needed"""
+        return await self._store().update(session_id, lambda ledger: ledger.add(text, entities, turn))
+
+    async def drop(self, session_id: str):
+        await self._store().drop(session_id)
+
+
+ledgers = LedgerStore()
+
+
+async def interview_context(history: List[dict], session_id: Optional[str], mode: Optional[str] = None,
+                            include_questions: bool = True) -> Optional[str]:
+    """
+    Ledger-based replacement for the transcript, or None when the transcript
+    should be used (mode is "transcript", or no ledger/entities for the session).
+    The question list lets next_question avoid repeats; the summary skips it.
+    """
+    mode = mode or INTERVIEW_CONTEXT
+    if mode != "ledger" or not session_id:
+        return None
+    ledger = await ledgers.get(session_id)
+    if ledger is None or not ledger.entries:
+        return None
+
+    first_user = next((m["content"] for m in history if m.get("role") == "user"), None)
+    complaint = first_user or ledger.chief_complaint
+    questions = [" ".join(m["content"].split()) for m in history if m.get("role") == "assistant"]
+    lines = [f"Chief complaint: {complaint}", "Findings so far:", ledger.render()]
+    if questions and include_questions:
+        lines.append(f"Questions already asked ({len(questions)}): " + " | ".join(questions))
+    if len(history) >= 2 and history[-1].get("role") == "user" and history[-2].get("role") == "assistant":
+        lines.append(f"Latest answer to \"{questions[-1]}\": {' '.join(history[-1]['content'].split())}")
+    return "\n".join(lines)
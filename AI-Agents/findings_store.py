@@ -0,0 +1,297 @@
+import os
+import re
+import asyncio
+import sqlite3
+import logging
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+from lab_parser import canonical_finding, get_lab_reference
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# --- Findings History ---
+# Analyzed report findings per patient, one row per (user, analyte, day) with
+# the value converted to the analyte's canonical unit so results from
+# different labs line up (a value whose unit is printed nowhere is kept as
+# text only, never guessed). Rows are clustered on that key, so a series for one
+# analyte (optionally within a date range) is a single index range scan. The
+# agent chat pulls series into its context only when the message names an
+# analyte or asks about past results.
+
+FINDINGS_STORE = os.getenv("FINDINGS_STORE", "sqlite:findings.db")
+# Points per analyte and analytes (for general questions) rendered into chat context
+FINDINGS_CONTEXT_POINTS = int(os.getenv("FINDINGS_CONTEXT_POINTS", "6"))
+FINDINGS_CONTEXT_ANALYTES = int(os.getenv("FINDINGS_CONTEXT_ANALYTES", "12"))
+# Relative change between first and latest value below which a trend is "stable"
+TREND_STABLE_RATIO = 0.05
+
+HISTORY_QUESTION = re.compile(
+    r"\b(trends?|history|histor\w+|chang\w*|improv\w*|wors\w*|progress\w*|over time|previous|past|earlier|"
+    r"last (?:report|test|time|results?)|compar\w*|results?|reports?|levels?|labs?|blood ?work|blood tests?)\b",
+    re.I
+)
+
+# (taken_on, analyte, parameter, value, unit, value_text, normal_range, status, source)
+Row = Tuple[str, str, str, Optional[float], Optional[str], str, str, str, Optional[str]]
+COLUMNS = ("taken_on", "analyte", "parameter", "value", "unit", "value_text", "normal_range", "status", "source")
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.4g}"
+
+
+def parse_report_date(value: Optional[str]) -> str:
+    """ISO day ("2025-06-02") from a date or datetime string; today when empty"""
+    if not value:
+        return date.today().isoformat()
+    try:
+        return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).date().isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid report date '{value}' (expected YYYY-MM-DD)")
+
+
+def _row(finding: Dict[str, Any], taken_on: str, source: Optional[str]) -> Row:
+    canonical = canonical_finding(finding)
+    if canonical:
+        analyte, parameter, value, unit = canonical["key"], canonical["parameter"], canonical["value"], canonical["unit"]
+    else:
+        # Not a known analyte (imaging, free text): kept for the record, no numeric series
+        analyte, parameter, value, unit = f"other:{finding['parameter'].strip().lower()}", finding["parameter"], None, None
+    return (taken_on, analyte, parameter, value, unit, str(finding.get("value", "")),
+            str(finding.get("normal_range", "")), str(finding.get("status", "")), source)
+
+
+# --- Stores ---
+
+class MemoryFindingsStore:
+    """Process-local; per user and analyte a list of rows kept sorted by day"""
+
+    def __init__(self):
+        self._series: Dict[str, Dict[str, List[Row]]] = {}
+
+    async def put(self, user: str, rows: List[Row]):
+        for row in rows:
+            series = self._series.setdefault(user, {}).setdefault(row[1], [])
+            i = bisect_left(series, row[0], key=lambda r: r[0])
+            if i < len(series) and series[i][0] == row[0]:
+                series[i] = row  # same analyte and day: the later report wins
+            else:
+                insort(series, row, key=lambda r: r[0])
+
+    async def query(self, user: str, analytes: Optional[List[str]], since: Optional[str],
+                    until: Optional[str]) -> List[Row]:
+        by_analyte = self._series.get(user, {})
+        rows = []
+        for analyte in (analytes if analytes is not None else sorted(by_analyte)):
+            series = by_analyte.get(analyte, [])
+            lo = bisect_left(series, since, key=lambda r: r[0]) if since else 0
+            hi = bisect_right(series, until, key=lambda r: r[0]) if until else len(series)
+            rows += series[lo:hi]
+        return rows
+
+
+class SQLiteFindingsStore:
+    """
+    WITHOUT ROWID table clustered on (user_id, analyte, taken_on): rows for one
+    series are stored contiguously and range queries never touch a second index.
+    """
+
+    def __init__(self, path: str = "findings.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS findings (
+                    user_id TEXT NOT NULL,
+                    analyte TEXT NOT NULL,
+                    taken_on TEXT NOT NULL,
+                    parameter TEXT NOT NULL,
+                    value REAL,
+                    unit TEXT,
+                    value_text TEXT NOT NULL,
+                    normal_range TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    source TEXT,
+                    PRIMARY KEY (user_id, analyte, taken_on)
+                ) WITHOUT ROWID
+            """)
+            self._conn.commit()
+
+    def _put(self, user: str, rows: List[Row]):
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO findings (user_id, {', '.join(COLUMNS)}) VALUES (?, {', '.join('?' * len(COLUMNS))})",
+                [(user, *row) for row in rows]
+            )
+            self._conn.commit()
+
+    def _query(self, user: str, analytes: Optional[List[str]], since: Optional[str],
+               until: Optional[str]) -> List[Row]:
+        sql = f"SELECT {', '.join(COLUMNS)} FROM findings WHERE user_id = ?"
+        params: List[Any] = [user]
+        if analytes is not None:
+            sql += f" AND analyte IN ({', '.join('?' * len(analytes))})"
+            params += analytes
+        if since:
+            sql += " AND taken_on >= ?"
+            params.append(since)
+        if until:
+            sql += " AND taken_on <= ?"
+            params.append(until)
+        with self._lock:
+            return self._conn.execute(sql + " ORDER BY analyte, taken_on", params).fetchall()
+
+    async def put(self, user: str, rows: List[Row]):
+        await asyncio.to_thread(self._put, user, rows)
+
+    async def query(self, user: str, analytes: Optional[List[str]], since: Optional[str],
+                    until: Optional[str]) -> List[Row]:
+        return await asyncio.to_thread(self._query, user, analytes, since, until)
+
+
+def create_store(spec: Optional[str] = None):
+    """Build a store from FINDINGS_STORE: 'off', 'memory' or 'sqlite:<path>'"""
+    spec = spec or FINDINGS_STORE
+    if spec == "off":
+        return None
+    if spec == "memory":
+        return MemoryFindingsStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteFindingsStore(spec[len("sqlite:"):] or "findings.db")
+    raise ValueError(f"Unknown FINDINGS_STORE '{spec}'")
+
+
+# --- Trends ---
+
+def trend(points: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """First/latest/min/max and direction over the numeric points of one series"""
+    values = [p["value"] for p in points if p["value"] is not None]
+    latest = points[-1]
+    summary = {"count": len(points), "latest": latest["value"], "latest_on": latest["taken_on"],
+               "latest_status": latest["status"]}
+    if len(values) < 2:
+        return {**summary, "direction": None}
+    first, last = values[0], values[-1]
+    change = float(f"{last - first:.6g}")
+    ratio = change / abs(first) if first else None
+    if ratio is not None and abs(ratio) < TREND_STABLE_RATIO:
+        direction = "stable"
+    else:
+        direction = "rising" if change > 0 else "falling" if change < 0 else "stable"
+    return {
+        **summary,
+        "first": first, "first_on": points[0]["taken_on"], "min": min(values), "max": max(values),
+        "change": change, "change_pct": round(ratio * 100, 1) if ratio is not None else None,
+        "direction": direction,
+    }
+
+
+def series_trends(series: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """trend() for every series, labelled with the latest parameter name and unit"""
+    return {
+        analyte: {"parameter": points[-1]["parameter"], "unit": points[-1]["unit"], **trend(points)}
+        for analyte, points in series.items()
+    }
+
+
+class FindingsHistory:
+    """Per-patient findings over a store, with series/trend queries and chat context rendering"""
+
+    def __init__(self, store=None):
+        self.store = store
+        self._configured = store is not None
+
+    def configure(self, spec: Optional[str] = None):
+        """(Re)build the store from a FINDINGS_STORE spec; 'off' disables history"""
+        self.store = create_store(spec)
+        self._configured = True
+
+    def _store(self):
+        # Opened lazily so a preloading parent never shares a connection with its workers
+        if not self._configured:
+            self.configure()
+        return self.store
+
+    @property
+    def enabled(self) -> bool:
+        return self._store() is not None
+
+    async def record(self, user: str, findings: List[Dict[str, Any]], taken_on: str,
+                     source: Optional[str] = None) -> int:
+        """Store one report's findings; returns how many were stored (0 when disabled or on failure)"""
+        if not self.enabled or not findings:
+            return 0
+        rows = [_row(f, taken_on, source) for f in findings if f.get("parameter")]
+        try:
+            await self.store.put(user, rows)
+        except Exception as e:
+            logger.warning(f"Findings history write failed for {user}: {e}")
+            return 0
+        return len(rows)
+
+    async def series(self, user: str, analytes: Optional[List[str]] = None, since: Optional[str] = None,
+                     until: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """analyte -> points ordered by day, optionally restricted to analytes and an inclusive day range"""
+        if not self.enabled:
+            return {}
+        series: Dict[str, List[Dict[str, Any]]] = {}
+        for row in await self.store.query(user, analytes, since, until):
+            series.setdefault(row[1], []).append(dict(zip(COLUMNS, row)))
+        return series
+
+    async def trends(self, user: str, analytes: Optional[List[str]] = None, since: Optional[str] = None,
+                     until: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        return series_trends(await self.series(user, analytes, since, until))
+
+    async def chat_context(self, user: str, message: str) -> str:
+        """
+        Lab history lines for the agent prompt: the series for analytes named
+        in the message, or an overview of every tracked analyte when the
+        message asks about results in general. Empty otherwise (no lookup).
+        """
+        if not self.enabled:
+            return ""
+        mentioned = sorted(get_lab_reference().mentions(message))
+        if not mentioned and not HISTORY_QUESTION.search(message):
+            return ""
+        try:
+            with stage("findings_lookup"):
+                series = await self.series(user, mentioned or None)
+        except Exception as e:
+            logger.warning(f"Findings history read failed for {user}: {e}")
+            return ""
+        series = {a: points for a, points in series.items() if not a.startswith("other:")}
+        if not series:
+            return "LAB RESULT HISTORY: no stored lab results" + (" for " + ", ".join(mentioned) if mentioned else "")
+
+        order = sorted(series)
+        if not mentioned:
+            # General questions: abnormal results first, then the most recently tested
+            order.sort(key=lambda a: series[a][-1]["taken_on"], reverse=True)
+            order.sort(key=lambda a: series[a][-1]["status"].lower() == "normal")
+            order = order[:FINDINGS_CONTEXT_ANALYTES]
+
+        lines = ["LAB RESULT HISTORY (oldest to latest):"]
+        for analyte in order:
+            points = series[analyte]
+            summary = trend(points)
+            shown = points[-FINDINGS_CONTEXT_POINTS:]
+            values = "; ".join(
+                f"{p['taken_on']} {_fmt(p['value']) if p['value'] is not None else p['value_text']} {p['status']}".rstrip()
+                for p in shown
+            )
+            line = f"{points[-1]['parameter']} ({points[-1]['unit']}): {values}"
+            if len(points) > len(shown):
+                line = f"{line} (+{len(points) - len(shown)} earlier)"
+            if summary["direction"]:
+                pct = f", {summary['change_pct']:+g}%" if summary["change_pct"] is not None else ""
+                line += f" | {summary['direction']} since {summary['first_on']} ({summary['change']:+.3g}{pct})"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+findings_history = FindingsHistory()
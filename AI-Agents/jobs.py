@@ -0,0 +1,515 @@
+import os
+import json
+import uuid
+import time
+import socket
+import asyncio
+import sqlite3
+import logging
+import ipaddress
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pydantic import BaseModel, Field
+from metrics import request_id_var, endpoint_var
+
+logger = logging.getLogger(__name__)
+
+# --- Job Model ---
+
+PRIORITIES = {"high": 0, "normal": 5, "low": 9}
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = [SUCCEEDED, FAILED]
+
+# Finished jobs (results hold patient data) are deleted this long after they
+# finish; the sweep runs every JOB_SWEEP_INTERVAL seconds while the queue is up
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", "300"))
+# Each job is owned by the process that queued (or took over) it, and only
+# that process runs it. Running jobs refresh heartbeat_at; a job is orphaned
+# once its owner process is gone (checked by pid on the same host) or, where
+# that cannot be checked, once a running job's heartbeat is older than
+# JOB_LEASE_TIMEOUT. Every queue looks for orphans every JOB_RECOVERY_INTERVAL.
+JOB_HEARTBEAT = float(os.getenv("JOB_HEARTBEAT", "15"))
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", "120"))
+JOB_RECOVERY_INTERVAL = float(os.getenv("JOB_RECOVERY_INTERVAL", "30"))
+
+
+class Job(BaseModel):
+    """A unit of background work and its persisted state"""
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    kind: str = Field(description="Registered handler name, e.g. consultation or report_analysis")
+    status: str = Field(default=QUEUED)
+    priority: int = Field(default=PRIORITIES["normal"], description="Lower runs first")
+    params: Dict[str, Any] = Field(default_factory=dict, description="JSON-serializable handler arguments")
+    data: bytes = Field(default=b"", description="Uploaded file contents")
+    callback_url: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    owner: Optional[str] = Field(default=None, description="host:pid of the process that runs it")
+    quota: Optional[Dict[str, Any]] = Field(default=None, description="Quota charge (user, endpoint, reserved) settled when it finishes")
+    created_at: float = Field(default_factory=time.time)
+    started_at: Optional[float] = None
+    heartbeat_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def public(self) -> Dict[str, Any]:
+        """Job state as returned to clients (without the uploaded bytes)"""
+        return self.dict(exclude={"data", "params", "owner", "heartbeat_at", "quota"})
+
+
+def current_owner() -> str:
+    # Read at call time: forked server workers each get their own pid
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: str) -> Optional[bool]:
+    """Whether the owning process still exists; None when it cannot be checked (another host, Windows)"""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or os.name == "nt" or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def orphaned(job: Job, now: Optional[float] = None) -> bool:
+    """Whether a queued or running job has lost the process that owns it"""
+    if not job.owner:
+        return True  # released on shutdown, or queued before jobs had owners
+    if job.owner == current_owner():
+        return False
+    alive = _owner_alive(job.owner)
+    if alive is not None:
+        return not alive
+    last_seen = job.heartbeat_at or job.started_at
+    return job.status == RUNNING and last_seen is not None and (now or time.time()) - last_seen > JOB_LEASE_TIMEOUT
+
+
+# --- Stores ---
+
+class MemoryJobStore:
+    """Process-local job store; state is lost on restart"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+
+    async def save(self, job: Job):
+        self._jobs[job.id] = job.copy()
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        return job.copy() if job else None
+
+    async def list_by_status(self, statuses: List[str]) -> List[Job]:
+        return [job.copy() for job in self._jobs.values() if job.status in statuses]
+
+    async def claim(self, job_id: str, status: str, owner: Optional[str], new_owner: Optional[str]) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None or job.status != status or job.owner != owner:
+            return None
+        job.status, job.owner, job.heartbeat_at = QUEUED, new_owner, None
+        return job.copy()
+
+    async def delete_finished(self, before: float) -> int:
+        expired = [job.id for job in self._jobs.values()
+                   if job.status in FINISHED and (job.finished_at or 0) < before]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+
+class SQLiteJobStore:
+    """SQLite-backed job store so queued work survives a restart"""
+
+    def __init__(self, path: str = "jobs.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            # Overwrite deleted results and uploads instead of leaving them in free pages
+            self._conn.execute("PRAGMA secure_delete=ON")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    doc TEXT NOT NULL,
+                    data BLOB
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+            self._conn.commit()
+
+    def _save(self, job: Job):
+        doc = json.dumps(job.dict(exclude={"data"}))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, doc, data) VALUES (?, ?, ?, ?)",
+                (job.id, job.status, doc, job.data)
+            )
+            self._conn.commit()
+
+    def _rows(self, query: str, args: tuple) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [Job(**json.loads(doc), data=data or b"") for doc, data in rows]
+
+    async def save(self, job: Job):
+        await asyncio.to_thread(self._save, job)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        rows = await asyncio.to_thread(self._rows, "SELECT doc, data FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    async def list_by_status(self, statuses: List[str]) -> List[Job]:
+        marks = ",".join("?" for _ in statuses)
+        return await asyncio.to_thread(
+            self._rows, f"SELECT doc, data FROM jobs WHERE status IN ({marks})", tuple(statuses)
+        )
+
+    def _claim(self, job_id: str, status: str, owner: Optional[str], new_owner: Optional[str]) -> bool:
+        # One conditional UPDATE: of several processes claiming the same job, exactly one matches
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, doc = json_set(doc, '$.status', ?, '$.owner', ?, '$.heartbeat_at', NULL) "
+                "WHERE id = ? AND status = ? AND json_extract(doc, '$.owner') IS ?",
+                (QUEUED, QUEUED, new_owner, job_id, status, owner)
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    async def claim(self, job_id: str, status: str, owner: Optional[str], new_owner: Optional[str]) -> Optional[Job]:
+        """Atomically requeue a job under `new_owner` if it is still `status` and owned by `owner`"""
+        if not await asyncio.to_thread(self._claim, job_id, status, owner, new_owner):
+            return None
+        return await self.get(job_id)
+
+    def _delete_finished(self, before: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({','.join('?' for _ in FINISHED)}) "
+                "AND COALESCE(json_extract(doc, '$.finished_at'), 0) < ?",
+                (*FINISHED, before)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    async def delete_finished(self, before: float) -> int:
+        return await asyncio.to_thread(self._delete_finished, before)
+
+
+def create_store(spec: Optional[str] = None):
+    """Build a store from JOB_STORE: 'memory' or 'sqlite:<path>'"""
+    spec = spec or os.getenv("JOB_STORE", "sqlite:jobs.db")
+    if spec == "memory":
+        return MemoryJobStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteJobStore(spec[len("sqlite:"):] or "jobs.db")
+    raise ValueError(f"Unknown JOB_STORE '{spec}'")
+
+
+# --- Queue ---
+
+Handler = Callable[[Job], Awaitable[Dict[str, Any]]]
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class InvalidCallbackError(ValueError):
+    pass
+
+
+class JobQueue:
+    """Bounded priority queue drained by a fixed pool of async workers"""
+
+    def __init__(self, store=None, workers: Optional[int] = None, max_queued: Optional[int] = None):
+        self.store = store
+        self.workers = workers or int(os.getenv("JOB_WORKERS", "2"))
+        self.max_queued = max_queued or int(os.getenv("JOB_MAX_QUEUED", "100"))
+        self.drain_timeout = float(os.getenv("JOB_DRAIN_TIMEOUT", "30"))
+        self.retention = JOB_RETENTION
+        self.handlers: Dict[str, Handler] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._maintenance: Optional[asyncio.Task] = None
+        self.owner = current_owner()
+        self._busy: set = set()
+        self._stopping = False
+        self._seq = 0
+        self._running = 0
+        self._counts = {SUCCEEDED: 0, FAILED: 0}
+        self._durations: Dict[str, List[float]] = {}
+
+    def register(self, kind: str, handler: Handler):
+        self.handlers[kind] = handler
+
+    def _put(self, job: Job):
+        self._seq += 1
+        self._queue.put_nowait((job.priority, self._seq, job.id))
+
+    async def start(self, recover: Optional[bool] = None):
+        """
+        Start workers and take over orphaned jobs: queued or running jobs whose
+        owning process has died (see orphaned()). Safe to run in every server
+        worker sharing one store; JOB_RECOVERY=0 turns recovery off.
+        """
+        if self.store is None:
+            self.store = create_store()
+        if recover is None:
+            recover = os.getenv("JOB_RECOVERY", "1") != "0"
+        self.owner = current_owner()
+        self._queue = asyncio.PriorityQueue()
+        self._stopping = False
+        if recover:
+            await self.recover()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._maintenance = asyncio.create_task(self._maintenance_loop(recover))
+
+    async def recover(self) -> int:
+        """Claim and enqueue orphaned jobs; returns how many this process took over"""
+        claimed = 0
+        now = time.time()
+        for job in await self.store.list_by_status([QUEUED, RUNNING]):
+            if not orphaned(job, now):
+                continue
+            job = await self.store.claim(job.id, job.status, job.owner, self.owner)
+            if job is not None:
+                self._put(job)
+                claimed += 1
+        if claimed:
+            logger.info(f"Recovered {claimed} orphaned job(s)")
+        return claimed
+
+    async def sweep(self) -> int:
+        """Delete jobs that finished more than `retention` seconds ago; returns how many"""
+        removed = await self.store.delete_finished(time.time() - self.retention)
+        if removed:
+            logger.info(f"Deleted {removed} finished job(s) older than {self.retention:.0f}s")
+        return removed
+
+    async def _maintenance_loop(self, recover: bool):
+        swept_at = 0.0
+        while True:
+            if time.time() - swept_at >= JOB_SWEEP_INTERVAL:
+                swept_at = time.time()
+                try:
+                    await self.sweep()
+                except Exception as e:
+                    logger.warning(f"Job retention sweep failed: {e}")
+            await asyncio.sleep(JOB_RECOVERY_INTERVAL if recover else JOB_SWEEP_INTERVAL)
+            if recover:
+                try:
+                    await self.recover()
+                except Exception as e:
+                    logger.warning(f"Job recovery failed: {e}")
+
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        Stop taking jobs and give running ones up to `timeout` seconds to
+        finish. Jobs still waiting are released for other processes to take
+        over; anything cut off mid-run is recovered once this process exits.
+        """
+        timeout = self.drain_timeout if timeout is None else timeout
+        self._stopping = True
+        if self._maintenance:
+            self._maintenance.cancel()
+            self._maintenance = None
+        while self._queue is not None and not self._queue.empty():
+            _, _, job_id = self._queue.get_nowait()
+            try:
+                await self.store.claim(job_id, QUEUED, self.owner, None)
+            except Exception as e:
+                logger.warning(f"Could not release queued job {job_id}: {e}")
+        busy = [task for task in self._tasks if task in self._busy]
+        for task in self._tasks:
+            if task not in self._busy:
+                task.cancel()
+        if busy:
+            logger.info(f"Draining {len(busy)} running job(s), up to {timeout}s")
+            _, pending = await asyncio.wait(busy, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Cancelled {len(pending)} job(s) still running after {timeout}s")
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, params: Dict[str, Any], data: bytes = b"",
+                     priority: int = PRIORITIES["normal"], callback_url: Optional[str] = None,
+                     quota: Optional[Dict[str, Any]] = None) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        if self._queue.qsize() >= self.max_queued:
+            raise QueueFullError("Job queue is full, try again later")
+        if callback_url:
+            await asyncio.to_thread(check_callback_url, callback_url)
+        job = Job(kind=kind, params=params, data=data, priority=priority, callback_url=callback_url,
+                  owner=self.owner, quota=quota)
+        await self.store.save(job)
+        self._put(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = await self.store.get(job_id)
+        if job and job.status in FINISHED and (job.finished_at or 0) < time.time() - self.retention:
+            return None  # past retention, the sweep just has not reached it yet
+        return job
+
+    async def _worker(self):
+        task = asyncio.current_task()
+        while not self._stopping:
+            _, _, job_id = await self._queue.get()
+            self._busy.add(task)
+            try:
+                job = await self.store.get(job_id)
+                if job and job.status == QUEUED and job.owner == self.owner:
+                    await self._run(job)
+            except Exception as e:
+                logger.error(f"Job worker error for {job_id}: {e}")
+            finally:
+                self._busy.discard(task)
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        request_id_var.set(job.id)
+        endpoint_var.set(f"job:{job.kind}")
+        job.status = RUNNING
+        job.attempts += 1
+        job.started_at = job.heartbeat_at = time.time()
+        await self.store.save(job)
+        self._running += 1
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            result = await self.handlers[job.kind](job)
+            if "error" in result:
+                job.status, job.error = FAILED, result["error"]
+            else:
+                job.status, job.result = SUCCEEDED, result
+        except Exception as e:
+            job.status, job.error = FAILED, str(e)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            self._running -= 1
+        job.finished_at = time.time()
+        job.data = b""  # uploaded bytes are no longer needed once the job has run
+        await self.store.save(job)
+
+        self._counts[job.status] += 1
+        durations = self._durations.setdefault(job.kind, [])
+        durations.append(job.finished_at - job.started_at)
+        del durations[:-200]
+
+        if job.callback_url:
+            await asyncio.to_thread(_post_callback, job.callback_url, job.public())
+
+    async def _heartbeat(self, job: Job):
+        """Keep the running job's lease fresh until _run cancels this"""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT)
+            job.heartbeat_at = time.time()
+            try:
+                await self.store.save(job)
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {job.id} failed: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        depth: Dict[str, int] = {}
+        if self._queue is not None:
+            names = {v: k for k, v in PRIORITIES.items()}
+            for priority, _, _ in list(self._queue._queue):
+                label = names.get(priority, str(priority))
+                depth[label] = depth.get(label, 0) + 1
+        return {
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": depth,
+            "running": self._running,
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "completed": dict(self._counts),
+            "avg_duration_seconds": {
+                kind: round(sum(d) / len(d), 3) for kind, d in self._durations.items() if d
+            },
+        }
+
+
+# --- Callbacks ---
+# Results are POSTed to a client-supplied URL, so the server must not become a
+# proxy into its own network: https only (JOB_CALLBACK_ALLOW_HTTP=1 for local
+# development), hosts limited to JOB_CALLBACK_HOSTS when set ("example.com"
+# or "*.example.com"), and otherwise only hosts resolving to public addresses.
+# The check runs at submit and again right before posting; redirects are not
+# followed.
+
+JOB_CALLBACK_HOSTS = [h.strip().lower() for h in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if h.strip()]
+JOB_CALLBACK_ALLOW_HTTP = os.getenv("JOB_CALLBACK_ALLOW_HTTP", "0") == "1"
+
+
+def _host_allowed(host: str) -> bool:
+    return any(host == pattern or (pattern.startswith("*.") and host.endswith(pattern[1:]))
+               for pattern in JOB_CALLBACK_HOSTS)
+
+
+def check_callback_url(url: str) -> str:
+    """Raise InvalidCallbackError unless `url` is a permitted callback target"""
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port
+    except ValueError as e:
+        raise InvalidCallbackError(f"Invalid callback_url: {e}")
+    schemes = ("https", "http") if JOB_CALLBACK_ALLOW_HTTP else ("https",)
+    if parts.scheme not in schemes:
+        raise InvalidCallbackError(f"callback_url must use {' or '.join(schemes)}")
+    host = (parts.hostname or "").lower()
+    if not host or parts.username or parts.password:
+        raise InvalidCallbackError("callback_url must name a host and carry no credentials")
+    if JOB_CALLBACK_HOSTS:
+        if not _host_allowed(host):
+            raise InvalidCallbackError(f"callback_url host '{host}' is not allowed")
+        return url
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port or 443, proto=socket.IPPROTO_TCP)}
+    except OSError as e:
+        raise InvalidCallbackError(f"callback_url host '{host}' does not resolve: {e}")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise InvalidCallbackError(f"callback_url host '{host}' resolves to a non-public address")
+    return url
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        raise urllib.error.HTTPError(req.full_url, code, f"Callback redirect to {newurl} refused", headers, fp)
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _post_callback(url: str, payload: Dict[str, Any]):
+    """Push the finished job state to the client-supplied callback URL"""
+    try:
+        check_callback_url(url)
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        _callback_opener.open(request, timeout=10).close()
+    except Exception as e:
+        logger.error(f"Error posting job callback to {url}: {e}")
+
+
+job_queue = JobQueue()
@@ -0,0 +1,305 @@
+import re
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Type
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import JsonOutputParser
+
+logger = logging.getLogger(__name__)
+
+# --- Incremental, Repairing JSON Parser ---
+# Feeds raw model output a chunk at a time and rewrites it into valid JSON as
+# it goes. Handled without another LLM round-trip:
+#   - markdown fences and prose before/after the JSON value
+#   - trailing or missing commas, single-quoted strings, bare keys
+#   - Python literals (True/False/None), raw newlines inside strings
+#   - truncation (unterminated strings, unclosed objects/arrays)
+
+_LITERALS = {
+    "true": "true", "false": "false", "null": "null",
+    "True": "true", "False": "false", "None": "null",
+    "NaN": "null", "Infinity": "null", "-Infinity": "null",
+}
+_NUMBER = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$")
+_TOKEN_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-+.")
+
+
+class IncrementalJsonParser:
+    """
+    Streaming JSON scanner. After every feed() the longest valid prefix is
+    available from snapshot(), and top-level object keys whose values have
+    fully arrived are listed in completed_keys (in arrival order).
+    """
+
+    def __init__(self):
+        self.out: List[str] = []
+        self.stack: List[List[str]] = []   # [container, expecting]
+        self.started = False
+        self.done = False
+        self.in_string = False
+        self.quote = '"'
+        self.escape = False
+        self.string_is_key = False
+        self.string_start = 0
+        self.token: List[str] = []
+        self.token_is_key = False
+        self.pending_comma = False
+        self.safe_len = 0
+        self.safe_closers = ""
+        self.top_key: Optional[str] = None
+        self.completed_keys: List[str] = []
+
+    # State helpers
+
+    def _expecting(self) -> Optional[str]:
+        return self.stack[-1][1] if self.stack else None
+
+    def _mark_safe(self):
+        self.safe_len = len(self.out)
+        self.safe_closers = "".join("}" if c == "{" else "]" for c, _ in reversed(self.stack))
+
+    def _begin_item(self):
+        """A key or value is starting; insert a comma if the model left one out"""
+        if self._expecting() == "comma":
+            self.pending_comma = True
+            self.stack[-1][1] = "key" if self.stack[-1][0] == "{" else "value"
+
+    def _emit_comma(self):
+        if self.pending_comma:
+            self.out.append(",")
+            self.pending_comma = False
+
+    def _value_complete(self):
+        if len(self.stack) == 1 and self.stack[0][0] == "{" and self.top_key is not None:
+            self.completed_keys.append(self.top_key)
+            self.top_key = None
+        if self.stack:
+            self.stack[-1][1] = "comma"
+        self._mark_safe()
+
+    def _key_complete(self, key: str):
+        if len(self.stack) == 1:
+            self.top_key = key
+        self.stack[-1][1] = "colon"
+
+    def _open(self, char: str):
+        self._begin_item()
+        self._emit_comma()
+        self.out.append(char)
+        self.stack.append([char, "key" if char == "{" else "value"])
+        self._mark_safe()
+
+    def _close(self):
+        self.pending_comma = False  # drop trailing commas
+        container, _ = self.stack.pop()
+        self.out.append("}" if container == "{" else "]")
+        self._value_complete()
+        if not self.stack:
+            self.done = True
+
+    def _end_string(self):
+        self.out.append('"')
+        self.in_string = False
+        if self.string_is_key:
+            raw = "".join(self.out[self.string_start:])
+            try:
+                key = json.loads(raw)
+            except ValueError:
+                key = raw.strip('"')
+            self._key_complete(key)
+        else:
+            self._value_complete()
+
+    def _finish_token(self):
+        text = "".join(self.token)
+        self.token = []
+        self._emit_comma()
+        if self.token_is_key:
+            self.out.append(json.dumps(text))
+            self._key_complete(text)
+            return
+        if text in _LITERALS:
+            self.out.append(_LITERALS[text])
+        elif _NUMBER.match(text):
+            self.out.append(text)
+        else:
+            self.out.append(json.dumps(text))  # unquoted word value
+        self._value_complete()
+
+    # Public API
+
+    def feed(self, chunk: str):
+        for char in chunk:
+            if self.done:
+                return
+            if not self.started:
+                if char in "{[":
+                    self.started = True
+                    self._open(char)
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    if char == "'" and self.out and self.out[-1] == "\\":
+                        self.out[-1] = "'"  # \' is not a valid JSON escape
+                    else:
+                        self.out.append(char)
+                elif char == "\\":
+                    self.out.append(char)
+                    self.escape = True
+                elif char == self.quote:
+                    self._end_string()
+                elif char == '"':
+                    self.out.append('\\"')
+                elif char == "\n":
+                    self.out.append("\\n")
+                elif char in "\r\t":
+                    self.out.append("\\r" if char == "\r" else "\\t")
+                else:
+                    self.out.append(char)
+                continue
+
+            if self.token:
+                if char in _TOKEN_CHARS:
+                    self.token.append(char)
+                    continue
+                self._finish_token()
+
+            if char in " \t\r\n":
+                continue
+            if char in "\"'":
+                self._begin_item()
+                self._emit_comma()
+                self.in_string = True
+                self.quote = char
+                self.string_is_key = self._expecting() == "key"
+                self.string_start = len(self.out)
+                self.out.append('"')
+            elif char in "{[":
+                self._open(char)
+            elif char in "}]":
+                self._close()
+            elif char == ":":
+                self.out.append(":")
+                if self.stack:
+                    self.stack[-1][1] = "value"
+            elif char == ",":
+                if self._expecting() == "comma":
+                    self.pending_comma = True
+                    self.stack[-1][1] = "key" if self.stack[-1][0] == "{" else "value"
+            elif char in _TOKEN_CHARS:
+                self._begin_item()
+                self.token_is_key = self._expecting() == "key"
+                self.token.append(char)
+            # anything else (comments, stray prose) is dropped
+
+    def finish(self):
+        """Flush a trailing token or string at end of stream"""
+        if self.token:
+            text = "".join(self.token)
+            truncated_literal = text not in _LITERALS and any(lit.startswith(text) for lit in _LITERALS)
+            if truncated_literal:
+                self.token = []
+            else:
+                self._finish_token()
+        if self.in_string:
+            self._end_string()
+
+    def snapshot(self) -> Optional[Any]:
+        """Longest valid prefix of the value seen so far, closed off"""
+        if not self.started:
+            return None
+        try:
+            return json.loads("".join(self.out[:self.safe_len]) + self.safe_closers)
+        except ValueError:
+            return None
+
+
+def repair_json(text: str) -> Optional[Any]:
+    """Parse possibly malformed or truncated model output without a retry"""
+    parser = IncrementalJsonParser()
+    parser.feed(text)
+    parser.finish()
+    return parser.snapshot()
+
+
+# --- Schema Helpers ---
+
+def validate_field(model: Type[BaseModel], name: str, value: Any) -> Tuple[bool, Any]:
+    """Validate one top-level field against the model's annotation"""
+    field = model.model_fields.get(name)
+    if field is None:
+        return False, value
+    try:
+        return True, TypeAdapter(field.annotation).validate_python(value)
+    except ValidationError:
+        return False, value
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+async def stream_fields(model: Type[BaseModel], chunks: AsyncIterator[str]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Consume streamed completion text and yield events as soon as each
+    top-level field of `model` is complete and valid:
+        {"event": "field", "name": ..., "value": ...}
+    followed by a final {"event": "result", "data": ...} (or "error").
+    """
+    parser = IncrementalJsonParser()
+    emitted = 0
+    async for chunk in chunks:
+        parser.feed(chunk)
+        if len(parser.completed_keys) > emitted:
+            data = parser.snapshot() or {}
+            for name in parser.completed_keys[emitted:]:
+                ok, value = validate_field(model, name, data.get(name))
+                if ok:
+                    yield {"event": "field", "name": name, "value": _jsonable(value)}
+            emitted = len(parser.completed_keys)
+
+    parser.finish()
+    data = parser.snapshot()
+    try:
+        yield {"event": "result", "data": model(**data).model_dump()}
+    except (TypeError, ValidationError) as e:
+        yield {"event": "error", "error": f"Model output did not match {model.__name__}: {e}"}
+
+
+# --- LangChain Parser ---
+
+class RobustJsonOutputParser(JsonOutputParser):
+    """
+    JsonOutputParser that repairs malformed output locally instead of failing.
+    Final output, parsed or repaired, must validate against `pydantic_object`
+    (JsonOutputParser itself closes truncated JSON without checking it): a
+    completion missing required fields raises OutputParserException, so the
+    router falls back to the next backend instead of returning it as a result.
+    """
+
+    def parse_result(self, result, *, partial: bool = False):
+        text = result[0].text
+        try:
+            parsed = super().parse_result(result, partial=partial)
+        except OutputParserException:
+            if partial:
+                return None
+            parsed = repair_json(text)
+            if parsed is None:
+                raise
+            logger.info(f"Repaired malformed JSON output ({len(text)} chars)")
+        if not partial and self.pydantic_object is not None:
+            try:
+                self.pydantic_object.model_validate(parsed)
+            except ValidationError as e:
+                raise OutputParserException(
+                    f"Output does not match {self.pydantic_object.__name__}: {e}", llm_output=text
+                ) from e
+        return parsed
@@ -0,0 +1,319 @@
+import os
+import re
+import json
+import math
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+from safety_index import NameTrie, normalize
+
+logger = logging.getLogger(__name__)
+
+DATA_PATH = os.getenv(
+    "LAB_REFERENCE_DATA",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lab_reference.json")
+)
+
+# --- Line Grammar ---
+# Lab reports are mostly one result per line: name, value, unit, reference
+# range, sometimes a flag ("Hemoglobin 13.5 g/dL 13.0-17.0", "S. Creatinine :
+# 1.9 mg/dL (H) 0.7 - 1.3"). The value is the first number not glued to a
+# letter (so the 12 in "Vitamin B12" is part of the name) and not an ordinal.
+
+_NUM = r"\d+(?:,\d{2,3})*(?:\.\d+)?"
+VALUE = re.compile(rf"(?<![A-Za-z0-9.^/*])([<>]=?|≤|≥)?\s*({_NUM})(?![\d^]|(?:st|nd|rd|th)\b)")
+RANGES = [
+    ("between", re.compile(rf"({_NUM})\s*(?:-|–|—|to)\s*({_NUM})", re.I)),
+    ("upper", re.compile(rf"(?:<=?|≤|up\s*to|upto|less\s+than|below)\s*({_NUM})", re.I)),
+    ("lower", re.compile(rf"(?:>=?|≥|more\s+than|greater\s+than|above)\s*({_NUM})", re.I)),
+]
+FLAGS = re.compile(r"(?<!\S)(?:\(?(?:h|l|hh|ll|high|low|critical|abnormal)\)?|\*+|↑|↓)(?!\S)", re.I)
+PARENS = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+
+# Results for these are not the analyte itself ("Cholesterol/HDL Ratio", "Urine Creatinine")
+EXCLUDED_WORDS = {"ratio", "index", "urine", "urinary", "csf", "fluid"}
+# Aliases shorter than this only resolve on an exact name match ("K", "Na", "Hb")
+MIN_CONTAINED_ALIAS = 4
+# Aliases shorter than this are not picked out of chat messages ("na", "k")
+MIN_MENTION_ALIAS = 3
+CONTEXT_CHARS = int(os.getenv("REPORT_CONTEXT_CHARS", "1500"))
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+def _fmt(value: float) -> str:
+    return f"{float(f'{value:.3g}'):g}" if value else "0"
+
+
+def _unit_key(text: str) -> str:
+    return text.lower().replace("µ", "u").replace("μ", "u").replace(" ", "").strip("()[],;:")
+
+
+# --- Lab Reference ---
+
+class LabReference:
+    """
+    Analyte table: names and aliases, canonical unit with conversion factors,
+    reference range and critical limits (all in the canonical unit).
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self.version = data.get("version")
+        self.panels: Dict[str, str] = data.get("panels", {})
+        self.tests: Dict[str, Dict[str, Any]] = data.get("tests", {})
+        self.unit_aliases = {_unit_key(k): _unit_key(v) for k, v in data.get("unit_aliases", {}).items()}
+        self.aliases: Dict[str, str] = {}
+        self.trie = NameTrie()
+        self.mention_trie = NameTrie()
+        for key, test in self.tests.items():
+            test["unit_label"] = test["unit"]
+            test["unit"] = _unit_key(test["unit"])
+            test["units"] = {_unit_key(u): f for u, f in test.get("units", {}).items()}
+        # Anything that reads as a unit, convertible for a given analyte or not
+        self.known_units = {*self.unit_aliases, *self.unit_aliases.values()}
+        for key, test in self.tests.items():
+            self.known_units |= {test["unit"], *test["units"]}
+            for alias in [test["name"], *test.get("aliases", [])]:
+                name = normalize(alias)
+                self.aliases.setdefault(name, key)
+                if len(name) >= MIN_CONTAINED_ALIAS:
+                    self.trie.insert(name, [key])
+                if len(name) >= MIN_MENTION_ALIAS:
+                    self.mention_trie.insert(name, [key])
+
+    @classmethod
+    def load(cls, path: str = DATA_PATH) -> "LabReference":
+        start = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            reference = cls(json.load(f))
+        logger.info(f"Lab reference {reference.version} built in {(time.perf_counter() - start) * 1000:.1f}ms "
+                    f"({len(reference.tests)} analytes)")
+        return reference
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Analyte key for a printed test name, or None when unknown or ambiguous"""
+        full = normalize(name)
+        if not full or EXCLUDED_WORDS & set(full.split()):
+            return None
+        bare = normalize(PARENS.sub(" ", name))
+        inner = [normalize(m[1:-1]) for m in PARENS.findall(name)]
+        for candidate in [full, bare, *inner]:
+            if candidate in self.aliases:
+                return self.aliases[candidate]
+        found = self.trie.find_all(bare or full)
+        return next(iter(found)) if len(found) == 1 else None
+
+    def mentions(self, text: str) -> Set[str]:
+        """Analyte keys named anywhere in free text ("has my HbA1c come down?")"""
+        return self.mention_trie.find_all(text)
+
+    def leading_unit(self, text: str) -> str:
+        """The unit at the start of `text` ("mg/dL Desirable" -> "mg/dL"); the first word if none is known"""
+        words = text.replace("|", " ").split()
+        for n in (3, 2, 1):
+            candidate = " ".join(words[:n]).strip(" :;,()[]")
+            if len(words) >= n and _unit_key(candidate) in self.known_units:
+                return candidate
+        return words[0].strip(" :;,()[]") if words else ""
+
+    def factor(self, key: str, unit: str) -> Optional[float]:
+        """Multiplier from `unit` to the analyte's canonical unit, None if unknown"""
+        test = self.tests[key]
+        unit = self.unit_aliases.get(_unit_key(unit), _unit_key(unit))
+        if unit == test["unit"]:
+            return 1.0
+        return test["units"].get(unit)
+
+    def range_factor(self, key: str, low: Optional[float], high: Optional[float]) -> float:
+        """
+        For a value printed without a unit: the known unit whose reference range
+        best matches the laboratory's printed range. Only the range is used, never
+        the value, so an abnormal result is not pulled towards normal.
+        """
+        test = self.tests[key]
+        ref_low, ref_high = test["range"]
+        target = math.sqrt(ref_low * ref_high) if ref_low and ref_high else (ref_high / 2 if ref_high else ref_low * 1.5)
+        printed = math.sqrt(low * high) if low and high else (high / 2 if high else (low or 0) * 1.5)
+        if printed <= 0:
+            return 1.0
+        return min([1.0, *test["units"].values()], key=lambda f: abs(math.log(printed * f / target)))
+
+    def trailing_unit(self, text: str) -> str:
+        """A known unit printed after a reference range ("12-15 g/dL"), else ''"""
+        unit = self.leading_unit(FLAGS.sub(" ", text))
+        return unit if unit and _unit_key(unit) in self.known_units else ""
+
+
+_reference: Optional[LabReference] = None
+_reference_lock = threading.Lock()
+
+
+def get_lab_reference() -> LabReference:
+    """Process-wide reference table, built on first use"""
+    global _reference
+    if _reference is None:
+        with _reference_lock:
+            if _reference is None:
+                _reference = LabReference.load()
+    return _reference
+
+
+# --- Parser ---
+
+def _find_range(text: str) -> Optional[Tuple[str, Optional[float], Optional[float], int, int]]:
+    """Earliest reference range in `text`: (kind, low, high, start, end)"""
+    best = None
+    for kind, pattern in RANGES:
+        m = pattern.search(text)
+        if m and (best is None or m.start() < best[3]):
+            if kind == "between":
+                best = (kind, _number(m.group(1)), _number(m.group(2)), m.start(), m.end())
+            elif kind == "upper":
+                best = (kind, None, _number(m.group(1)), m.start(), m.end())
+            else:
+                best = (kind, _number(m.group(1)), None, m.start(), m.end())
+    return best
+
+
+def _status(value: float, low: Optional[float], high: Optional[float]) -> str:
+    if low is not None and value < low:
+        return "Low"
+    if high is not None and value > high:
+        return "High"
+    return "Normal"
+
+
+def _range_text(low: Optional[float], high: Optional[float]) -> str:
+    if low is None:
+        return f"< {_fmt(high)}"
+    if high is None:
+        return f"> {_fmt(low)}"
+    return f"{_fmt(low)}-{_fmt(high)}"
+
+
+def parse_line(line: str, reference: LabReference) -> Optional[Dict[str, Any]]:
+    """One finding from a report line, or None if the line is not a recognised result"""
+    for m in VALUE.finditer(line):
+        name = line[:m.start()]
+        if name.count("(") > name.count(")"):
+            continue  # a number inside the name, e.g. "Glucose PP (2 hr)"
+        key = reference.resolve(name)
+        if key is None:
+            continue
+        test = reference.tests[key]
+        value = _number(m.group(2))
+        value_text = f"{m.group(1) or ''}{m.group(2)}"
+
+        rest = line[m.end():]
+        found = _find_range(rest)
+        unit_text = reference.leading_unit(FLAGS.sub(" ", rest[:found[3]] if found else rest))
+
+        factor = reference.factor(key, unit_text) if unit_text else None
+        if unit_text and factor is None and _unit_key(unit_text) not in reference.known_units:
+            # Not a unit at all (e.g. a method name); judge as if it were missing
+            unit_text = ""
+        if not unit_text and found:
+            # Some layouts print the unit after the range ("11.2 L 12-15 g/dL")
+            unit_text = reference.trailing_unit(rest[found[4]:])
+            factor = reference.factor(key, unit_text) if unit_text else None
+        if factor is None and not unit_text:
+            # No unit anywhere: match the lab's printed range, else assume the canonical unit
+            factor = reference.range_factor(key, found[1], found[2]) if found else 1.0
+
+        # Prefer the laboratory's own range (same unit as the value); else the table's
+        if found:
+            low, high = found[1], found[2]
+            range_text = rest[found[3]:found[4]].strip()
+        elif factor:
+            low = test["range"][0] / factor if test["range"][0] is not None else None
+            high = test["range"][1] / factor if test["range"][1] is not None else None
+            range_text = _range_text(low, high)
+        else:
+            return None
+
+        status = _status(value, low, high)
+        critical = test.get("critical")
+        if critical and factor:
+            canonical = value * factor
+            if (critical[0] is not None and canonical < critical[0]) or \
+                    (critical[1] is not None and canonical > critical[1]):
+                status = "Critical"
+
+        return {
+            "key": key,
+            "parameter": test["name"],
+            "value": f"{value_text} {unit_text}".strip(),
+            "normal_range": f"{range_text} {unit_text}".strip(),
+            "status": status,
+        }
+    return None
+
+
+def canonical_finding(finding: Dict[str, Any], reference: Optional[LabReference] = None) -> Optional[Dict[str, Any]]:
+    """
+    Analyte key, numeric value and unit in the table's canonical unit for a
+    finding from either the local parser or the LLM ("7.1 %", "6.2 mmol/L").
+    A value without a unit takes the unit printed with its normal range; with
+    neither, or a unit that does not convert, the value is None rather than a
+    guess. None when the parameter is unknown or the value is not a number.
+    """
+    reference = reference or get_lab_reference()
+    key = reference.resolve(finding.get("parameter", ""))
+    m = VALUE.search(str(finding.get("value", "")))
+    if key is None or m is None:
+        return None
+    test = reference.tests[key]
+    unit_text = reference.trailing_unit(m.string[m.end():])
+    if not unit_text:
+        normal_range = str(finding.get("normal_range", ""))
+        found = _find_range(normal_range)
+        unit_text = reference.trailing_unit(normal_range[found[4]:] if found else normal_range)
+    factor = reference.factor(key, unit_text) if unit_text else None
+    value = _number(m.group(2)) * factor if factor is not None else None
+    return {"key": key, "parameter": test["name"], "value": value, "unit": test["unit_label"]}
+
+
+def parse_lab_report(text: str, reference: Optional[LabReference] = None) -> Dict[str, Any]:
+    """
+    Findings for every recognised result line (first occurrence of each
+    analyte), the report type from the panels they belong to, and the
+    remaining free-text lines as context for the narrative.
+    """
+    start = time.perf_counter()
+    reference = reference or get_lab_reference()
+    findings, seen, panels, context = [], set(), [], []
+    for raw in (text or "").splitlines():
+        line = " ".join(raw.split())
+        if not line:
+            continue
+        finding = parse_line(line, reference) if any(c.isdigit() for c in line) else None
+        if finding is None:
+            if any(c.isalpha() for c in line):
+                context.append(line)
+            continue
+        key = finding.pop("key")
+        if key in seen:
+            continue
+        seen.add(key)
+        findings.append(finding)
+        panel = reference.panels.get(reference.tests[key].get("panel"))
+        if panel and panel not in panels:
+            panels.append(panel)
+
+    context_text, used = [], 0
+    for line in context:
+        if used + len(line) > CONTEXT_CHARS:
+            break
+        context_text.append(line)
+        used += len(line) + 1
+
+    return {
+        "report_type": ", ".join(panels) or "Lab Report",
+        "findings": findings,
+        "context": "\n".join(context_text),
+        "reference_version": reference.version,
+        "latency_us": round((time.perf_counter() - start) * 1e6, 1),
+    }
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import logging
+import importlib
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Lazy Modules ---
+# The request handlers pull in LangChain, the Groq SDK, PyPDF2/PIL/pytesseract
+# and Motor, which together take most of a second to import. app.py refers to
+# them through LazyModule, so importing the app (worker boot, autoscaling,
+# test collection) costs little more than FastAPI itself. The real imports run
+# on first use or in warm_up(), which the lifespan hook starts in the
+# background and serve.py runs before forking workers.
+
+# Import order for warm-up; each entry is timed on its own, so modules it
+# pulls in that are not loaded yet count towards it
+WARM_UP_MODULES = [
+    "llm_router",
+    "json_stream",
+    "database",
+    "chat_diagnosis",
+    "agent_service",
+    "report_analyzer",
+    "consulatation_handler",
+    "pre_diagnosis",
+]
+# "background" (serve while importing), "blocking" (finish before serving) or "off" (first use only)
+LAZY_WARM_UP = os.getenv("LAZY_WARM_UP", "background")
+
+
+class LazyModule:
+    """
+    Stand-in for a module that imports it on first attribute access.
+    importlib's per-module locks make a concurrent first use (a request racing
+    the warm-up thread) wait for the one import instead of running it twice.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None or self._name in sys.modules
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}' ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+# --- Warm-up ---
+
+_profile: Dict[str, float] = {}
+_warm: Optional[bool] = None  # None: not started, False: running, True: done
+
+
+def warm_up(modules: Optional[List[str]] = None) -> Dict[str, float]:
+    """Import the handler modules now; returns milliseconds spent per module (0 if already loaded)"""
+    global _warm
+    _warm = False
+    start = time.perf_counter()
+    for name in modules or WARM_UP_MODULES:
+        module_start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            # Surfaced again, with the real traceback, by the first request that needs it
+            logger.error(f"Warm-up import of {name} failed: {e}")
+        _profile.setdefault(name, round((time.perf_counter() - module_start) * 1000, 1))
+    _warm = True
+    logger.info(f"Warm-up imports done in {(time.perf_counter() - start) * 1000:.0f}ms: "
+                + ", ".join(f"{name} {ms:.0f}ms" for name, ms in _profile.items()))
+    return dict(_profile)
+
+
+def warm_up_state() -> Dict[str, Any]:
+    """For /health: whether the handler modules are imported yet, and what each cost"""
+    return {
+        "state": {None: "cold", False: "warming", True: "warm"}[_warm],
+        "import_ms": dict(_profile),
+    }
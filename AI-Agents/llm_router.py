@@ -0,0 +1,424 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+from metrics import stage, record_tokens
+from tracing import span, set_attributes
+
+logger = logging.getLogger(__name__)
+
+# --- Route Configuration ---
+# Each task maps to an ordered list of backends ("provider:model"). The first
+# backend is the primary; the rest are used as hedges (when the primary is
+# slower than its observed latency percentile) and as fallbacks on failure.
+# Override with LLM_ROUTES (JSON string) or LLM_ROUTES_FILE (path to JSON).
+
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    "triage": {
+        "backends": ["groq:llama-3.3-70b-versatile", "gemini:gemini-2.5-flash"],
+        "temperature": 0.3,
+    },
+    "next_question": {
+        "backends": ["groq:llama-3.3-70b-versatile", "gemini:gemini-2.5-flash"],
+        "temperature": 0.3,
+    },
+    "entity_extraction": {
+        "backends": ["groq:llama-3.1-8b-instant", "groq:llama-3.3-70b-versatile"],
+        "temperature": 0.3,
+    },
+    "final_summary": {
+        "backends": ["groq:llama-3.3-70b-versatile", "gemini:gemini-2.5-flash"],
+        "temperature": 0.3,
+    },
+    "consultation_summary": {
+        "backends": ["groq:llama-3.3-70b-versatile", "gemini:gemini-2.5-flash"],
+        "temperature": 0.3,
+    },
+    "prescription": {
+        "backends": ["groq:llama-3.3-70b-versatile", "gemini:gemini-2.5-flash"],
+        "temperature": 0.2,
+    },
+    "report_analysis": {
+        "backends": ["groq:llama-3.3-70b-versatile", "gemini:gemini-2.5-flash"],
+        "temperature": 0.3,
+    },
+    # Summary/recommendations/concerns for lab reports whose findings were parsed locally
+    "report_narrative": {
+        "backends": ["groq:llama-3.3-70b-versatile", "gemini:gemini-2.5-flash"],
+        "temperature": 0.3,
+    },
+    "agent_chat": {
+        "backends": ["gemini:gemini-2.5-flash", "groq:llama-3.3-70b-versatile"],
+        "temperature": 0.7,
+        "max_tokens": 8192,
+    },
+    # Free-text interview prompts (the "gemini" interview backend, formerly server.py)
+    "next_question_text": {
+        "backends": ["gemini:gemini-2.5-flash", "groq:llama-3.3-70b-versatile"],
+        "temperature": 0.7,
+    },
+    "final_summary_text": {
+        "backends": ["gemini:gemini-2.5-flash", "groq:llama-3.3-70b-versatile"],
+        "temperature": 0.4,
+        "max_tokens": 8192,
+    },
+}
+
+HEDGE_PERCENTILE = 0.95       # hedge once the primary exceeds this latency percentile
+HEDGE_MIN_SAMPLES = 20        # below this many samples, use DEFAULT_HEDGE_AFTER
+DEFAULT_HEDGE_AFTER = 8.0     # seconds
+MIN_HEDGE_AFTER = 0.5         # never hedge sooner than this
+LATENCY_WINDOW = 500          # latency samples kept per route
+
+
+def load_routes() -> Dict[str, Dict[str, Any]]:
+    """Load route config from the environment, falling back to DEFAULT_ROUTES"""
+    routes = {task: dict(cfg) for task, cfg in DEFAULT_ROUTES.items()}
+    raw = os.getenv("LLM_ROUTES")
+    path = os.getenv("LLM_ROUTES_FILE")
+    try:
+        if path:
+            with open(path) as f:
+                raw = f.read()
+        if raw:
+            for task, cfg in json.loads(raw).items():
+                routes.setdefault(task, {}).update(cfg)
+    except Exception as e:
+        logger.error(f"Error loading LLM routes, using defaults: {e}")
+    return routes
+
+
+# --- Backends ---
+
+def _groq_backend(model: str, cfg: Dict[str, Any]):
+    from langchain_groq import ChatGroq
+    kwargs = {}
+    if cfg.get("max_tokens"):
+        kwargs["max_tokens"] = cfg["max_tokens"]
+    return ChatGroq(
+        model=model,
+        temperature=cfg.get("temperature", 0.3),
+        groq_api_key=os.getenv("GROQ_API_KEY"),
+        **kwargs
+    )
+
+
+_gemini_configured = False
+
+
+def _gemini_backend(model: str, cfg: Dict[str, Any]):
+    """Wrap google.generativeai as a runnable that accepts a prompt value"""
+    global _gemini_configured
+    import google.generativeai as genai
+    if not _gemini_configured:
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        _gemini_configured = True
+
+    generation_config = {
+        "temperature": cfg.get("temperature", 0.3),
+        "top_p": cfg.get("top_p", 0.95),
+        "top_k": cfg.get("top_k", 64),
+        "max_output_tokens": cfg.get("max_tokens", 8192),
+        "response_mime_type": "text/plain",
+    }
+
+    def call(prompt_value):
+        messages = prompt_value.to_messages() if hasattr(prompt_value, "to_messages") else prompt_value
+        system = "\n".join(m.content for m in messages if isinstance(m, SystemMessage))
+        turns = [m for m in messages if not isinstance(m, SystemMessage)]
+        history = [
+            {"role": "user" if isinstance(m, HumanMessage) else "model", "parts": [m.content]}
+            for m in turns[:-1]
+        ]
+        gemini = genai.GenerativeModel(
+            model_name=model,
+            system_instruction=system or None,
+            generation_config=generation_config
+        )
+        chat = gemini.start_chat(history=history)
+        response = chat.send_message(turns[-1].content if turns else "")
+        usage = getattr(response, "usage_metadata", None)
+        usage_metadata = None
+        if usage is not None:
+            usage_metadata = {
+                "input_tokens": usage.prompt_token_count,
+                "output_tokens": usage.candidates_token_count,
+                "total_tokens": usage.total_token_count,
+            }
+        return AIMessage(content=response.text, usage_metadata=usage_metadata)
+
+    return RunnableLambda(call)
+
+
+def _local_backend(model: str, cfg: Dict[str, Any]):
+    """
+    Local stand-in model for offline development. `model` is a path to a JSON
+    file mapping task name to a canned completion string.
+    """
+    with open(model) as f:
+        responses = json.load(f)
+    task = cfg.get("task")
+
+    def call(prompt_value):
+        return AIMessage(content=responses.get(task, responses.get("default", "{}")))
+
+    return RunnableLambda(call)
+
+
+BACKEND_FACTORIES: Dict[str, Callable[[str, Dict[str, Any]], Any]] = {
+    "groq": _groq_backend,
+    "gemini": _gemini_backend,
+    "local": _local_backend,
+}
+
+
+def register_backend(provider: str, factory: Callable[[str, Dict[str, Any]], Any]):
+    """Register a backend provider. `factory(model, route_cfg)` returns a runnable chat model."""
+    BACKEND_FACTORIES[provider] = factory
+
+
+# --- Stats ---
+
+class RouteStats:
+    """Latency and outcome counters for one (task, backend) route"""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self.lock:
+            self.requests += 1
+            if ok:
+                self.successes += 1
+                self.latencies.append(latency)
+            else:
+                self.failures += 1
+
+    def count_hedge(self, won: bool = False):
+        with self.lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, int(q * len(samples)))
+        return samples[idx]
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "success_rate": round(self.successes / self.requests, 4) if self.requests else None,
+            "hedges_started": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p50_seconds": round(p50, 4) if p50 is not None else None,
+            "p95_seconds": round(p95, 4) if p95 is not None else None,
+        }
+
+
+# --- Router ---
+
+class LLMRouter:
+    """Routes each task to an ordered list of backends with hedging and fallback"""
+
+    def __init__(self, routes: Optional[Dict[str, Dict[str, Any]]] = None, max_workers: Optional[int] = None):
+        # Upper bound on concurrent backend calls in this process (hedges included)
+        max_workers = max_workers or int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+        self.routes = routes if routes is not None else load_routes()
+        self.stats: Dict[str, Dict[str, RouteStats]] = {}
+        self._models: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-route")
+        self._inflight: set = set()
+
+    def _route(self, task: str) -> Dict[str, Any]:
+        if task not in self.routes:
+            raise KeyError(f"No LLM route configured for task '{task}'")
+        return self.routes[task]
+
+    def _stats(self, task: str, backend: str) -> RouteStats:
+        with self._lock:
+            return self.stats.setdefault(task, {}).setdefault(backend, RouteStats())
+
+    def _model(self, task: str, backend: str, cfg: Dict[str, Any]):
+        key = (task, backend)
+        with self._lock:
+            model = self._models.get(key)
+        if model is None:
+            provider, _, name = backend.partition(":")
+            if provider not in BACKEND_FACTORIES:
+                raise ValueError(f"Unknown LLM provider '{provider}'")
+            model = BACKEND_FACTORIES[provider](name, {**cfg, "task": task})
+            with self._lock:
+                self._models[key] = model
+        return model
+
+    def hedge_after(self, task: str, backend: str) -> float:
+        """Seconds to wait on `backend` before starting a hedged request"""
+        cfg = self._route(task)
+        stats = self._stats(task, backend)
+        if len(stats.latencies) < cfg.get("hedge_min_samples", HEDGE_MIN_SAMPLES):
+            return cfg.get("hedge_after", DEFAULT_HEDGE_AFTER)
+        threshold = stats.percentile(cfg.get("hedge_percentile", HEDGE_PERCENTILE))
+        return max(cfg.get("min_hedge_after", MIN_HEDGE_AFTER), threshold)
+
+    def _attempt(self, task: str, backend: str, cfg: Dict[str, Any], prompt, inputs, parser):
+        stats = self._stats(task, backend)
+        start = time.perf_counter()
+        try:
+            with span(f"llm.{task}", **{"llm.task": task, "llm.backend": backend}):
+                model = self._model(task, backend, cfg)
+                with stage("prompt_build"):
+                    prompt_value = prompt.invoke(inputs)
+                with stage("llm_call"):
+                    message = model.invoke(prompt_value)
+                usage = getattr(message, "usage_metadata", None) or {}
+                record_tokens(task, backend, usage)
+                set_attributes(**{
+                    "llm.input_tokens": usage.get("input_tokens"),
+                    "llm.output_tokens": usage.get("output_tokens"),
+                })
+                result = message
+                if parser is not None:
+                    with stage("json_parse"):
+                        result = parser.invoke(message)
+        except Exception:
+            stats.record(time.perf_counter() - start, ok=False)
+            raise
+        stats.record(time.perf_counter() - start, ok=True)
+        return result
+
+    def invoke(self, task: str, prompt, inputs: Dict[str, Any], parser=None):
+        """
+        Run `prompt | model | parser` for `task`. Starts on the primary backend,
+        hedges to the next backend once the in-flight attempt exceeds its latency
+        percentile, and falls back on errors. Returns the first successful result.
+        """
+        cfg = self._route(task)
+        backends: List[str] = list(cfg["backends"])
+        pending = {}
+        last_error: Optional[Exception] = None
+        next_idx = 0
+
+        def launch(hedge: bool = False):
+            nonlocal next_idx
+            backend = backends[next_idx]
+            next_idx += 1
+            if hedge:
+                self._stats(task, backend).count_hedge()
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, self._attempt, task, backend, cfg, prompt, inputs, parser)
+            self._inflight.add(future)
+            future.add_done_callback(self._inflight.discard)
+            pending[future] = (backend, hedge)
+
+        launch()
+        while pending:
+            newest_backend = list(pending.values())[-1][0]
+            timeout = self.hedge_after(task, newest_backend) if next_idx < len(backends) else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                launch(hedge=True)
+                continue
+
+            for future in done:
+                backend, hedge = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning(f"LLM route {task} -> {backend} failed: {e}")
+                    last_error = e
+                    if next_idx < len(backends):
+                        launch()
+                    continue
+                if hedge:
+                    self._stats(task, backend).count_hedge(won=True)
+                return result
+
+        raise last_error or RuntimeError(f"All backends failed for task '{task}'")
+
+    def drain(self, timeout: float = 30.0) -> int:
+        """
+        Block until in-flight backend calls (including losing hedges) finish or
+        `timeout` passes. Returns the number still running.
+        """
+        inflight = list(self._inflight)
+        if not inflight:
+            return 0
+        logger.info(f"Draining {len(inflight)} in-flight LLM call(s), up to {timeout}s")
+        _, not_done = wait(inflight, timeout=timeout)
+        if not_done:
+            logger.warning(f"{len(not_done)} LLM call(s) still running after {timeout}s")
+        return len(not_done)
+
+    async def ainvoke(self, task: str, prompt, inputs: Dict[str, Any], parser=None):
+        """Async wrapper around invoke() that keeps the event loop free"""
+        import asyncio
+        return await asyncio.to_thread(self.invoke, task, prompt, inputs, parser)
+
+    async def astream(self, task: str, prompt, inputs: Dict[str, Any]):
+        """
+        Stream completion text for `task`. Backends are tried in order; once a
+        backend has produced output it is committed to (no hedging mid-stream).
+        """
+        cfg = self._route(task)
+        last_error: Optional[Exception] = None
+        for backend in cfg["backends"]:
+            stats = self._stats(task, backend)
+            start = time.perf_counter()
+            started = False
+            try:
+                model = self._model(task, backend, cfg)
+                with stage("prompt_build"):
+                    prompt_value = prompt.invoke(inputs)
+                async for chunk in model.astream(prompt_value):
+                    started = True
+                    record_tokens(task, backend, getattr(chunk, "usage_metadata", None))
+                    yield chunk.content if hasattr(chunk, "content") else str(chunk)
+            except Exception as e:
+                stats.record(time.perf_counter() - start, ok=False)
+                if started:
+                    raise
+                logger.warning(f"LLM route {task} -> {backend} stream failed: {e}")
+                last_error = e
+                continue
+            stats.record(time.perf_counter() - start, ok=True)
+            return
+        raise last_error or RuntimeError(f"All backends failed for task '{task}'")
+
+    def report(self) -> Dict[str, Any]:
+        """Per-route latency and success stats"""
+        with self._lock:
+            tasks = {task: dict(backends) for task, backends in self.stats.items()}
+        return {
+            task: {
+                "backends": self.routes.get(task, {}).get("backends", []),
+                "stats": {backend: s.snapshot() for backend, s in backends.items()},
+            }
+            for task, backends in tasks.items()
+        }
+
+
+router = LLMRouter()
@@ -0,0 +1,123 @@
+import os
+import re
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# --- Local NER Backend ---
+# Hugging Face token-classification pipelines (formerly served by the Flask
+# server.py) run in a small dedicated thread pool so inference never blocks
+# the event loop. Models load once per process on first use, or before fork
+# when serve.py preloads them.
+
+NER_MODELS = [m.strip() for m in os.getenv("NER_MODELS", "dslim/bert-base-NER,d4data/biomedical-ner-all").split(",") if m.strip()]
+NER_MAX_CONCURRENCY = int(os.getenv("NER_MAX_CONCURRENCY", "2"))
+NER_MIN_SCORE = float(os.getenv("NER_MIN_SCORE", "0.4"))
+
+# Model labels -> MedicalEntity categories. Person/organisation/location tags
+# from the general-purpose model carry no clinical meaning and are dropped.
+LABEL_CATEGORIES = {
+    "Sign_symptom": "Symptom",
+    "Disease_disorder": "Condition",
+    "Medication": "Medication",
+    "Biological_structure": "Body Part",
+    "Duration": "Duration",
+    "Severity": "Severity",
+    "Dosage": "Dosage",
+    "Frequency": "Frequency",
+    "Diagnostic_procedure": "Procedure",
+    "Therapeutic_procedure": "Procedure",
+    "Lab_value": "Lab Value",
+    "History": "History",
+    "Family_history": "History",
+    "Date": "Duration",
+    "Time": "Duration",
+    "MISC": "Other",
+}
+DROPPED_LABELS = {"PER", "ORG", "LOC", "Personal_background", "Age", "Sex", "Occupation", "Detailed_description"}
+
+# --- Negation ---
+# Whether a mention is denied ("I don't have a fever"): a negation cue up to
+# three words before it in the same clause. Shared with the keyword triage.
+# "can't stop coughing" is not a denial, and "never" is left out: "never had
+# pain this bad" affirms the symptom.
+NEGATIONS = re.compile(
+    r"\b(no|not|without|denies|deny|denied|none|(?:do|does|did|have|has)n['’]?t|can['’]?t(?!\s+stop))\b"
+    r"(\W+\w+){0,3}\W*$",
+    re.IGNORECASE
+)
+CLAUSE_BREAK = re.compile(r"[.,;:!?]|\b(but|however|although|and now)\b", re.IGNORECASE)
+
+
+def negated(text: str, position: int) -> bool:
+    """Whether a negation word precedes `position` within the same clause"""
+    window = text[max(0, position - 40):position]
+    breaks = list(CLAUSE_BREAK.finditer(window))
+    if breaks:
+        window = window[breaks[-1].end():]
+    return bool(NEGATIONS.search(window))
+
+
+_pipelines: Optional[List[Callable[[str], List[Dict[str, Any]]]]] = None
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=NER_MAX_CONCURRENCY, thread_name_prefix="ner")
+
+
+def load_pipelines() -> List[Callable[[str], List[Dict[str, Any]]]]:
+    """Build (once) the configured NER pipelines; requires transformers + torch"""
+    global _pipelines
+    if _pipelines is None:
+        with _lock:
+            if _pipelines is None:
+                try:
+                    from transformers import pipeline
+                except ImportError as e:
+                    raise RuntimeError("Local NER backend needs the 'transformers' and 'torch' packages") from e
+                _pipelines = [pipeline("ner", model=model, aggregation_strategy="simple") for model in NER_MODELS]
+                logger.info(f"Loaded NER models: {', '.join(NER_MODELS)}")
+    return _pipelines
+
+
+def _to_entities(raw: List[Dict[str, Any]], text: str = "") -> List[Dict[str, Any]]:
+    """Pipeline output -> MedicalEntity dicts, keeping the best score per entity"""
+    best: Dict[tuple, Dict[str, Any]] = {}
+    for item in raw:
+        label = item.get("entity_group") or item.get("entity", "")
+        if label in DROPPED_LABELS:
+            continue
+        word = str(item.get("word", "")).replace(" ##", "").replace("##", "").strip()
+        score = float(item.get("score", 0.0))
+        if not word or score < NER_MIN_SCORE:
+            continue
+        category = LABEL_CATEGORIES.get(label, label.replace("_", " ").title())
+        key = (word.lower(), category)
+        if key not in best or score > best[key]["confidence"]:
+            best[key] = {"entity": word, "category": category, "confidence": round(score, 4),
+                         "negated": item.get("start") is not None and negated(text, item["start"])}
+    return list(best.values())
+
+
+def extract_entities_local(text: str) -> List[Dict[str, Any]]:
+    with stage("ner"):
+        raw = []
+        for ner in load_pipelines():
+            raw.extend(ner(text))
+        return _to_entities(raw, text)
+
+
+async def extract_entities_ner(text: str) -> Dict[str, Any]:
+    """Async local NER; same {"entities": [...]} shape as the LLM extraction"""
+    try:
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        entities = await loop.run_in_executor(_executor, context.run, extract_entities_local, text)
+        return {"entities": entities, "backend": "ner"}
+    except Exception as e:
+        logger.error(f"Error in extract_entities_ner: {e}")
+        return {"error": str(e)}
@@ -0,0 +1,147 @@
+import os
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+from tracing import span
+
+# --- Request Context ---
+# Carried through asyncio tasks and asyncio.to_thread automatically; thread
+# pools must submit via contextvars.copy_context().run to keep them.
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+endpoint_var = contextvars.ContextVar("endpoint", default="none")
+# LLM token usage of the current request ({"input_tokens", "output_tokens"}),
+# set by the quota middleware; the dict is shared with worker threads
+usage_var = contextvars.ContextVar("usage", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp every log record with the current request id"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+def configure_logging(level: int = logging.INFO):
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+    ))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+
+# --- Metrics ---
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+REQUEST_DURATION = Histogram(
+    "telemed_request_duration_seconds",
+    "End-to-end HTTP request latency",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+STAGE_DURATION = Histogram(
+    "telemed_stage_duration_seconds",
+    "Latency of individual processing stages (upload_read, pdf_extract, ocr_extract, "
+    "audio_preprocess, transcription, lab_parse, prompt_build, llm_call, json_parse, mongo_fetch, findings_lookup)",
+    ["endpoint", "stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+STAGE_ERRORS = Counter(
+    "telemed_stage_errors_total",
+    "Processing stages that raised",
+    ["endpoint", "stage"]
+)
+
+LLM_TOKENS = Counter(
+    "telemed_llm_tokens_total",
+    "LLM tokens consumed, by task, backend and direction (input/output)",
+    ["task", "backend", "direction"]
+)
+
+AUDIO_BYTES = Counter(
+    "telemed_audio_bytes_total",
+    "Consultation audio bytes received from clients and uploaded to Whisper",
+    ["direction", "action"]
+)
+
+CACHE_LOOKUPS = Counter(
+    "telemed_cache_lookups_total",
+    "Result cache lookups by stage (transcription, summary) and outcome (hit/miss)",
+    ["stage", "result"]
+)
+
+ADMISSION_DECISIONS = Counter(
+    "telemed_admission_total",
+    "Admission control outcomes by priority class (admitted, shed_queue_full, shed_deadline, expired)",
+    ["priority_class", "outcome"]
+)
+
+QUOTA_REJECTIONS = Counter(
+    "telemed_quota_rejections_total",
+    "Requests refused with 429 because a per-user sliding window was full",
+    ["endpoint", "metric"]
+)
+
+ADMISSION_WAIT = Histogram(
+    "telemed_admission_wait_seconds",
+    "Time admitted requests spent in the admission queue",
+    ["priority_class"],
+    buckets=LATENCY_BUCKETS
+)
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a processing stage of the current endpoint (and trace it when enabled)"""
+    endpoint = endpoint_var.get()
+    start = time.perf_counter()
+    with span(f"stage.{name}"):
+        try:
+            yield
+        except Exception:
+            STAGE_ERRORS.labels(endpoint, name).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            STAGE_DURATION.labels(endpoint, name).observe(elapsed)
+            logger.debug("stage %s took %.1fms", name, elapsed * 1000)
+
+
+def record_tokens(task: str, backend: str, usage: dict | None):
+    """Count tokens from a LangChain usage_metadata dict"""
+    if not usage:
+        return
+    LLM_TOKENS.labels(task, backend, "input").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(task, backend, "output").inc(usage.get("output_tokens", 0))
+    request_usage = usage_var.get()
+    if request_usage is not None:
+        for direction in ("input_tokens", "output_tokens"):
+            request_usage[direction] = request_usage.get(direction, 0) + usage.get(direction, 0)
+
+
+def render_metrics():
+    """
+    Prometheus exposition payload and content type. Under the multi-worker
+    launcher (PROMETHEUS_MULTIPROC_DIR set) every worker's samples are merged.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,258 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from chat_diagnosis import analyze_initial_problem
+from consulatation_handler import transcribe_audio
+from medical_ner import negated
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Total time the endpoint may spend before answering with the local result
+# alone. LLM enrichment that has not finished by then is dropped.
+LATENCY_BUDGET = float(os.getenv("PRE_DIAGNOSIS_LATENCY_BUDGET", "4.0"))
+
+# --- Local Triage Lexicon ---
+# Canonical name -> surface phrases. Compiled once at import.
+
+RED_FLAGS: Dict[str, Dict] = {
+    "chest pain": {
+        "level": "Emergency",
+        "phrases": ["chest pain", "chest tightness", "pressure in my chest", "crushing chest", "pain in my chest"],
+        "advice": "Chest pain can signal a heart attack. Call emergency services immediately."
+    },
+    "breathing difficulty": {
+        "level": "Emergency",
+        "phrases": ["difficulty breathing", "shortness of breath", "can't breathe", "can’t breathe", "cannot breathe",
+                    "not able to breathe", "unable to breathe", "trouble breathing", "breathless", "gasping"],
+        "advice": "Severe breathing difficulty needs emergency care right away."
+    },
+    "stroke signs": {
+        "level": "Emergency",
+        "phrases": ["face drooping", "facial droop", "slurred speech", "weakness on one side",
+                    "numbness on one side", "sudden confusion", "can't move my arm"],
+        "advice": "These may be signs of a stroke. Call emergency services immediately."
+    },
+    "loss of consciousness": {
+        "level": "Emergency",
+        "phrases": ["unconscious", "passed out", "fainted", "fainting", "blacked out", "unresponsive"],
+        "advice": "Loss of consciousness needs urgent medical evaluation."
+    },
+    "seizure": {
+        "level": "Emergency",
+        "phrases": ["seizure", "convulsion", "convulsing", "having a fit"],
+        "advice": "A seizure requires emergency medical attention."
+    },
+    "severe bleeding": {
+        "level": "Emergency",
+        "phrases": ["severe bleeding", "heavy bleeding", "won't stop bleeding", "bleeding heavily",
+                    "coughing blood", "coughing up blood", "vomiting blood", "blood in vomit"],
+        "advice": "Uncontrolled bleeding is an emergency. Apply pressure and seek help immediately."
+    },
+    "anaphylaxis": {
+        "level": "Emergency",
+        "phrases": ["throat swelling", "swollen throat", "swelling of lips", "swollen tongue",
+                    "anaphylaxis", "severe allergic reaction"],
+        "advice": "A severe allergic reaction can be life-threatening. Use an epinephrine pen if available and call emergency services."
+    },
+    "suicidal thoughts": {
+        "level": "Emergency",
+        "phrases": ["suicidal", "want to die", "kill myself", "end my life", "self harm", "self-harm"],
+        "advice": "Please reach out now to a crisis helpline or emergency services. You are not alone."
+    },
+    "thunderclap headache": {
+        "level": "Urgent",
+        "phrases": ["worst headache", "sudden severe headache", "thunderclap headache"],
+        "advice": "A sudden, severe headache should be assessed urgently."
+    },
+    "meningism": {
+        "level": "Urgent",
+        "phrases": ["stiff neck", "neck stiffness"],
+        "advice": "Stiff neck with fever can indicate meningitis. Seek urgent care."
+    },
+    "severe abdominal pain": {
+        "level": "Urgent",
+        "phrases": ["severe abdominal pain", "severe stomach pain", "unbearable stomach pain", "rigid abdomen"],
+        "advice": "Severe abdominal pain should be evaluated urgently."
+    },
+    "pregnancy bleeding": {
+        "level": "Urgent",
+        "phrases": ["bleeding during pregnancy", "pregnant and bleeding", "vaginal bleeding while pregnant"],
+        "advice": "Bleeding during pregnancy needs prompt medical review."
+    },
+}
+
+SYMPTOMS: Dict[str, List[str]] = {
+    "fever": ["fever", "high temperature", "feverish", "febrile"],
+    "chills": ["chills", "shivering"],
+    "cough": ["cough", "coughing"],
+    "sore throat": ["sore throat", "throat pain", "painful swallowing"],
+    "runny nose": ["runny nose", "blocked nose", "nasal congestion", "stuffy nose", "sneezing"],
+    "headache": ["headache", "head ache", "migraine", "head pain"],
+    "fatigue": ["fatigue", "tired", "tiredness", "exhausted", "weakness", "lethargy"],
+    "body ache": ["body ache", "body pain", "muscle pain", "myalgia", "aching"],
+    "joint pain": ["joint pain", "knee pain", "arthralgia"],
+    "back pain": ["back pain", "backache", "lower back"],
+    "abdominal pain": ["abdominal pain", "stomach pain", "stomach ache", "tummy ache", "belly pain", "cramps"],
+    "nausea": ["nausea", "nauseous", "queasy"],
+    "vomiting": ["vomiting", "vomit", "throwing up"],
+    "diarrhea": ["diarrhea", "diarrhoea", "loose motions", "loose stools"],
+    "constipation": ["constipation", "constipated"],
+    "dizziness": ["dizzy", "dizziness", "lightheaded", "vertigo"],
+    "rash": ["rash", "hives", "skin eruption", "red spots"],
+    "itching": ["itching", "itchy"],
+    "palpitations": ["palpitations", "heart racing", "racing heart", "pounding heart"],
+    "burning urination": ["burning urination", "burning while urinating", "painful urination", "dysuria"],
+    "frequent urination": ["frequent urination", "urinating often", "peeing a lot"],
+    "ear pain": ["ear pain", "earache"],
+    "eye redness": ["red eyes", "eye redness", "pink eye"],
+    "swelling": ["swelling", "swollen"],
+    "loss of appetite": ["loss of appetite", "not hungry", "no appetite"],
+    "insomnia": ["insomnia", "can't sleep", "trouble sleeping"],
+    "anxiety": ["anxiety", "anxious", "panic"],
+}
+
+SEVERITY_WORDS = {
+    "severe": ["severe", "unbearable", "excruciating", "intense", "worst", "extreme"],
+    "moderate": ["moderate", "persistent", "constant", "getting worse", "worsening"],
+}
+
+# Red flags are only dropped on an explicit denial directly before the phrase
+# ("no chest pain", "denies chest pain"); any looser negation keeps the flag.
+DENIALS = re.compile(r"\b(no|denies|denied|deny|without)\s+(any\s+)?$", re.IGNORECASE)
+
+URGENCY_ORDER = ["Routine", "Soon", "Urgent", "Emergency"]
+
+
+def _compile(table: Dict[str, List[str]]) -> List[tuple]:
+    compiled = []
+    for name, phrases in table.items():
+        pattern = "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+        compiled.append((name, re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE)))
+    return compiled
+
+
+_RED_FLAG_PATTERNS = _compile({name: cfg["phrases"] for name, cfg in RED_FLAGS.items()})
+_SYMPTOM_PATTERNS = _compile(SYMPTOMS)
+_SEVERITY_PATTERNS = _compile(SEVERITY_WORDS)
+
+
+def _denied(text: str, position: int) -> bool:
+    """Whether an explicit denial immediately precedes `position`"""
+    return bool(DENIALS.search(text[max(0, position - 20):position]))
+
+
+def _find(patterns: List[tuple], text: str, excluded=negated) -> List[Dict]:
+    """Matches not ruled out by `excluded` (negation by default), as {name, phrase}"""
+    found = []
+    for name, pattern in patterns:
+        for match in pattern.finditer(text):
+            if excluded(text, match.start()):
+                continue
+            found.append({"name": name, "phrase": match.group(0)})
+            break
+    return found
+
+
+def local_triage(text: str) -> Dict:
+    """
+    Millisecond keyword triage: symptoms and severity (with negation handling),
+    red flags (dropped only on an explicit denial such as "no chest pain") and
+    an urgency level.
+    """
+    start = time.perf_counter()
+    red_flags = [
+        {"flag": m["name"], "matched": m["phrase"], "level": RED_FLAGS[m["name"]]["level"],
+         "advice": RED_FLAGS[m["name"]]["advice"]}
+        for m in _find(_RED_FLAG_PATTERNS, text, excluded=_denied)
+    ]
+    symptoms = [m["name"] for m in _find(_SYMPTOM_PATTERNS, text)]
+    severity_hits = {m["name"] for m in _find(_SEVERITY_PATTERNS, text)}
+
+    if "severe" in severity_hits:
+        severity = "Severe"
+    elif "moderate" in severity_hits or len(symptoms) >= 4:
+        severity = "Moderate"
+    else:
+        severity = "Mild"
+
+    urgency = "Routine"
+    for flag in red_flags:
+        if URGENCY_ORDER.index(flag["level"]) > URGENCY_ORDER.index(urgency):
+            urgency = flag["level"]
+    if urgency == "Routine" and severity == "Severe":
+        urgency = "Soon"
+
+    if red_flags:
+        advice = " ".join(dict.fromkeys(flag["advice"] for flag in red_flags))
+    elif symptoms:
+        advice = "Your symptoms do not show emergency warning signs. Book a consultation if they persist or worsen."
+    else:
+        advice = "We couldn't identify specific symptoms. Please describe what you are feeling in more detail."
+
+    return {
+        "symptoms": symptoms,
+        "red_flags": red_flags,
+        "severity": severity,
+        "urgency": urgency,
+        "advice": advice,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 3)
+    }
+
+
+async def process_pre_diagnosis(
+    symptoms_text: Optional[str] = None,
+    audio_file=None,
+    enrich: bool = True,
+    latency_budget: float = LATENCY_BUDGET
+) -> dict:
+    """
+    Pre-diagnosis pipeline: transcribe audio (if given), run local triage,
+    then enrich with the LLM triage route within the remaining latency budget.
+    Emergencies are answered from the local pass without waiting on the LLM.
+    """
+    start = time.perf_counter()
+    transcription = None
+
+    if audio_file is not None:
+        transcription = await transcribe_audio(audio_file)
+        if not transcription and not symptoms_text:
+            return {"error": "Failed to transcribe audio"}
+
+    text = " ".join(t.strip() for t in [symptoms_text, transcription] if t and t.strip())
+    if not text:
+        return {"error": "No symptoms provided"}
+
+    with stage("local_triage"):
+        triage = local_triage(text)
+
+    enrichment = None
+    enrichment_status = "skipped"
+    remaining = latency_budget - (time.perf_counter() - start)
+
+    if enrich and triage["urgency"] != "Emergency" and remaining > 0:
+        try:
+            result = await asyncio.wait_for(analyze_initial_problem(text), timeout=remaining)
+            if "error" in result:
+                enrichment_status = "failed"
+            else:
+                enrichment, enrichment_status = result, "completed"
+        except asyncio.TimeoutError:
+            enrichment_status = "timed_out"
+            logger.info(f"Pre-diagnosis enrichment exceeded {latency_budget}s budget, answering from local triage")
+    elif enrich and triage["urgency"] != "Emergency":
+        enrichment_status = "timed_out"
+
+    return {
+        "success": True,
+        "symptoms_text": symptoms_text,
+        "transcription": transcription,
+        "triage": triage,
+        "enrichment": enrichment,
+        "enrichment_status": enrichment_status,
+        "source": "local+llm" if enrichment else "local",
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1)
+    }
@@ -0,0 +1,248 @@
+import os
+import json
+import logging
+from datetime import datetime, date
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Compact Patient Context ---
+# Renders patient records for prompts as short "key=value" lines instead of
+# Python reprs: empty values and placeholders are dropped, keys abbreviated
+# consistently, list items formatted by template and repeated facts emitted
+# once. Which fields each endpoint sees is configured in CONTEXT_FIELDS.
+
+KEY_ABBREVIATIONS = {
+    "basicHealthProfile": "profile",
+    "medicalHistory": "history",
+    "currentHealthStatus": "status",
+    "telemedicinePreferences": "prefs",
+    "patientName": "name",
+    "gender": "sex",
+    "dateOfBirth": "age",
+    "bloodGroup": "blood",
+    "height": "ht",
+    "weight": "wt",
+    "chronicDiseases": "chronic",
+    "previousSurgeries": "surgeries",
+    "hospitalizations": "admissions",
+    "familyMedicalHistory": "family",
+    "currentMedications": "meds",
+    "ongoingTreatments": "treatments",
+    "smokingStatus": "smoking",
+    "smokingDetails": "smoking_detail",
+    "alcoholConsumption": "alcohol",
+    "alcoholDetails": "alcohol_detail",
+    "exerciseFrequency": "exercise",
+    "exerciseType": "exercise_type",
+    "dietType": "diet",
+    "sleepHours": "sleep",
+    "languagePreference": "lang",
+    "emergencyContacts": "emergency",
+    "cigarettesPerDay": "per_day",
+    "yearsSmoked": "years",
+    "drinksPerWeek": "per_week",
+}
+
+# Primary field first; the rest go in parentheses
+ITEM_FORMATS = {
+    "chronicDiseases": ("name", ["diagnosedYear", "notes"]),
+    "previousSurgeries": ("name", ["year", "notes"]),
+    "hospitalizations": ("reason", ["year", "duration", "hospital"]),
+    "familyMedicalHistory": ("relation", ["condition", "notes"]),
+    "currentMedications": ("name", ["dosage", "frequency"]),
+    "allergies": ("allergen", ["severity", "reaction"]),
+    "ongoingTreatments": ("condition", ["treatmentType", "provider"]),
+    "specialistPreferences": ("specialty", []),
+    "primary": ("name", ["relationship", "phone"]),
+    "secondary": ("name", ["relationship", "phone"]),
+}
+
+DROP_KEYS = {
+    "_id", "__v", "id", "userId", "createdAt", "updatedAt", "onboardingProgress",
+    "notificationPreferences", "preferredConsultationTime", "preferredConsultationType",
+    "startDate", "prescribedBy", "email", "address", "alternatePhone",
+}
+
+PLACEHOLDERS = {"", "n/a", "na", "unknown", "not specified", "null", "undefined"}
+
+# Dotted path prefixes each endpoint receives (None = every non-empty field).
+CONTEXT_FIELDS: Dict[str, Optional[List[str]]] = {
+    "next_question": [
+        "patientName", "name", "age", "gender", "basicHealthProfile.gender", "basicHealthProfile.dateOfBirth",
+        "medicalHistory.chronicDiseases", "currentHealthStatus.currentMedications",
+        "currentHealthStatus.allergies", "currentHealthStatus.smokingStatus",
+        "currentHealthStatus.alcoholConsumption",
+    ],
+    "final_summary": [
+        "patientName", "name", "age", "gender", "basicHealthProfile", "medicalHistory",
+        "currentHealthStatus.currentMedications", "currentHealthStatus.allergies",
+        "currentHealthStatus.ongoingTreatments", "currentHealthStatus.smokingStatus",
+        "currentHealthStatus.alcoholConsumption",
+    ],
+    "prescription": [
+        "basicHealthProfile.dateOfBirth", "basicHealthProfile.weight", "basicHealthProfile.gender",
+        "medicalHistory.chronicDiseases", "currentHealthStatus.currentMedications", "currentHealthStatus.allergies",
+        "currentHealthStatus.smokingStatus", "currentHealthStatus.alcoholConsumption",
+    ],
+    "agent_chat": [
+        "patientName", "basicHealthProfile", "medicalHistory", "currentHealthStatus",
+        "telemedicinePreferences.languagePreference", "telemedicinePreferences.emergencyContacts",
+    ],
+}
+
+
+
+def load_context_fields() -> Dict[str, Optional[List[str]]]:
+    """CONTEXT_FIELDS merged with PROMPT_CONTEXT_FIELDS (JSON), e.g. '{"prescription": null}'"""
+    fields = dict(CONTEXT_FIELDS)
+    raw = os.getenv("PROMPT_CONTEXT_FIELDS")
+    try:
+        if raw:
+            fields.update(json.loads(raw))
+    except Exception as e:
+        logger.error(f"Error loading PROMPT_CONTEXT_FIELDS, using defaults: {e}")
+        return dict(CONTEXT_FIELDS)
+    return fields
+
+
+CONTEXT_FIELDS = load_context_fields()
+
+
+def _is_empty(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return value.strip().lower() in PLACEHOLDERS
+    if isinstance(value, (list, dict)):
+        return all(_is_empty(v) for v in (value.values() if isinstance(value, dict) else value))
+    return False
+
+
+def _age(value: Any) -> Optional[str]:
+    try:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if isinstance(value, datetime):
+            value = value.date()
+        today = date.today()
+        return str(today.year - value.year - ((today.month, today.day) < (value.month, value.day)))
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+def _scalar(value: Any) -> Optional[str]:
+    if _is_empty(value):
+        return None
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, float):
+        return f"{value:g}"
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, str) and len(value) >= 20 and value[4:5] == "-" and "T" in value:
+        return value[:10]  # ISO timestamp -> date
+    return str(value).strip()
+
+
+def _render(key: str, value: Any) -> Optional[str]:
+    """Render one field's value compactly, or None if it carries no information"""
+    if _is_empty(value):
+        return None
+    if key == "dateOfBirth":
+        return _age(value)
+    if isinstance(value, dict):
+        if "value" in value:
+            rendered = _scalar(value.get("value"))
+            return f"{rendered}{value.get('unit') or ''}" if rendered else None
+        if key == "sleepHours":
+            parts = [f"{value['average']:g}h" if isinstance(value.get("average"), (int, float)) else None,
+                     _scalar(value.get("quality"))]
+            return " ".join(p for p in parts if p) or None
+        parts = []
+        for k, v in value.items():
+            if k in DROP_KEYS:
+                continue
+            rendered = _render_item(k, v) if isinstance(v, dict) and k in ITEM_FORMATS else _render(k, v)
+            if rendered:
+                parts.append(f"{KEY_ABBREVIATIONS.get(k, k)} {rendered}" if isinstance(v, (str, int, float)) else rendered)
+        return ", ".join(parts) or None
+    if isinstance(value, list):
+        items = [_render_item(key, item) for item in value]
+        items = list(dict.fromkeys(i for i in items if i))
+        return ", ".join(items) or None
+    return _scalar(value)
+
+
+def _render_item(key: str, item: Any) -> Optional[str]:
+    if not isinstance(item, dict):
+        return _scalar(item)
+    primary, extras = ITEM_FORMATS.get(key, (None, []))
+    if primary is None:
+        values = [_scalar(v) for k, v in item.items() if k not in DROP_KEYS]
+        return " ".join(v for v in values if v) or None
+    head = _scalar(item.get(primary))
+    details = [d for d in (_scalar(item.get(k)) for k in extras) if d]
+    if not head:
+        return "; ".join(details) or None
+    return f"{head} ({'; '.join(details)})" if details else head
+
+
+def _selected(path: str, fields: Optional[Iterable[str]]) -> bool:
+    if fields is None:
+        return True
+    return any(path == f or path.startswith(f + ".") or f.startswith(path + ".") for f in fields)
+
+
+def compact_context(record: Dict[str, Any], endpoint: Optional[str] = None) -> str:
+    """
+    Compact multi-line rendering of `record` for a prompt. Top-level sections
+    become one line each; scalar top-level fields share the first line.
+    """
+    if not record:
+        return "none provided"
+    fields = CONTEXT_FIELDS.get(endpoint) if endpoint else None
+    seen = set()
+    header: List[str] = []
+    lines: List[str] = []
+
+    def emit(parts: List[str], key: str, value: Any):
+        rendered = _render(key, value)
+        if not rendered:
+            return
+        fact = (KEY_ABBREVIATIONS.get(key, key), rendered.lower())
+        if fact in seen:
+            return
+        seen.add(fact)
+        parts.append(f"{KEY_ABBREVIATIONS.get(key, key)}={rendered}")
+
+    for key, value in record.items():
+        if key in DROP_KEYS or not _selected(key, fields):
+            continue
+        if isinstance(value, dict) and "value" not in value and key not in ("sleepHours",):
+            parts: List[str] = []
+            for sub_key, sub_value in value.items():
+                if sub_key in DROP_KEYS or not _selected(f"{key}.{sub_key}", fields):
+                    continue
+                emit(parts, sub_key, sub_value)
+            if parts:
+                lines.append(f"{KEY_ABBREVIATIONS.get(key, key)}: " + "; ".join(parts))
+        else:
+            emit(header, key, value)
+
+    if header:
+        lines.insert(0, "; ".join(header))
+    return "\n".join(lines) or "none provided"
+
+
+def compact_history(history: List[Dict[str, Any]]) -> str:
+    """Conversation turns as "role: text" lines, whitespace collapsed and repeated turns dropped"""
+    lines: List[str] = []
+    for msg in history:
+        content = " ".join(str(msg.get("content") or "").split())
+        if not content:
+            continue
+        line = f"{msg.get('role', 'user')}: {content}"
+        if not lines or lines[-1] != line:
+            lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,596 @@
+import os
+import json
+import math
+import time
+import zlib
+import asyncio
+import contextvars
+import sqlite3
+import logging
+import threading
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi.responses import JSONResponse
+from metrics import endpoint_var, usage_var, QUOTA_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+# --- Quota Rules ---
+# Per-user sliding-window limits on requests and LLM tokens, per endpoint and
+# across all endpoints ("*"). Each window is a ring of QUOTA_BUCKETS counters,
+# so memory per (user, scope, metric, window) is fixed no matter the traffic.
+# A request is refused once a window is already at its limit; tokens are only
+# known afterwards, so endpoints with large generations reserve an estimate up
+# front and settle the difference when the response completes.
+
+QUOTA_STORE = os.getenv("QUOTA_STORE", "sqlite:quota.db")
+QUOTA_BUCKETS = int(os.getenv("QUOTA_BUCKETS", "60"))
+QUOTA_USER_HEADER = "x-user-id"
+# Peers allowed to set QUOTA_USER_HEADER (comma-separated addresses of the
+# gateway/proxy, "*" for any client). A body "userId" always wins.
+QUOTA_TRUSTED_PROXIES = {p.strip() for p in os.getenv("QUOTA_TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if p.strip()}
+# Requests without a user id (multipart uploads carry none unless the gateway
+# sets the header): "ip" (metered per client address) or "reject" (401)
+QUOTA_ANONYMOUS = os.getenv("QUOTA_ANONYMOUS", "ip")
+QUOTA_MAX_BODY = 64 * 1024  # larger JSON bodies are not inspected for a userId
+# Bearer token that may read any user's usage; otherwise only the user named
+# by a trusted QUOTA_USER_HEADER may read their own
+QUOTA_ADMIN_TOKEN = os.getenv("QUOTA_ADMIN_TOKEN")
+
+# scope -> {"requests"|"tokens": {window seconds: limit}, "reserve_tokens": n}
+DEFAULT_LIMITS: Dict[str, Dict[str, Any]] = {
+    "*": {
+        "requests": {"60": 120, "86400": 5000},
+        "tokens": {"86400": 2_000_000},
+    },
+    "/api/v1/agent/chat": {
+        "requests": {"60": 20, "86400": 1000},
+        "tokens": {"3600": 150_000, "86400": 600_000},
+        "reserve_tokens": 2000,
+    },
+    "/api/v1/consultation/process": {
+        "requests": {"3600": 30},
+        "reserve_tokens": 3000,
+    },
+    "/ai/report-analyze/batch": {
+        "requests": {"3600": 20},
+        "reserve_tokens": 4000,
+    },
+}
+
+# Variants of an endpoint that count against its limits rather than their own
+SHARED_SCOPES = {
+    "/api/v1/consultation/process/stream": "/api/v1/consultation/process",
+}
+
+# Metered route templates; anything else (health, metrics, job polling) is free
+QUOTA_ENDPOINTS = {
+    "/api/v1/agent/chat",
+    "/api/v1/pre-diagnosis",
+    "/api/v1/consultation/process", "/api/v1/consultation/process/stream",
+    "/ai/report-analyze",
+    "/ai/report-analyze/batch",
+    "/api/v1/interview/initial-problem", "/initial-problem",
+    "/api/v1/interview/next-question", "/next-question",
+    "/api/v1/interview/next-question/stream", "/next-question/stream",
+    "/api/v1/interview/extract-entities", "/extract-entities",
+    "/api/v1/interview/final-summary", "/final-summary",
+}
+
+
+def load_limits() -> Dict[str, Dict[str, Any]]:
+    """DEFAULT_LIMITS merged with QUOTA_LIMITS (JSON), e.g. '{"/api/v1/agent/chat": {"tokens": {"3600": 50000}}}'"""
+    limits = {scope: dict(rule) for scope, rule in DEFAULT_LIMITS.items()}
+    raw = os.getenv("QUOTA_LIMITS")
+    try:
+        if raw:
+            for scope, rule in json.loads(raw).items():
+                limits.setdefault(scope, {}).update(rule)
+    except Exception as e:
+        logger.error(f"Error loading QUOTA_LIMITS, using defaults: {e}")
+    return limits
+
+
+# Counter key: "<scope>|<metric>|<window seconds>"
+Check = Tuple[str, int, int, int]  # (key, window, limit, cost)
+
+
+def _key(scope: str, metric: str, window: int) -> str:
+    return f"{scope}|{metric}|{window}"
+
+
+def _headers(scope) -> Dict[str, str]:
+    return {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+
+
+def _trusted_peer(scope) -> bool:
+    client = scope["client"][0] if scope.get("client") else None
+    return "*" in QUOTA_TRUSTED_PROXIES or client in QUOTA_TRUSTED_PROXIES
+
+
+def may_read_usage(scope, user: str) -> bool:
+    """Whether the caller may read `user`'s usage: the admin token, or that user via a trusted header"""
+    headers = _headers(scope)
+    if QUOTA_ADMIN_TOKEN and headers.get("authorization") == f"Bearer {QUOTA_ADMIN_TOKEN}":
+        return True
+    return _trusted_peer(scope) and headers.get(QUOTA_USER_HEADER) == user
+
+
+# The current request's charge (user, endpoint, reserved tokens). Work handed
+# to a background job takes it over with QuotaManager.defer() and settles when
+# the job finishes, since the job's tokens are spent after the response.
+charge_var = contextvars.ContextVar("quota_charge", default=None)
+
+
+class QuotaExceeded(Exception):
+    """A sliding window is at its limit; nothing was charged"""
+
+    def __init__(self, key: str, limit: int, retry_after: float):
+        scope, metric, window = key.rsplit("|", 2)
+        super().__init__(f"{metric} quota for {scope} exceeded ({limit} per {window}s)")
+        self.scope = scope
+        self.metric = metric
+        self.window = int(window)
+        self.limit = limit
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+# --- Ring Counters ---
+
+class RingCounter:
+    """
+    Sliding-window counter: `buckets` slots of window/buckets seconds each,
+    tagged with the bucket index they hold so stale slots read as zero.
+    """
+
+    __slots__ = ("width", "counts", "epochs")
+
+    def __init__(self, window: int, buckets: int = QUOTA_BUCKETS):
+        self.width = window / buckets
+        self.counts = array("q", [0]) * buckets
+        self.epochs = array("q", [-1]) * buckets
+
+    def add(self, now: float, amount: int):
+        idx = int(now // self.width)
+        slot = idx % len(self.counts)
+        if self.epochs[slot] != idx:
+            self.epochs[slot] = idx
+            self.counts[slot] = 0
+        self.counts[slot] += amount
+
+    def live(self, now: float) -> List[Tuple[int, int]]:
+        """(bucket index, count) of the slots still inside the window, oldest first"""
+        oldest = int(now // self.width) - len(self.counts)
+        return sorted((e, c) for e, c in zip(self.epochs, self.counts) if e > oldest)
+
+    def total(self, now: float) -> int:
+        return sum(c for _, c in self.live(now))
+
+    def idle(self, now: float) -> bool:
+        return max(self.epochs) <= int(now // self.width) - len(self.counts)
+
+
+def _retry_after(live: List[Tuple[int, int]], width: float, buckets: int, limit: int, now: float) -> float:
+    """Seconds until enough old buckets expire for the total to drop below limit"""
+    excess = sum(c for _, c in live) - limit + 1
+    for epoch, count in live:
+        excess -= count
+        if excess <= 0:
+            return (epoch + buckets) * width - now
+    return width * buckets
+
+
+# --- Stores ---
+# consume() checks every window and charges only if all have room; add()
+# settles costs afterwards; snapshot() reports a user's windows and totals.
+# All keys of one user live in one store, so a shard can decide alone.
+
+class MemoryQuotaStore:
+    """Process-local rings; each worker keeps its own counts"""
+
+    PRUNE_EVERY = 4096
+
+    def __init__(self, buckets: int = QUOTA_BUCKETS):
+        self.buckets = buckets
+        self._rings: Dict[str, Dict[str, RingCounter]] = {}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._ops = 0
+
+    def _ring(self, user: str, key: str) -> RingCounter:
+        rings = self._rings.setdefault(user, {})
+        ring = rings.get(key)
+        if ring is None:
+            ring = rings[key] = RingCounter(int(key.rsplit("|", 1)[1]), self.buckets)
+        return ring
+
+    def _prune(self, now: float):
+        """Drop users whose windows have all expired (billing totals are kept)"""
+        for user in [u for u, rings in self._rings.items() if all(r.idle(now) for r in rings.values())]:
+            del self._rings[user]
+
+    async def consume(self, user: str, checks: List[Check], now: float):
+        self._ops += 1
+        if self._ops % self.PRUNE_EVERY == 0:
+            self._prune(now)
+        for key, window, limit, _ in checks:
+            ring = self._ring(user, key)
+            live = ring.live(now)
+            if sum(c for _, c in live) >= limit:
+                raise QuotaExceeded(key, limit, _retry_after(live, ring.width, self.buckets, limit, now))
+        for key, _, _, cost in checks:
+            if cost:
+                self._ring(user, key).add(now, cost)
+
+    async def add(self, user: str, costs: Dict[str, int], totals: Dict[str, int], now: float):
+        for key, cost in costs.items():
+            if cost:
+                self._ring(user, key).add(now, cost)
+        user_totals = self._totals.setdefault(user, {})
+        for key, amount in totals.items():
+            user_totals[key] = user_totals.get(key, 0) + amount
+
+    async def snapshot(self, user: str, now: float) -> Tuple[Dict[str, int], Dict[str, int]]:
+        rings = self._rings.get(user, {})
+        return {key: ring.total(now) for key, ring in rings.items()}, dict(self._totals.get(user, {}))
+
+
+class SQLiteQuotaStore:
+    """
+    Rings stored one row per slot, shared by every worker on the host (WAL
+    mode). Check-and-charge runs in a single IMMEDIATE transaction.
+    """
+
+    def __init__(self, path: str = "quota.db", buckets: int = QUOTA_BUCKETS):
+        self.buckets = buckets
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS quota_slots (
+                    user TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    slot INTEGER NOT NULL,
+                    epoch INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (user, key, slot)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS quota_totals (
+                    user TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    PRIMARY KEY (user, key)
+                )
+            """)
+
+    def _width(self, key: str) -> float:
+        return int(key.rsplit("|", 1)[1]) / self.buckets
+
+    def _live(self, user: str, key: str, now: float) -> List[Tuple[int, int]]:
+        oldest = int(now // self._width(key)) - self.buckets
+        return self._conn.execute(
+            "SELECT epoch, count FROM quota_slots WHERE user = ? AND key = ? AND epoch > ? ORDER BY epoch",
+            (user, key, oldest)
+        ).fetchall()
+
+    def _add(self, user: str, key: str, cost: int, now: float):
+        idx = int(now // self._width(key))
+        self._conn.execute("""
+            INSERT INTO quota_slots (user, key, slot, epoch, count) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user, key, slot) DO UPDATE SET
+                count = CASE WHEN epoch = excluded.epoch THEN count + excluded.count ELSE excluded.count END,
+                epoch = excluded.epoch
+        """, (user, key, idx % self.buckets, idx, cost))
+
+    def _consume(self, user: str, checks: List[Check], now: float):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key, window, limit, _ in checks:
+                    live = self._live(user, key, now)
+                    if sum(c for _, c in live) >= limit:
+                        raise QuotaExceeded(key, limit, _retry_after(live, self._width(key), self.buckets, limit, now))
+                for key, _, _, cost in checks:
+                    if cost:
+                        self._add(user, key, cost, now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _settle(self, user: str, costs: Dict[str, int], totals: Dict[str, int], now: float):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key, cost in costs.items():
+                    if cost:
+                        self._add(user, key, cost, now)
+                for key, amount in totals.items():
+                    self._conn.execute("""
+                        INSERT INTO quota_totals (user, key, amount) VALUES (?, ?, ?)
+                        ON CONFLICT (user, key) DO UPDATE SET amount = amount + excluded.amount
+                    """, (user, key, amount))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _snapshot(self, user: str, now: float) -> Tuple[Dict[str, int], Dict[str, int]]:
+        with self._lock:
+            keys = [k for (k,) in self._conn.execute("SELECT DISTINCT key FROM quota_slots WHERE user = ?", (user,))]
+            windows = {key: sum(c for _, c in self._live(user, key, now)) for key in keys}
+            totals = dict(self._conn.execute("SELECT key, amount FROM quota_totals WHERE user = ?", (user,)).fetchall())
+        return windows, totals
+
+    async def consume(self, user: str, checks: List[Check], now: float):
+        await asyncio.to_thread(self._consume, user, checks, now)
+
+    async def add(self, user: str, costs: Dict[str, int], totals: Dict[str, int], now: float):
+        await asyncio.to_thread(self._settle, user, costs, totals, now)
+
+    async def snapshot(self, user: str, now: float) -> Tuple[Dict[str, int], Dict[str, int]]:
+        return await asyncio.to_thread(self._snapshot, user, now)
+
+
+class ShardedQuotaStore:
+    """Routes each user to one of several stores by a stable hash of the user id"""
+
+    def __init__(self, shards: List[Any]):
+        self.shards = shards
+
+    def _shard(self, user: str):
+        return self.shards[zlib.crc32(user.encode("utf-8")) % len(self.shards)]
+
+    async def consume(self, user: str, checks: List[Check], now: float):
+        await self._shard(user).consume(user, checks, now)
+
+    async def add(self, user: str, costs: Dict[str, int], totals: Dict[str, int], now: float):
+        await self._shard(user).add(user, costs, totals, now)
+
+    async def snapshot(self, user: str, now: float):
+        return await self._shard(user).snapshot(user, now)
+
+
+def create_store(spec: Optional[str] = None):
+    """
+    Build a store from QUOTA_STORE: 'off', 'memory', 'sqlite:<path>', or a
+    comma-separated list of those to shard users across.
+    """
+    spec = spec or QUOTA_STORE
+    if spec == "off":
+        return None
+    parts = [part.strip() for part in spec.split(",") if part.strip()]
+    if len(parts) > 1:
+        return ShardedQuotaStore([create_store(part) for part in parts])
+    if spec == "memory":
+        return MemoryQuotaStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteQuotaStore(spec[len("sqlite:"):] or "quota.db")
+    raise ValueError(f"Unknown QUOTA_STORE '{spec}'")
+
+
+# --- Quota Manager ---
+
+class QuotaManager:
+    """Sliding-window checks before a request runs and token settlement after it"""
+
+    def __init__(self, store=None, limits: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.store = store
+        self._configured = store is not None
+        self.limits = limits or load_limits()
+        self.since = time.time()
+
+    def configure(self, spec: Optional[str] = None):
+        """(Re)build the store from a QUOTA_STORE spec; 'off' disables quotas"""
+        self.store = create_store(spec)
+        self._configured = True
+
+    def _store(self):
+        # Opened lazily so a preloading parent never shares a connection with its workers
+        if not self._configured:
+            self.configure()
+        return self.store
+
+    @property
+    def enabled(self) -> bool:
+        return self._store() is not None
+
+    def _scopes(self, endpoint: str) -> List[str]:
+        return [scope for scope in ("*", SHARED_SCOPES.get(endpoint, endpoint)) if scope in self.limits]
+
+    def _windows(self, scope: str, metric: str) -> List[Tuple[int, int]]:
+        return [(int(window), int(limit)) for window, limit in self.limits[scope].get(metric, {}).items()]
+
+    def reserve(self, endpoint: str) -> int:
+        return int(self.limits.get(SHARED_SCOPES.get(endpoint, endpoint), {}).get("reserve_tokens", 0))
+
+    async def admit(self, user: str, endpoint: str) -> int:
+        """
+        Charge one request (and the endpoint's token reservation) to every
+        window, or raise QuotaExceeded without charging anything.
+        Returns the reserved token count.
+        """
+        reserve = self.reserve(endpoint)
+        checks: List[Check] = []
+        for scope in self._scopes(endpoint):
+            checks += [(_key(scope, "requests", w), w, limit, 1) for w, limit in self._windows(scope, "requests")]
+            checks += [(_key(scope, "tokens", w), w, limit, reserve) for w, limit in self._windows(scope, "tokens")]
+        if checks:
+            await self.store.consume(user, checks, time.time())
+        return reserve
+
+    async def settle(self, user: str, endpoint: str, usage: Dict[str, int], reserved: int):
+        """Replace the reservation with the tokens actually used and add to billing totals"""
+        used = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+        costs = {
+            _key(scope, "tokens", w): used - reserved
+            for scope in self._scopes(endpoint) for w, _ in self._windows(scope, "tokens")
+        }
+        totals = {
+            f"{endpoint}|requests": 1,
+            f"{endpoint}|input_tokens": usage.get("input_tokens", 0),
+            f"{endpoint}|output_tokens": usage.get("output_tokens", 0),
+        }
+        try:
+            await self.store.add(user, costs, totals, time.time())
+        except Exception as e:
+            logger.warning(f"Quota settlement failed for {user}: {e}")
+
+    def current_charge(self) -> Optional[Dict[str, Any]]:
+        """The current request's (user, endpoint, reserved) charge, or None when it is not metered"""
+        charge = charge_var.get()
+        if charge is None:
+            return None
+        return {"user": charge["user"], "endpoint": charge["endpoint"], "reserved": charge["reserved"]}
+
+    def defer(self):
+        """Leave the current request's settlement to background work, which calls settle_charge()"""
+        charge = charge_var.get()
+        if charge is not None:
+            charge["deferred"] = True
+
+    async def settle_charge(self, charge: Dict[str, Any], usage: Dict[str, int]):
+        await self.settle(charge["user"], charge["endpoint"], usage, charge["reserved"])
+
+    async def usage(self, user: str) -> Dict[str, Any]:
+        """Current window usage against limits, plus cumulative per-endpoint totals for billing"""
+        if not self.enabled:
+            return {"enabled": False}
+        current, totals = await self.store.snapshot(user, time.time())
+        windows = []
+        for scope, rule in self.limits.items():
+            for metric in ("requests", "tokens"):
+                for window, limit in self._windows(scope, metric):
+                    used = max(0, current.get(_key(scope, metric, window), 0))
+                    windows.append({
+                        "scope": scope, "metric": metric, "window_s": window,
+                        "used": used, "limit": limit, "remaining": max(0, limit - used)
+                    })
+        endpoints: Dict[str, Dict[str, int]] = {}
+        for key, amount in totals.items():
+            endpoint, field = key.rsplit("|", 1)
+            endpoints.setdefault(endpoint, {"requests": 0, "input_tokens": 0, "output_tokens": 0})[field] = amount
+        return {
+            "userId": user,
+            "windows": windows,
+            "totals": {
+                "since": self.since,
+                "requests": sum(e["requests"] for e in endpoints.values()),
+                "input_tokens": sum(e["input_tokens"] for e in endpoints.values()),
+                "output_tokens": sum(e["output_tokens"] for e in endpoints.values()),
+                "endpoints": endpoints,
+            },
+        }
+
+
+quota = QuotaManager()
+
+
+# --- Middleware ---
+
+class QuotaMiddleware:
+    """
+    ASGI middleware: identifies the user from a top-level "userId" in a JSON
+    body (the id the endpoint itself serves), else from the X-User-ID header
+    when the peer is trusted, else by client address (QUOTA_ANONYMOUS),
+    refuses over-quota requests with 429 before the endpoint runs (no Mongo
+    or LLM work), and settles the tokens the request consumed once the
+    response has been sent, unless a background job took the charge over.
+    Must sit inside the request-context middleware, which sets endpoint_var.
+    """
+
+    def __init__(self, app, manager: QuotaManager = quota):
+        self.app = app
+        self.manager = manager
+
+    async def _identify(self, scope, receive) -> Tuple[Optional[str], Any]:
+        """Returns (user id, receive); the body is replayed if it had to be read"""
+        headers = _headers(scope)
+        client = scope["client"][0] if scope.get("client") else None
+        # The header is only a fallback: a client naming itself in the body and
+        # sending a random header must still be charged for the body's userId
+        trusted_header = _trusted_peer(scope)
+
+        user = None
+        inspect = headers.get("content-type", "").startswith("application/json")
+        if inspect and int(headers.get("content-length") or 0) > QUOTA_MAX_BODY:
+            # Not inspected, so it may carry a userId the header must not stand in for
+            inspect = trusted_header = False
+        if inspect:
+            chunks, more = [], True
+            while more:
+                message = await receive()
+                if message["type"] != "http.request":
+                    break
+                chunks.append(message.get("body", b""))
+                more = message.get("more_body", False)
+            body = b"".join(chunks)
+            try:
+                payload = json.loads(body) if body else None
+                if isinstance(payload, dict) and payload.get("userId"):
+                    user = str(payload["userId"])
+            except ValueError:
+                pass
+
+            replayed = False
+
+            async def replay():
+                nonlocal replayed
+                if not replayed:
+                    replayed = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                return await receive()
+
+            receive = replay
+
+        if user is None and trusted_header and headers.get(QUOTA_USER_HEADER):
+            user = headers[QUOTA_USER_HEADER]
+        if user is None and QUOTA_ANONYMOUS == "ip":
+            user = f"ip:{client or 'unknown'}"
+        return user, receive
+
+    async def __call__(self, scope, receive, send):
+        endpoint = endpoint_var.get() if scope["type"] == "http" else None
+        if endpoint not in QUOTA_ENDPOINTS or not self.manager.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        user, receive = await self._identify(scope, receive)
+        if user is None:
+            # QUOTA_ANONYMOUS=reject
+            response = JSONResponse(status_code=401, content={"error": "User identity required"})
+            await response(scope, receive, send)
+            return
+
+        try:
+            reserved = await self.manager.admit(user, endpoint)
+        except QuotaExceeded as e:
+            QUOTA_REJECTIONS.labels(endpoint, e.metric).inc()
+            logger.warning(f"Quota exceeded for {user} on {endpoint}: {e}")
+            response = JSONResponse(
+                status_code=429,
+                content={"error": "Quota exceeded", "scope": e.scope, "metric": e.metric,
+                         "window_s": e.window, "limit": e.limit},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        except Exception as e:
+            # A broken quota store must not take the API down with it
+            logger.error(f"Quota check failed, allowing request: {e}")
+            await self.app(scope, receive, send)
+            return
+
+        usage: Dict[str, int] = {}
+        charge = {"user": user, "endpoint": endpoint, "reserved": reserved, "deferred": False}
+        token = usage_var.set(usage)
+        charge_token = charge_var.set(charge)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            usage_var.reset(token)
+            charge_var.reset(charge_token)
+            if not charge["deferred"]:
+                await self.manager.settle(user, endpoint, usage, reserved)
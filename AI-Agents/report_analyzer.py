@@ -1,13 +1,37 @@
 import os
-from langchain_groq import ChatGroq
+import asyncio
+import logging
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
-from typing import List
-import PyPDF2
-from PIL import Image
-import pytesseract
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+from typing import List, Dict, Optional
+from llm_router import router
+from json_stream import RobustJsonOutputParser
+from lab_parser import parse_lab_report
+from metrics import stage
+# PDF and OCR libraries are imported on first extraction
+TESSERACT_CMD = os.getenv("TESSERACT_CMD", r'C:\Program Files\Tesseract-OCR\tesseract.exe')
+
+# Input budget for one batched analysis call (~4 chars per token), leaving
+# headroom in the context window for instructions and the JSON response.
+BATCH_INPUT_TOKEN_BUDGET = int(os.getenv("REPORT_BATCH_TOKEN_BUDGET", "24000"))
+CHARS_PER_TOKEN = 4
+
+# The response grows with the batch too: every result row becomes a JSON
+# finding, several times longer than the row itself. Batches are also kept
+# within an output budget (headroom under the backends' 8192-token output
+# limit) estimated per report from its result rows, and capped in size.
+BATCH_OUTPUT_TOKEN_BUDGET = int(os.getenv("REPORT_BATCH_OUTPUT_BUDGET", "6000"))
+BATCH_MAX_REPORTS = int(os.getenv("REPORT_BATCH_MAX_REPORTS", "8"))
+OUTPUT_TOKENS_PER_REPORT = 300   # report type, summary, recommendations
+OUTPUT_TOKENS_PER_FINDING = 40
+
+# Tabular lab results are parsed and classified locally; the LLM only writes
+# the narrative. Reports yielding fewer findings than this (imaging, free-text
+# notes) go through full LLM analysis.
+REPORT_LOCAL_PARSER = os.getenv("REPORT_LOCAL_PARSER", "1") == "1"
+REPORT_PARSER_MIN_FINDINGS = int(os.getenv("REPORT_PARSER_MIN_FINDINGS", "2"))
+
+logger = logging.getLogger(__name__)
 
 #  Pydantic Models 
 class ReportFinding(BaseModel):
@@ -28,49 +52,210 @@ class ReportAnalysis(BaseModel):
         default="This is an AI-generated analysis. Please consult with a healthcare professional for medical advice."
     )
 
+class IndexedReportAnalysis(ReportAnalysis):
+    """Analysis of one report within a batched request"""
+    report_index: int = Field(description="Index of the report this analysis belongs to, as given in the REPORT header")
+
+class BatchReportAnalysis(BaseModel):
+    """Analyses for several reports returned from a single call"""
+    reports: List[IndexedReportAnalysis] = Field(description="One analysis per report, in the same order as the input")
+
+class ReportNarrative(BaseModel):
+    """Narrative part of an analysis whose findings were parsed locally"""
+    summary: str = Field(description="Overall summary of the report")
+    recommendations: List[str] = Field(description="Health recommendations based on findings")
+    concerns: List[str] = Field(description="Areas that need attention")
+
+class IndexedReportNarrative(ReportNarrative):
+    """Narrative for one report within a batched request"""
+    report_index: int = Field(description="Index of the report this narrative belongs to, as given in the REPORT header")
+
+class BatchReportNarrative(BaseModel):
+    """Narratives for several reports returned from a single call"""
+    reports: List[IndexedReportNarrative] = Field(description="One narrative per report, in the same order as the input")
+
+SYSTEM_PROMPT = """You are an expert medical AI assistant analyzing medical reports. 
+            You provide accurate, structured analysis in JSON format.
+            Always use simple, patient-friendly language and include appropriate medical disclaimers."""
+
 def extract_text_from_pdf(pdf_file) -> str:
     """Extract text from PDF file"""
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-            print(f"Extracted PDF text length: {len(text)}")  # ADD THIS
-            print(f"First 200 chars: {text[:200]}")  # ADD THIS
+        import PyPDF2
+        with stage("pdf_extract"):
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            text = ""
+            for page in pdf_reader.pages:
+                text += page.extract_text()
+        logger.debug(f"Extracted PDF text length: {len(text)}")
         return text
     except Exception as e:
-        print(f"Error extracting PDF text: {e}")
+        logger.error(f"Error extracting PDF text: {e}")
         return None
 
 def extract_text_from_image(image_file) -> str:
     """Extract text from image using OCR"""
     try:
-        image = Image.open(image_file)
-        text = pytesseract.image_to_string(image)
+        from PIL import Image
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+        with stage("ocr_extract"):
+            image = Image.open(image_file)
+            text = pytesseract.image_to_string(image)
         return text
     except Exception as e:
-        print(f"Error extracting image text: {e}")
+        logger.error(f"Error extracting image text: {e}")
+        return None
+
+# --- Local Findings + Narrative ---
+
+NARRATIVE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", """The results below were extracted from a {report_type} report and classified against their reference ranges.
+
+**Results:**
+{findings}
+
+**Other report text:**
+{context}
+
+**Instructions:**
+1. Provide an overall summary of the report
+2. Give practical health recommendations based on the findings
+3. Highlight any concerns that need immediate attention (every Critical result is one)
+4. Do not restate every value; the results table is shown to the patient separately
+
+**Important:** 
+- Use simple, patient-friendly language
+- If values are concerning, clearly state they need medical attention
+
+{format_instructions}
+""")
+])
+
+BATCH_NARRATIVE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", """Each report below starts with a "=== REPORT <index> ===" header and lists results already extracted
+and classified against their reference ranges, followed by any other report text.
+
+{reports}
+
+**Instructions (apply to every report):**
+1. Provide an overall summary of the report
+2. Give practical health recommendations based on the findings
+3. Highlight any concerns that need immediate attention (every Critical result is one)
+4. Set report_index to the index from the report's header
+
+**Important:** 
+- Return exactly one narrative per report, in the same order
+- Use simple, patient-friendly language
+- If values are concerning, clearly state they need medical attention
+
+{format_instructions}
+""")
+])
+
+def parse_findings(report_text: str) -> Dict | None:
+    """Locally parsed findings, or None when the report is not a tabular lab report"""
+    if not REPORT_LOCAL_PARSER:
+        return None
+    try:
+        with stage("lab_parse"):
+            parsed = parse_lab_report(report_text)
+    except Exception as e:
+        logger.error(f"Error parsing lab values: {e}")
         return None
+    return parsed if len(parsed["findings"]) >= REPORT_PARSER_MIN_FINDINGS else None
+
+def _results_block(parsed: Dict) -> str:
+    return "\n".join(
+        f"- {f['parameter']}: {f['value']} (ref {f['normal_range']}) {f['status']}" for f in parsed["findings"]
+    )
+
+def _local_narrative(parsed: Dict) -> ReportNarrative:
+    """Plain narrative when the LLM is unavailable; findings are still complete"""
+    abnormal = [f for f in parsed["findings"] if f["status"] != "Normal"]
+    if not abnormal:
+        summary = f"All {len(parsed['findings'])} results are within their reference ranges."
+    else:
+        summary = (f"{len(abnormal)} of {len(parsed['findings'])} results are outside their reference ranges: "
+                   + ", ".join(f"{f['parameter']} ({f['status']})" for f in abnormal) + ".")
+    concerns = [f"{f['parameter']} is at a critical level ({f['value']}); seek medical attention promptly."
+                for f in abnormal if f["status"] == "Critical"]
+    return ReportNarrative(
+        summary=summary,
+        recommendations=["Review these results with your doctor."] if abnormal else [],
+        concerns=concerns
+    )
+
+def _with_narrative(parsed: Dict, narrative: ReportNarrative) -> ReportAnalysis:
+    return ReportAnalysis(
+        report_type=parsed["report_type"],
+        findings=[ReportFinding(**f) for f in parsed["findings"]],
+        **narrative.dict()
+    )
+
+def generate_report_narrative(parsed: Dict) -> ReportAnalysis:
+    """Analysis from locally parsed findings; only the narrative comes from the LLM"""
+    try:
+        parser = RobustJsonOutputParser(pydantic_object=ReportNarrative)
+        result = router.invoke("report_narrative", NARRATIVE_PROMPT, {
+            "report_type": parsed["report_type"],
+            "findings": _results_block(parsed),
+            "context": parsed["context"] or "(none)",
+            "format_instructions": parser.get_format_instructions()
+        }, parser)
+        narrative = ReportNarrative(**result)
+    except Exception as e:
+        logger.error(f"Error generating report narrative: {e}")
+        narrative = _local_narrative(parsed)
+    return _with_narrative(parsed, narrative)
+
+def generate_report_narratives_batch(parsed: List[Dict]) -> List[ReportAnalysis]:
+    """Narratives for several locally parsed reports in one LLM call"""
+    if len(parsed) == 1:
+        return [generate_report_narrative(parsed[0])]
+
+    narratives: List[ReportNarrative | None] = [None] * len(parsed)
+    try:
+        parser = RobustJsonOutputParser(pydantic_object=BatchReportNarrative)
+        reports = "\n\n".join(
+            f"=== REPORT {idx} ===\nType: {p['report_type']}\n{_results_block(p)}"
+            + (f"\n{p['context']}" if p["context"] else "")
+            for idx, p in enumerate(parsed)
+        )
+        result = router.invoke("report_narrative", BATCH_NARRATIVE_PROMPT, {
+            "reports": reports,
+            "format_instructions": parser.get_format_instructions()
+        }, parser)
+        for item in BatchReportNarrative(**result).reports:
+            if 0 <= item.report_index < len(parsed) and narratives[item.report_index] is None:
+                narratives[item.report_index] = ReportNarrative(**item.dict(exclude={"report_index"}))
+    except Exception as e:
+        logger.error(f"Error during batch report narrative: {e}")
+
+    return [
+        _with_narrative(p, narrative) if narrative else generate_report_narrative(p)
+        for p, narrative in zip(parsed, narratives)
+    ]
+
+# --- Report Analysis ---
 
 def analyze_medical_report(report_text: str) -> ReportAnalysis | None:
     """
-    Analyzes medical report text using LangChain and provides structured analysis
+    Analyzes medical report text. Tabular lab reports are parsed locally and
+    only the narrative is generated; anything else gets full LLM analysis.
     """
-    
+    parsed = parse_findings(report_text)
+    if parsed is not None:
+        return generate_report_narrative(parsed)
+
     try:
-        llm = ChatGroq(
-            model="llama-3.3-70b-versatile",
-            temperature=0.3,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
-        
-        parser = JsonOutputParser(pydantic_object=ReportAnalysis)
+        parser = RobustJsonOutputParser(pydantic_object=ReportAnalysis)
         
 
         prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert medical AI assistant analyzing medical reports. 
-            You provide accurate, structured analysis in JSON format.
-            Always use simple, patient-friendly language and include appropriate medical disclaimers."""),
+            ("system", SYSTEM_PROMPT),
             ("human", """Analyze the following medical report and provide a structured analysis.
 
 **Medical Report:**
@@ -94,35 +279,220 @@ def analyze_medical_report(report_text: str) -> ReportAnalysis | None:
 """)
         ])
         
-        chain = prompt | llm | parser
-        
-        result = chain.invoke({
+        result = router.invoke("report_analysis", prompt, {
             "report_text": report_text,
             "format_instructions": parser.get_format_instructions()
-        })
+        }, parser)
         
         validated_analysis = ReportAnalysis(**result)
         
         return validated_analysis
         
     except Exception as e:
-        print(f"Error during report analysis: {e}")
+        logger.error(f"Error during report analysis: {e}")
         return None
 
+def extract_report_text(file_obj, file_type: str) -> str | None:
+    """Extract text from a PDF or image file object"""
+    if file_type == 'pdf':
+        return extract_text_from_pdf(file_obj)
+    if file_type in ['jpg', 'jpeg', 'png']:
+        return extract_text_from_image(file_obj)
+    return None
+
+def estimate_output_tokens(text: str) -> int:
+    """Rough size of a report's analysis: one finding per line carrying a number"""
+    rows = sum(1 for line in text.splitlines() if any(c.isdigit() for c in line))
+    return OUTPUT_TOKENS_PER_REPORT + OUTPUT_TOKENS_PER_FINDING * rows
+
+def pack_reports(texts: List[str], token_budget: int = BATCH_INPUT_TOKEN_BUDGET,
+                 output_budget: int = BATCH_OUTPUT_TOKEN_BUDGET,
+                 max_reports: int = BATCH_MAX_REPORTS) -> List[List[int]]:
+    """
+    Greedily pack report indices into groups of at most `max_reports` whose
+    combined text fits the input token budget and whose estimated analyses
+    fit the output budget. A report over either budget gets a group of its own.
+    """
+    groups, current, used, produced = [], [], 0, 0
+    for idx, text in enumerate(texts):
+        cost = len(text) // CHARS_PER_TOKEN + 1
+        output = estimate_output_tokens(text)
+        if current and (used + cost > token_budget or produced + output > output_budget
+                        or len(current) >= max_reports):
+            groups.append(current)
+            current, used, produced = [], 0, 0
+        current.append(idx)
+        used += cost
+        produced += output
+    if current:
+        groups.append(current)
+    return groups
+
+def analyze_medical_reports_batch(texts: List[str]) -> List[ReportAnalysis | None]:
+    """
+    Analyzes several report texts, returning analyses in input order. Lab
+    reports the local parser handles share one narrative call; the rest share
+    one full analysis call.
+    """
+    parsed = [parse_findings(text) for text in texts]
+    local = [idx for idx, p in enumerate(parsed) if p is not None]
+    remote = [idx for idx, p in enumerate(parsed) if p is None]
+
+    analyses: List[ReportAnalysis | None] = [None] * len(texts)
+    if local:
+        for idx, analysis in zip(local, generate_report_narratives_batch([parsed[idx] for idx in local])):
+            analyses[idx] = analysis
+    if remote:
+        for idx, analysis in zip(remote, _analyze_reports_llm([texts[idx] for idx in remote])):
+            analyses[idx] = analysis
+    return analyses
+
+def _analyze_reports_llm(texts: List[str]) -> List[ReportAnalysis | None]:
+    """
+    Full analysis of several report texts in one LLM call. Reports missing
+    from the batched response are re-analyzed one by one.
+    """
+    if len(texts) == 1:
+        return [analyze_medical_report(texts[0])]
+
+    analyses: List[ReportAnalysis | None] = [None] * len(texts)
+    try:
+        parser = RobustJsonOutputParser(pydantic_object=BatchReportAnalysis)
+
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", SYSTEM_PROMPT),
+            ("human", """Analyze each of the following medical reports separately and provide a structured analysis for each one.
+Each report starts with a "=== REPORT <index> ===" header.
+
+{reports}
+
+**Instructions (apply to every report):**
+1. Identify the type of report (blood test, lipid profile, liver function, etc.)
+2. Extract all test parameters with their values and normal ranges
+3. Classify each parameter as Normal, High, Low, or Critical
+4. Provide an overall summary of the report
+5. Give practical health recommendations based on the findings
+6. Highlight any concerns that need immediate attention
+7. Set report_index to the index from the report's header
+
+**Important:** 
+- Return exactly one analysis per report, in the same order
+- Be accurate with medical values
+- Use simple, patient-friendly language
+- If values are concerning, clearly state they need medical attention
+
+{format_instructions}
+""")
+        ])
+
+        reports = "\n\n".join(f"=== REPORT {idx} ===\n{text}" for idx, text in enumerate(texts))
+        result = router.invoke("report_analysis", prompt, {
+            "reports": reports,
+            "format_instructions": parser.get_format_instructions()
+        }, parser)
+
+        for item in BatchReportAnalysis(**result).reports:
+            if 0 <= item.report_index < len(texts) and analyses[item.report_index] is None:
+                analyses[item.report_index] = ReportAnalysis(**item.dict(exclude={"report_index"}))
+
+    except Exception as e:
+        logger.error(f"Error during batch report analysis: {e}")
+
+    for idx, analysis in enumerate(analyses):
+        if analysis is None:
+            analyses[idx] = analyze_medical_report(texts[idx])
+    return analyses
+
+def merge_findings(analyses: List[Dict]) -> Dict:
+    """
+    Merged view across a batch: every finding tagged with its source file,
+    abnormal findings pulled out, and recommendations/concerns de-duplicated.
+    """
+    findings, abnormal, recommendations, concerns = [], [], [], []
+    seen_recommendations, seen_concerns = set(), set()
+
+    for item in analyses:
+        analysis = item.get("analysis")
+        if not analysis:
+            continue
+        for finding in analysis["findings"]:
+            entry = {**finding, "fileName": item["fileName"], "reportType": analysis["report_type"]}
+            findings.append(entry)
+            if finding["status"].strip().lower() != "normal":
+                abnormal.append(entry)
+        for text in analysis["recommendations"]:
+            if text.strip().lower() not in seen_recommendations:
+                seen_recommendations.add(text.strip().lower())
+                recommendations.append(text)
+        for text in analysis["concerns"]:
+            if text.strip().lower() not in seen_concerns:
+                seen_concerns.add(text.strip().lower())
+                concerns.append(text)
+
+    return {
+        "findings": findings,
+        "abnormal_findings": abnormal,
+        "recommendations": recommendations,
+        "concerns": concerns
+    }
+
 async def process_report_file(file, file_type: str) -> dict:
     """
     Main function to process uploaded report file
     """
-    if file_type == 'pdf':
-        text = extract_text_from_pdf(file.file)
-    elif file_type in ['jpg', 'jpeg', 'png']:
-        text = extract_text_from_image(file.file)
-    else:
+    if file_type not in ['pdf', 'jpg', 'jpeg', 'png']:
         return {"error": "Unsupported file type"}
+
+    # OCR and the LLM call block; keep them off the event loop
+    text = await asyncio.to_thread(extract_report_text, file.file, file_type)
+    if not text:
+        return {"error": "Could not extract text from report"}
     
-    analysis = analyze_medical_report(text)
+    analysis = await asyncio.to_thread(analyze_medical_report, text)
+    if not analysis:
+        return {"error": "Failed to analyze report"}
     
     return {
         "success": True,
         "analysis": analysis.dict()
+    }
+
+async def process_report_files(files: List, file_types: List[str]) -> dict:
+    """
+    Process several uploaded report files: extract text from all of them in
+    parallel, then analyze them in as few LLM calls as the token budget allows.
+    """
+    texts: List[Optional[str]] = await asyncio.gather(*[
+        asyncio.to_thread(extract_report_text, f.file, file_type)
+        for f, file_type in zip(files, file_types)
+    ])
+
+    readable = [idx for idx, text in enumerate(texts) if text]
+    groups = pack_reports([texts[idx] for idx in readable])
+    group_results = await asyncio.gather(*[
+        asyncio.to_thread(analyze_medical_reports_batch, [texts[readable[i]] for i in group])
+        for group in groups
+    ])
+
+    analyses: Dict[int, ReportAnalysis | None] = {}
+    for group, results in zip(groups, group_results):
+        for i, analysis in zip(group, results):
+            analyses[readable[i]] = analysis
+
+    reports = []
+    for idx, f in enumerate(files):
+        item = {"fileName": f.filename, "fileType": file_types[idx]}
+        if not texts[idx]:
+            item["error"] = "Could not extract text from report"
+        elif not analyses.get(idx):
+            item["error"] = "Failed to analyze report"
+        else:
+            item["analysis"] = analyses[idx].dict()
+        reports.append(item)
+
+    return {
+        "success": any("analysis" in item for item in reports),
+        "reports": reports,
+        "merged": merge_findings(reports),
+        "batches": len(groups)
     }
\ No newline at end of file
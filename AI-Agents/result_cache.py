@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# --- Result Cache ---
+# Stage results that do not depend on the patient: Whisper transcriptions keyed
+# by the normalized audio fingerprint, consultation summaries keyed by the
+# transcription hash. Both backends evict least-recently-used entries once the
+# stored values exceed RESULT_CACHE_MAX_MB. Cached values are patient
+# transcripts and summaries, so caching is off unless RESULT_CACHE names a
+# backend, and the SQLite backend needs an explicit path.
+
+RESULT_CACHE_MAX_BYTES = int(float(os.getenv("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+
+def text_fingerprint(text: str) -> str:
+    """Whitespace-insensitive hash of a transcription"""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class MemoryResultCache:
+    """Process-local LRU; lost on restart"""
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+    async def get(self, namespace: str, key: str) -> Optional[str]:
+        value = self._entries.get((namespace, key))
+        if value is not None:
+            self._entries.move_to_end((namespace, key))
+        return value
+
+    async def put(self, namespace: str, key: str, value: str):
+        old = self._entries.pop((namespace, key), None)
+        self.size += len(value) - (len(old) if old is not None else 0)
+        self._entries[(namespace, key)] = value
+        while self.size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "bytes": self.size, "max_bytes": self.max_bytes}
+
+
+class SQLiteResultCache:
+    """SQLite-backed LRU so cached transcriptions survive restarts (shared by server workers)"""
+
+    def __init__(self, path: str, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    used_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_used_at ON results(used_at)")
+            self._conn.commit()
+
+    def _get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM results WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row:
+                self._conn.execute(
+                    "UPDATE results SET used_at = ? WHERE namespace = ? AND key = ?", (time.time(), namespace, key)
+                )
+                self._conn.commit()
+        return row[0] if row else None
+
+    def _put(self, namespace: str, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (namespace, key, value, size, used_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, value, len(value), time.time())
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk from the least recently used until enough is freed
+                excess, cutoff = total - self.max_bytes, None
+                for used_at, size in self._conn.execute("SELECT used_at, size FROM results ORDER BY used_at"):
+                    excess -= size
+                    cutoff = used_at
+                    if excess <= 0:
+                        break
+                self._conn.execute("DELETE FROM results WHERE used_at <= ?", (cutoff,))
+            self._conn.commit()
+
+    def _stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+    async def get(self, namespace: str, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, namespace, key)
+
+    async def put(self, namespace: str, key: str, value: str):
+        await asyncio.to_thread(self._put, namespace, key, value)
+
+    async def stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._stats)
+
+
+class ResultCache:
+    """JSON values over a store, with hit/miss counting per namespace (stage)"""
+
+    def __init__(self, store=None):
+        self.store = store
+        self._configured = store is not None
+
+    def configure(self, spec: Optional[str] = None):
+        """(Re)build the store from a RESULT_CACHE spec; 'off' disables caching"""
+        self.store = create_store(spec)
+        self._configured = True
+
+    def _store(self):
+        if not self._configured:
+            self.configure()
+        return self.store
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        if self._store() is None:
+            return None
+        try:
+            value = await self.store.get(namespace, key)
+        except Exception as e:
+            logger.warning(f"Result cache read failed ({namespace}): {e}")
+            value = None
+        CACHE_LOOKUPS.labels(namespace, "hit" if value is not None else "miss").inc()
+        return json.loads(value) if value is not None else None
+
+    async def put(self, namespace: str, key: str, value: Any):
+        if self._store() is None:
+            return
+        try:
+            await self.store.put(namespace, key, json.dumps(value))
+        except Exception as e:
+            logger.warning(f"Result cache write failed ({namespace}): {e}")
+
+    async def stats(self) -> Dict[str, Any]:
+        return await self.store.stats() if self._store() is not None else {"enabled": False}
+
+
+def create_store(spec: Optional[str] = None):
+    """Build a store from RESULT_CACHE: 'off' (default), 'memory' or 'sqlite:<path>'"""
+    spec = spec or os.getenv("RESULT_CACHE", "off")
+    if spec == "off":
+        return None
+    if spec == "memory":
+        return MemoryResultCache()
+    if spec.startswith("sqlite:"):
+        path = spec[len("sqlite:"):]
+        if not path:
+            raise ValueError("RESULT_CACHE=sqlite:<path> needs a database path")
+        return SQLiteResultCache(path)
+    raise ValueError(f"Unknown RESULT_CACHE '{spec}'")
+
+
+result_cache = ResultCache()
@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DATA_PATH = os.getenv(
+    "CLINICAL_SAFETY_DATA",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "clinical_safety.json")
+)
+
+# Issues at these severities (and every allergy hit) make a prescription unsafe
+BLOCKING_SEVERITIES = {"major", "contraindicated"}
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase, punctuation to spaces, single-spaced"""
+    return _NON_ALNUM.sub(" ", str(text).lower()).strip()
+
+
+# --- Name Trie ---
+
+class NameTrie:
+    """
+    Character trie over normalized drug, brand and class names. find_all()
+    scans free text ("Tab. Augmentin 625 Duo") and returns the union of keys
+    for every longest, word-aligned match, so combinations resolve to all
+    their components.
+    """
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+
+    def insert(self, name: str, keys: Iterable[str]):
+        node = self.root
+        for char in normalize(name):
+            node = node.setdefault(char, {})
+        node.setdefault("$", set()).update(keys)
+
+    def find_all(self, text: str) -> Set[str]:
+        text = normalize(text)
+        found: Set[str] = set()
+        i, n = 0, len(text)
+        while i < n:
+            node, match_end, match_keys = self.root, -1, None
+            j = i
+            while j < n and text[j] in node:
+                node = node[text[j]]
+                j += 1
+                if "$" in node and (j == n or text[j] == " "):
+                    match_end, match_keys = j, node["$"]
+            if match_keys:
+                found.update(match_keys)
+                i = match_end
+            else:
+                space = text.find(" ", i)
+                if space < 0:
+                    break
+                i = space
+            i += 1  # skip the separating space
+        return found
+
+
+# --- Safety Index ---
+
+class SafetyIndex:
+    """
+    In-memory interaction and allergy index. Every drug resolves to a key set
+    (its generic name plus its classes); interactions are stored in both
+    directions as key -> {partner key: interaction} so checking a medicine is
+    one hash lookup per key rather than a scan over every pair.
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self.version = data.get("version")
+        self.rank = {s: i for i, s in enumerate(data.get("severity_order", ["minor", "moderate", "major", "contraindicated"]))}
+        self.trie = NameTrie()
+        self.drug_keys: Dict[str, FrozenSet[str]] = {}
+        self.interactions: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self.cross_reactivity: Dict[str, Dict[str, Dict[str, str]]] = {}
+
+        for generic, info in data.get("drugs", {}).items():
+            keys = frozenset([generic, *info.get("classes", [])])
+            self.drug_keys[generic] = keys
+            for name in [generic, *info.get("aliases", [])]:
+                self.trie.insert(name, keys)
+        for term, keys in data.get("allergy_terms", {}).items():
+            self.trie.insert(term, keys)
+        # Medication names repeat across requests; cache name -> keys
+        self._lookup = lru_cache(maxsize=8192)(lambda name: frozenset(self.trie.find_all(name)))
+
+        for rule in data.get("interactions", []):
+            record = {"severity": rule["severity"], "effect": rule["effect"]}
+            self.interactions.setdefault(rule["a"], {})[rule["b"]] = record
+            self.interactions.setdefault(rule["b"], {})[rule["a"]] = record
+
+        for rule in data.get("cross_reactivity", []):
+            self.cross_reactivity.setdefault(rule["allergy"], {})[rule["drug"]] = {
+                "severity": rule["severity"], "effect": rule["effect"]
+            }
+
+    @classmethod
+    def load(cls, path: str = DATA_PATH) -> "SafetyIndex":
+        start = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            index = cls(json.load(f))
+        logger.info(f"Clinical safety index {index.version} built in {(time.perf_counter() - start) * 1000:.1f}ms "
+                    f"({len(index.drug_keys)} drugs)")
+        return index
+
+    def resolve(self, *names: Optional[str]) -> Set[str]:
+        """Keys for a medicine given any of its names (generic name, brand, free text)"""
+        keys: Set[str] = set()
+        for name in names:
+            if name:
+                keys |= self._lookup(name)
+        return keys
+
+    def _generics(self, keys: Set[str]) -> Set[str]:
+        return {k for k in keys if k in self.drug_keys}
+
+    def validate(self, medicines: List[Dict[str, Any]], current_medications: List[Any],
+                 allergies: List[Any]) -> Dict[str, Any]:
+        """
+        Check prescribed medicines against the patient's current medications,
+        allergies and each other. Returns the issue list plus the indexes of
+        medicines with blocking issues.
+        """
+        start = time.perf_counter()
+        issues: List[Dict[str, Any]] = []
+        unrecognized: List[str] = []
+
+        allergy_keys: Dict[str, str] = {}
+        for allergy in allergies or []:
+            label = allergy.get("allergen") if isinstance(allergy, dict) else allergy
+            for key in self.resolve(label):
+                allergy_keys.setdefault(key, label)
+
+        # key -> [(label, source, generics)] for everything already on board
+        present: Dict[str, List[tuple]] = {}
+        current_generics: Set[str] = set()
+        for med in current_medications or []:
+            label = med.get("name") if isinstance(med, dict) else med
+            keys = self.resolve(label)
+            generics = self._generics(keys)
+            current_generics |= generics
+            for key in keys:
+                present.setdefault(key, []).append((label, "current", generics))
+
+        # generic -> label of the earlier prescribed medicine that contains it
+        prescribed_generics: Dict[str, str] = {}
+        for index, med in enumerate(medicines):
+            label = med.get("name") or med.get("generic_name") or f"medicine {index}"
+            keys = self.resolve(med.get("generic_name"), med.get("name"))
+            if not keys:
+                unrecognized.append(label)
+                continue
+            generics = self._generics(keys)
+
+            for key in keys:
+                if key in allergy_keys:
+                    issues.append({
+                        "type": "allergy", "severity": "contraindicated", "medicine": label, "medicine_index": index,
+                        "with": allergy_keys[key], "effect": f"Patient is allergic to {allergy_keys[key]}"
+                    })
+                    break
+            for allergy_key, allergen in allergy_keys.items():
+                for key, rule in self.cross_reactivity.get(allergy_key, {}).items():
+                    if key in keys and allergy_key not in keys:
+                        issues.append({
+                            "type": "allergy_cross_reactivity", "severity": rule["severity"], "medicine": label,
+                            "medicine_index": index, "with": allergen, "effect": rule["effect"]
+                        })
+
+            for generic in generics & current_generics:
+                issues.append({
+                    "type": "duplicate_therapy", "severity": "moderate", "medicine": label, "medicine_index": index,
+                    "with": generic, "effect": "Already in the patient's current medications"
+                })
+            # e.g. Combiflam and Dolo together: two doses of paracetamol
+            for generic in sorted(generics & prescribed_generics.keys()):
+                issues.append({
+                    "type": "duplicate_therapy", "severity": "moderate", "medicine": label, "medicine_index": index,
+                    "with": prescribed_generics[generic], "with_source": "prescribed",
+                    "effect": f"Contains {generic}, also in {prescribed_generics[generic]} in this prescription"
+                })
+
+            # One issue per partner medicine, keeping the most severe rule
+            worst: Dict[tuple, Dict[str, Any]] = {}
+            for key in keys:
+                for partner_key, rule in self.interactions.get(key, {}).items():
+                    for other_label, source, other_generics in present.get(partner_key, ()):
+                        if other_generics and other_generics <= generics:
+                            continue  # same drug, not an interaction
+                        pair = (other_label, source)
+                        if pair not in worst or self.rank[rule["severity"]] > self.rank[worst[pair]["severity"]]:
+                            worst[pair] = {
+                                "type": "interaction", "severity": rule["severity"], "medicine": label,
+                                "medicine_index": index, "with": other_label, "with_source": source,
+                                "effect": rule["effect"]
+                            }
+            issues.extend(worst.values())
+
+            for key in keys:
+                present.setdefault(key, []).append((label, "prescribed", generics))
+            for generic in generics:
+                prescribed_generics.setdefault(generic, label)
+
+        blocking = sorted({
+            i["medicine_index"] for i in issues
+            if i["type"] == "allergy" or i["severity"] in BLOCKING_SEVERITIES
+        })
+        return {
+            "safe": not blocking,
+            "issues": issues,
+            "blocking_indexes": blocking,
+            "unrecognized": unrecognized,
+            "index_version": self.version,
+            "latency_us": round((time.perf_counter() - start) * 1e6, 1)
+        }
+
+
+_index: Optional[SafetyIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_safety_index() -> SafetyIndex:
+    """Process-wide index, built on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SafetyIndex.load()
+    return _index
+
+
+def validate_prescription(prescription: Dict[str, Any], patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a PrescriptionData dict against the patient's onboarding record"""
+    current_health = (patient_data or {}).get("currentHealthStatus", {}) or {}
+    return get_safety_index().validate(
+        prescription.get("medicines", []),
+        current_health.get("currentMedications", []),
+        current_health.get("allergies", [])
+    )
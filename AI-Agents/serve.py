@@ -0,0 +1,251 @@
+"""
+Production entry point for the AI service.
+
+Imports the app and its read-only resources once in a supervisor process,
+freezes them out of the garbage collector, then forks uvicorn workers that
+share those pages copy-on-write and accept on one listening socket. SIGTERM
+drains gracefully: workers stop accepting, finish in-flight requests, running
+jobs and outstanding LLM calls, then exit. Dead workers are replaced.
+
+    python serve.py                           # one worker per usable core
+    WEB_CONCURRENCY=4 WORKER_CONCURRENCY=64 python serve.py --port 8000
+
+`python app.py` remains the single-process auto-reload dev server.
+"""
+import os
+import gc
+import time
+import socket
+import shutil
+import signal
+import logging
+import argparse
+import importlib
+import tempfile
+from typing import Callable, Dict, List
+
+import uvicorn
+
+logger = logging.getLogger("serve")
+
+
+def usable_cores() -> int:
+    """CPUs this process may run on (respects container/affinity limits)"""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# --- Preload ---
+# Read-only resources built once before forking. Network clients (Groq,
+# Gemini, Motor) and the tracing exporter are deliberately not here: they are
+# created in each worker (lazily, or in the app's lifespan) because sockets,
+# pools and exporter threads do not survive fork.
+
+def _handler_modules():
+    # LangChain, the Groq SDK, PDF/OCR libraries and Motor, which app.py only
+    # imports lazily; loading them here lets workers share the pages
+    from lazy_imports import warm_up
+    warm_up()
+
+
+def _safety_index():
+    from safety_index import get_safety_index
+    get_safety_index()
+
+
+def _lab_reference():
+    from lab_parser import get_lab_reference
+    get_lab_reference()
+
+
+def _ner_models():
+    # Model weights are the largest read-only resource; only load them when used
+    if os.getenv("ENTITY_BACKEND", "llm") == "ner":
+        from medical_ner import load_pipelines
+        load_pipelines()
+
+
+PRELOAD_HOOKS: List[Callable[[], None]] = [_handler_modules, _safety_index, _lab_reference, _ner_models]
+
+# Stores whose "memory" backend lives in one process. Behind several workers
+# each would keep its own share: interview turns, job status polls, quota
+# windows and cache entries would land on workers that never saw the rest.
+PROCESS_LOCAL_STORES = ["ENTITY_LEDGER_STORE", "JOB_STORE", "QUOTA_STORE", "RESULT_CACHE", "FINDINGS_STORE"]
+
+
+def preload(app_path: str):
+    start = time.perf_counter()
+    module_name, _, attr = app_path.partition(":")
+    app = getattr(importlib.import_module(module_name), attr or "app")
+    for hook in PRELOAD_HOOKS:
+        hook_start = time.perf_counter()
+        hook()
+        logger.info(f"Preloaded {hook.__name__.lstrip('_')} in {(time.perf_counter() - hook_start) * 1000:.1f}ms")
+    # Keep the collector from touching (and so copying) preloaded objects in workers
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Preloaded {app_path} in {time.perf_counter() - start:.2f}s")
+    return app
+
+
+# --- Supervisor ---
+
+class Supervisor:
+    """Pre-fork process manager around uvicorn.Server"""
+
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.workers: Dict[int, int] = {}  # pid -> worker id
+        self.stopping = False
+        self.sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((args.host, args.port))
+        self.sock.listen(args.backlog)
+        self.sock.set_inheritable(True)
+
+    def spawn(self, worker_id: int):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = worker_id
+            return
+        # Worker process
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        os.environ["WORKER_ID"] = str(worker_id)
+        config = uvicorn.Config(
+            self.app,
+            limit_concurrency=self.args.worker_concurrency or None,
+            limit_max_requests=self.args.max_requests or None,
+            timeout_keep_alive=self.args.keepalive,
+            timeout_graceful_shutdown=self.args.graceful_timeout,
+            access_log=self.args.access_log,
+            lifespan="on",
+        )
+        code = 0
+        try:
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except Exception:
+            logger.exception(f"Worker {worker_id} crashed")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def reap(self) -> List[int]:
+        """Collect exited workers; returns their worker ids"""
+        exited = []
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            worker_id = self.workers.pop(pid, None)
+            if worker_id is None:
+                continue
+            if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+                from prometheus_client import multiprocess
+                multiprocess.mark_process_dead(pid)
+            if not self.stopping:
+                logger.warning(f"Worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}")
+            exited.append(worker_id)
+        return exited
+
+    def stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info(f"Received {signal.Signals(signum).name}, draining {len(self.workers)} worker(s)")
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker_id in range(self.args.workers):
+            self.spawn(worker_id)
+        logger.info(f"Serving on {self.args.host}:{self.args.port} with {self.args.workers} worker(s), "
+                    f"{self.args.worker_concurrency or 'unlimited'} concurrent requests each")
+
+        deadline = None
+        while self.workers:
+            for worker_id in self.reap():
+                if not self.stopping:
+                    self.spawn(worker_id)
+            if self.stopping:
+                # Requests, jobs and LLM calls each get graceful_timeout; then force it
+                deadline = deadline or time.monotonic() + self.args.graceful_timeout * 3 + 5
+                if time.monotonic() > deadline:
+                    logger.warning(f"Killing {len(self.workers)} worker(s) that did not drain in time")
+                    for pid in list(self.workers):
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    deadline = float("inf")
+            time.sleep(0.2)
+        self.sock.close()
+        logger.info("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app:app", help="Import path of the ASGI app")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=_env_int("PORT", 8000))
+    parser.add_argument("--workers", type=int, default=_env_int("WEB_CONCURRENCY", usable_cores()),
+                        help="Worker processes (WEB_CONCURRENCY; default: usable cores)")
+    parser.add_argument("--worker-concurrency", type=int, default=_env_int("WORKER_CONCURRENCY", 100),
+                        help="Max concurrent requests per worker before answering 503; 0 = unlimited")
+    parser.add_argument("--max-requests", type=int, default=_env_int("WORKER_MAX_REQUESTS", 0),
+                        help="Recycle a worker after this many requests; 0 = never")
+    parser.add_argument("--backlog", type=int, default=_env_int("WORKER_BACKLOG", 2048))
+    parser.add_argument("--keepalive", type=int, default=_env_int("KEEPALIVE_TIMEOUT", 5))
+    parser.add_argument("--graceful-timeout", type=int, default=_env_int("GRACEFUL_TIMEOUT", 30),
+                        help="Seconds each shutdown phase may take to drain")
+    parser.add_argument("--access-log", action="store_true", help="uvicorn access log (the app already logs requests)")
+    args = parser.parse_args()
+    from dotenv import load_dotenv
+    load_dotenv()  # the store specs below may come from .env, which app.py would only load later
+    local = [name for name in PROCESS_LOCAL_STORES if "memory" in os.getenv(name, "").split(",")]
+    if args.workers > 1 and local:
+        parser.error(f"{', '.join(local)}=memory is per process; use a sqlite: store (or off) with more than one worker")
+
+    # Drain budgets for jobs and LLM calls follow the launcher's timeout
+    os.environ.setdefault("JOB_DRAIN_TIMEOUT", str(args.graceful_timeout))
+    os.environ.setdefault("LLM_DRAIN_TIMEOUT", str(args.graceful_timeout))
+
+    if not hasattr(os, "fork"):
+        # No fork on Windows: plain uvicorn workers, without preloading
+        logger.warning("fork() unavailable; starting uvicorn workers without preload")
+        uvicorn.run(args.app, host=args.host, port=args.port, workers=args.workers,
+                    limit_concurrency=args.worker_concurrency or None,
+                    timeout_graceful_shutdown=args.graceful_timeout)
+        return
+
+    metrics_dir = None
+    if args.workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Must be set before prometheus_client is imported so /metrics covers every worker
+        metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="telemed-metrics-")
+
+    app = preload(args.app)
+    try:
+        Supervisor(app, args).run()
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
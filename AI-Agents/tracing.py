@@ -0,0 +1,120 @@
+import os
+import json
+import logging
+from contextlib import nullcontext
+
+# --- Opt-in OpenTelemetry Tracing ---
+# Disabled unless TRACING_EXPORTER is set to one of:
+#   otlp    - OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+#   file    - JSON lines appended to TRACING_FILE (default traces.jsonl)
+#   console - pretty-printed spans on stdout
+# When disabled (or opentelemetry is not installed) span() returns a shared
+# no-op context manager, so instrumented code pays only a function call.
+
+logger = logging.getLogger(__name__)
+
+_NOOP = nullcontext()
+_tracer = None
+_provider = None
+
+
+def _file_exporter(path: str):
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    class JsonLinesSpanExporter(SpanExporter):
+        """Write finished spans as JSON lines for offline inspection"""
+
+        def __init__(self, path: str):
+            self._file = open(path, "a", buffering=1)
+
+        def export(self, spans):
+            for s in spans:
+                self._file.write(json.dumps({
+                    "name": s.name,
+                    "trace_id": format(s.context.trace_id, "032x"),
+                    "span_id": format(s.context.span_id, "016x"),
+                    "parent_id": format(s.parent.span_id, "016x") if s.parent else None,
+                    "start_ns": s.start_time,
+                    "duration_ms": (s.end_time - s.start_time) / 1e6,
+                    "status": s.status.status_code.name,
+                    "attributes": dict(s.attributes or {}),
+                }) + "\n")
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self):
+            self._file.close()
+
+    return JsonLinesSpanExporter(path)
+
+
+def configure(exporter: str | None = None, service_name: str = "telemedai-ai"):
+    """Set up the tracer provider from TRACING_EXPORTER; a no-op when unset"""
+    global _tracer, _provider
+    exporter = (exporter or os.getenv("TRACING_EXPORTER", "")).lower()
+    if exporter in ("", "none", "off"):
+        _tracer = None
+        return
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        logger.warning("TRACING_EXPORTER is set but opentelemetry-sdk is not installed; tracing disabled")
+        return
+
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        span_exporter = OTLPSpanExporter()
+    elif exporter == "file":
+        span_exporter = _file_exporter(os.getenv("TRACING_FILE", "traces.jsonl"))
+    elif exporter == "console":
+        span_exporter = ConsoleSpanExporter()
+    else:
+        logger.warning(f"Unknown TRACING_EXPORTER '{exporter}'; tracing disabled")
+        return
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(provider)
+    # From this provider, not the global one, which can only be set once per process
+    _tracer = provider.get_tracer("telemedai")
+    _provider = provider
+
+    try:
+        from opentelemetry.instrumentation.pymongo import PymongoInstrumentor
+        PymongoInstrumentor().instrument()
+    except ImportError:
+        pass
+
+    logger.info(f"Tracing enabled with '{exporter}' exporter")
+
+
+def shutdown():
+    """Flush buffered spans; serve.py workers leave via os._exit, which skips atexit"""
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = _provider = None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **attributes):
+    """Context manager for a child span of the current one"""
+    if _tracer is None:
+        return _NOOP
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+def set_attributes(**attributes):
+    """Attach attributes (model, token counts, cache hits...) to the current span"""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    trace.get_current_span().set_attributes(
+        {k: v for k, v in attributes.items() if v is not None}
+    )